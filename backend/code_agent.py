@@ -2,60 +2,119 @@
 WatchFace Code Agent - Core Implementation
 真正的Coding Agent，支持完整代码生成和智能代码编辑
 """
-from openai import OpenAI
-import difflib
+from openai import AsyncOpenAI
+import asyncio
+import logging
+import httpx
 import re
-from datetime import datetime
-from typing import Dict, List, Optional
+import time
+from contextlib import nullcontext
+from typing import AsyncContextManager, AsyncIterator, Callable, Dict, List, Optional, Tuple
 from config import settings
-from logging_config import get_logger
-from prompts.system_prompt import WATCHFACE_SYSTEM_PROMPT
-from prompts.user_prompt import build_generation_prompt, build_edit_prompt
+from logging_config import get_logger, log_payload
+from utils.generation_cache import generation_cache
+from utils.code_patch import parse_search_replace_blocks, apply_search_replace_blocks, PatchApplyError
+from utils.context_slicer import build_sliced_context
+from utils.token_budget import token_budget, estimate_tokens
+from utils.hedging import hedger
+from utils.llm_transport import llm_transport, build_timeout, CircuitOpenError
+from utils.llm_cassette import llm_cassette
+from utils.stream_extractor import StreamCodeExtractor, MalformedOutputError
+from utils.think_filter import ThinkSplitter, split_think
+from utils.line_diff import compute_line_diff
+from utils.metrics import metrics
+from utils.tracing import tracer, traced
+from utils.usage_tracker import empty_usage, merge_usage
+from utils.model_router import model_router, current_route
+from prompts.system_prompt import CONVERSATION_SUMMARY_SYSTEM_PROMPT
+from prompts.user_prompt import build_generation_prompt, build_edit_prompt, build_summary_prompt
+from targets import OutputTarget, get_target
 
 # Initialize logger
 logger = get_logger()
 
 
 class WatchFaceCodeAgent:
-    """手表表盘Code Agent - 真正的代码生成和编辑"""
+    """
+    手表表盘Code Agent - 真正的代码生成和编辑
     
-    def __init__(self, api_key: Optional[str] = None, client_id: Optional[str] = None):
+    传输、流式输出、缓存、代码提取、差异计算由引擎统一实现，
+    与代码格式相关的部分（提示词、提取/校验规则、入口文件）由输出目标（targets）提供
+    """
+    
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        client_id: Optional[str] = None,
+        http_client: Optional[httpx.AsyncClient] = None,
+        target: str = "html"
+    ):
         """
         初始化Code Agent
         
         Args:
             api_key: 可选的API Key（如果提供则使用，否则使用默认配置）
             client_id: 客户端ID（用于日志记录）
+            http_client: 可选的共享HTTP客户端（由LLMClientPool提供，复用连接池）
+            target: 输出目标（html / ux），未知目标抛出ValueError
         """
+        self.target: OutputTarget = get_target(target)
+        
         # 使用提供的API Key或默认配置
         actual_api_key = api_key or settings.minimax_api_key
         
         if not actual_api_key:
             raise ValueError("No API Key provided and MINIMAX_API_KEY not configured")
         
-        # 配置MiniMax-M2客户端（设置较长的超时时间）
-        self.llm = OpenAI(
+        # 配置MiniMax-M2异步客户端（连接超时短、读取超时长 - AI代码生成可能需要较长时间）
+        # 注意：必须使用AsyncOpenAI，同步客户端会阻塞事件循环，导致其他接口在生成期间全部卡住
+        # 重试由llm_transport统一负责（分类重试+熔断），关闭SDK自带的重试
+        self.llm = AsyncOpenAI(
             base_url=settings.minimax_base_url,
             api_key=actual_api_key,
-            timeout=180.0  # 3分钟超时 - AI代码生成可能需要较长时间
+            timeout=build_timeout(),
+            max_retries=0,
+            http_client=http_client
         )
         
-        self.model = settings.minimax_model
-        self.temperature = settings.default_temperature
+        # 默认模型参数（当前请求的路由档位可覆盖，见model / temperature / enable_reasoning）
+        self.default_model = settings.minimax_model
+        self.default_temperature = settings.default_temperature
+        self.default_reasoning = settings.enable_reasoning
         self.max_tokens = settings.max_tokens
-        self.enable_reasoning = settings.enable_reasoning
         self.client_id = client_id
         
         key_source = f"客户端 {client_id[:16] if client_id else 'default'}..." if api_key else "默认配置"
-        print(f"✅ Code Agent initialized with {self.model} (Key来源: {key_source})")
+        logger.info(f"✅ Code Agent initialized with {self.model} (Key来源: {key_source}, 输出目标: {self.target.name})")
+    
+    @property
+    def model(self) -> str:
+        """当前请求使用的模型（路由档位优先）"""
+        route = current_route()
+        return route.model if route and route.model else self.default_model
+    
+    @property
+    def temperature(self) -> float:
+        """当前请求使用的temperature（路由档位优先）"""
+        route = current_route()
+        return route.temperature if route and route.temperature is not None else self.default_temperature
+    
+    @property
+    def enable_reasoning(self) -> bool:
+        """当前请求是否拆分思考过程（reasoning_split，路由档位优先）"""
+        route = current_route()
+        return route.reasoning if route and route.reasoning is not None else self.default_reasoning
     
+    @traced("agent.process_instruction")
     async def process_instruction(
         self, 
         user_input: str, 
         current_code: Optional[str] = None,
         conversation_history: Optional[List[Dict]] = None,
         assets = None,
-        config = None
+        config = None,
+        use_cache: bool = True,
+        conversation_summary: Optional[str] = None
     ) -> Dict:
         """
         处理用户指令 - Code Agent核心流程
@@ -66,6 +125,8 @@ class WatchFaceCodeAgent:
             conversation_history: 对话历史
             assets: 素材信息
             config: 配置信息
+            use_cache: 是否允许使用生成缓存（单次请求可关闭）
+            conversation_summary: 项目的设计决策摘要（见utils.conversation_summary，编辑时代替较早的对话历史）
         
         Returns:
             包含code、diff、reasoning等信息的字典
@@ -73,252 +134,478 @@ class WatchFaceCodeAgent:
         is_new_conversation = current_code is None
         
         # 🔍 日志：记录process_instruction入口
-        entry_log = f"""
-{"="*70}
-🤖 Code Agent 处理开始
-{"="*70}
-场景类型: {'新建表盘 (完整生成)' if is_new_conversation else '修改表盘 (智能编辑)'}
-用户指令: {user_input}
-当前代码: {'无 (新建)' if is_new_conversation else f'{len(current_code)} 字符'}
-对话历史: {len(conversation_history) if conversation_history else 0} 轮
-时间戳: {datetime.now().isoformat()}
-{"="*70}
-"""
-        print(entry_log)
-        logger.info(entry_log)
+        logger.info(
+            f"🤖 Code Agent 处理开始: {'新建表盘 (完整生成)' if is_new_conversation else '修改表盘 (智能编辑)'}",
+            extra={"fields": {
+                "user_input": user_input,
+                "current_code_chars": 0 if is_new_conversation else len(current_code),
+                "history_turns": len(conversation_history) if conversation_history else 0,
+            }}
+        )
         
+        route = model_router.route(user_input, current_code)
+        started_at = time.perf_counter()
         try:
-            if is_new_conversation:
-                # 场景1：从零生成完整代码
-                result = await self.generate_complete_code(user_input, assets, config)
-            else:
-                # 场景2：智能代码编辑
-                result = await self.edit_code(
-                    user_input, 
-                    current_code, 
-                    conversation_history or [],
-                    assets,
-                    config
-                )
+            with model_router.use(route):
+                if is_new_conversation:
+                    # 场景1：从零生成完整代码
+                    result = await self.generate_complete_code(user_input, assets, config, use_cache)
+                else:
+                    # 场景2：智能代码编辑
+                    result = await self.edit_code(
+                        user_input, 
+                        current_code, 
+                        conversation_history or [],
+                        assets,
+                        config,
+                        use_cache,
+                        conversation_summary
+                    )
+            model_router.record_outcome(route, time.perf_counter() - started_at, result)
+            result["route"] = route.to_dict() if route else None
             
             # 🔍 日志：记录process_instruction结果汇总
-            summary_log = f"""
-{"="*70}
-✅ Code Agent 处理完成
-{"="*70}
-成功状态: {result.get('success')}
-返回消息: {result.get('message')}
-代码长度: {len(result.get('code', '')) if result.get('code') else 0} 字符
-包含思考: {bool(result.get('reasoning'))}
-包含差异: {bool(result.get('diff'))}
-处理时间: {datetime.now().isoformat()}
-{"="*70}
-"""
-            print(summary_log)
-            logger.info(summary_log)
+            logger.info(
+                f"✅ Code Agent 处理完成: {result.get('message')}",
+                extra={"fields": {
+                    "success": result.get('success'),
+                    "code_chars": len(result.get('code') or ''),
+                    "has_reasoning": bool(result.get('reasoning')),
+                    "has_diff": bool(result.get('diff')),
+                }}
+            )
             
             return result
             
         except Exception as e:
             # 🔍 日志：记录process_instruction异常
-            exception_log = f"""
-{"="*70}
-❌ Code Agent 处理异常
-{"="*70}
-异常类型: {type(e).__name__}
-异常消息: {str(e)}
-用户指令: {user_input}
-场景类型: {'新建表盘' if is_new_conversation else '修改表盘'}
-{"="*70}
-"""
-            print(exception_log)
-            logger.error(exception_log, exc_info=True)
+            logger.error(
+                f"❌ Code Agent 处理异常 ({'新建表盘' if is_new_conversation else '修改表盘'}): {type(e).__name__}: {e}",
+                exc_info=True,
+                extra={"fields": {"user_input": user_input}}
+            )
             raise
     
-    async def generate_complete_code(self, user_input: str, assets=None, config=None) -> Dict:
+    async def stream_instruction(
+        self,
+        user_input: str,
+        current_code: Optional[str] = None,
+        conversation_history: Optional[List[Dict]] = None,
+        assets = None,
+        config = None,
+        use_cache: bool = True,
+        conversation_summary: Optional[str] = None
+    ) -> AsyncIterator[Dict]:
         """
-        场景1：从零生成完整表盘代码
+        流式处理用户指令 - 边生成边产出事件
         
-        这是真正的Code Agent能力 - 不使用模板，从零创作
+        Args:
+            与process_instruction相同
+        
+        Yields:
+            {"event": "reasoning" | "content", "data": {"delta": str}} 增量事件，
+            {"event": "code", "data": {"delta": str}} 从正文中提取出的代码增量，
+            补丁模式下修改块无法应用（reason=patch_apply_failed）或输出异常提前中止（reason=malformed_output）时
+            产出 {"event": "fallback", "data": {"reason": str}} 后重新流式生成，
+            最后一个事件为 {"event": "result", "data": 与process_instruction相同的结果字典}
         """
-        print("🎨 Generating complete watchface code from scratch...")
+        route = model_router.route(user_input, current_code)
+        started_at = time.perf_counter()
+        with model_router.use(route):
+            async for event in self._stream_instruction(
+                user_input, current_code, conversation_history, assets, config, use_cache, conversation_summary
+            ):
+                if event["event"] == "result":
+                    model_router.record_outcome(route, time.perf_counter() - started_at, event["data"])
+                    event["data"]["route"] = route.to_dict() if route else None
+                yield event
+    
+    async def _stream_instruction(
+        self,
+        user_input: str,
+        current_code: Optional[str],
+        conversation_history: Optional[List[Dict]],
+        assets,
+        config,
+        use_cache: bool,
+        conversation_summary: Optional[str] = None
+    ) -> AsyncIterator[Dict]:
+        """stream_instruction的实现（在路由档位的上下文中执行）"""
+        is_new_conversation = current_code is None
+        patch_mode = not is_new_conversation and settings.edit_mode == "patch"
+        logger.info(f"🌊 流式处理开始: {'新建表盘' if is_new_conversation else '修改表盘'} | 指令: {user_input}")
         
-        # 使用导入的系统提示词
-        system_prompt = WATCHFACE_SYSTEM_PROMPT
+        with metrics.stage("prompt_build", self.model):
+            if is_new_conversation:
+                request_messages = self._build_generation_messages(user_input, assets, config)
+            else:
+                request_messages = self._build_edit_messages(
+                    user_input, current_code, conversation_history or [], assets, patch_mode, conversation_summary
+                )
         
-        # 使用提示词构建函数生成用户消息
-        if assets and config:
-            user_message = build_generation_prompt(user_input, assets, config)
-            logger.info(f"✓ 使用素材信息构建提示词")
+        completion = {"raw_content": "", "reasoning": "", "cached": False}
+        if is_new_conversation:
+            budget = token_budget.plan("generation", request_messages)
         else:
-            # 如果没有提供assets和config，使用简化版本
-            user_message = f"""请为我创建一个表盘：
-
-{user_input}
-
-直接生成完整的HTML代码，让我能在浏览器中看到效果。"""
-            logger.warning("⚠️ 未提供素材和配置信息，使用简化提示词")
-
+            budget = token_budget.plan("edit_patch" if patch_mode else "edit_full", request_messages, current_code)
+        
         try:
-            # 调用MiniMax-M2生成代码
-            extra_body = {}
-            if self.enable_reasoning:
-                extra_body["reasoning_split"] = True
-            
-            # 准备请求参数
-            request_messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ]
+            async for event in self._stream_completion(
+                request_messages, assets, use_cache, completion, budget, patch_mode
+            ):
+                yield event
             
-            # 🔍 日志：记录发送给MiniMax的请求（同时写入文件和终端）
-            log_msg = "\n" + "="*70 + "\n📤 MiniMax API 请求详情\n" + "="*70
-            print(log_msg)
-            logger.info(log_msg)
+            new_code = None
+            edit_mode = "patch" if patch_mode else "full"
+            if patch_mode:
+                with metrics.stage("extraction", self.model):
+                    new_code = self._apply_edit_output(completion["raw_content"], current_code, patch_mode)
+                if new_code is None:
+                    # 修改块无法应用：通知前端后以完整代码模式重新流式生成
+                    logger.warning("⚠️ 修改块无法应用，回退到完整代码模式重新生成")
+                    yield {"event": "fallback", "data": {"reason": "patch_apply_failed"}}
+                    with metrics.stage("prompt_build", self.model):
+                        request_messages = self._build_edit_messages(
+                            user_input, current_code, conversation_history or [], assets,
+                            patch_mode=False, conversation_summary=conversation_summary
+                        )
+                    patch_usage = completion.get("usage")
+                    completion = {"raw_content": "", "reasoning": "", "cached": False}
+                    budget = token_budget.plan("edit_full", request_messages, current_code)
+                    async for event in self._stream_completion(request_messages, assets, use_cache, completion, budget):
+                        yield event
+                    completion["usage"] = merge_usage(patch_usage, completion.get("usage"))
+                    edit_mode = "patch_fallback"
             
-            request_info = f"""模型: {self.model}
-Temperature: {self.temperature}
-Max Tokens: {self.max_tokens}
-启用Reasoning: {self.enable_reasoning}
-
---- System Prompt (前200字符) ---
-{system_prompt[:200] + "..." if len(system_prompt) > 200 else system_prompt}
+        except Exception as e:
+            if is_new_conversation:
+                yield {"event": "result", "data": self._generation_error_result(e, user_input)}
+            else:
+                yield {"event": "result", "data": self._edit_error_result(e, user_input, current_code)}
+            return
+        
+        raw_content = completion["raw_content"]
+        reasoning = completion["reasoning"]
+        logger.info(f"📥 流式响应结束: 原始内容 {len(raw_content)} 字符, 思考过程 {len(reasoning)} 字符")
+        
+        if is_new_conversation:
+            result = self._build_generation_result(raw_content, reasoning)
+        else:
+            result = await self._build_edit_result(raw_content, reasoning, current_code, new_code, edit_mode)
+        result["cached"] = completion["cached"]
+        result["usage"] = completion.get("usage")
+        
+        yield {"event": "result", "data": result}
+    
+    async def _stream_completion(
+        self,
+        request_messages: List[Dict],
+        assets,
+        use_cache: bool,
+        completion: Dict,
+        budget: Optional[Dict] = None,
+        patch_mode: bool = False
+    ) -> AsyncIterator[Dict]:
+        """
+        流式获取一次补全（优先读取生成缓存），产出增量事件
+        
+        正文边到达边提取代码，产出 {"event": "code", "data": {"delta": str}} 代码增量；
+        输出明显异常（长时间没有代码、代码陷入重复）时提前中止，产出fallback事件后重新生成，
+        重试次数用尽时抛出MalformedOutputError。
+        
+        完整的raw_content/reasoning/cached累积写入调用方传入的completion字典，结束后写入本次用量usage。
+        """
+        cache_key = self._cache_key(request_messages, assets) if use_cache else None
+        
+        cached = await generation_cache.get(cache_key) if cache_key else None
+        if cache_key:
+            metrics.record_cache(self.model, bool(cached))
+        if cached:
+            # 命中缓存：一次性下发完整的思考过程和正文
+            logger.info(f"⚡ 命中生成缓存: {cache_key[:12]}")
+            completion.update(
+                raw_content=cached["raw_content"], reasoning=cached["reasoning"], cached=True, usage=empty_usage(True)
+            )
+            if cached["reasoning"]:
+                yield {"event": "reasoning", "data": {"delta": cached["reasoning"]}}
+            yield {"event": "content", "data": {"delta": cached["raw_content"]}}
+            code_delta = self.target.stream_extractor(patch_mode, for_stream=False).feed(cached["raw_content"])
+            if code_delta:
+                yield {"event": "code", "data": {"delta": code_delta}}
+            return
+        
+        attempt = 0
+        aborted_output = ""
+        started_at = time.perf_counter()
+        while True:
+            extractor = self.target.stream_extractor(patch_mode)
+            completion.update(raw_content="", reasoning="")
+            try:
+                finish_reason = None
+                async for event in self._stream_extracted(request_messages, budget, completion, extractor):
+                    if event["event"] == "finish":
+                        finish_reason = event["data"]["finish_reason"]
+                        continue
+                    yield event
+                break
+            except MalformedOutputError as e:
+                logger.warning(
+                    f"✂️ 输出异常提前中止（{e.reason}）: 已输出 {len(completion['raw_content'])} 字符"
+                )
+                # 中止的输出同样计费，计入本次用量
+                aborted_output += completion["reasoning"] + completion["raw_content"]
+                if attempt >= settings.stream_malformed_retries:
+                    raise
+                attempt += 1
+                yield {"event": "fallback", "data": {"reason": "malformed_output", "detail": e.reason}}
+        latency = time.perf_counter() - started_at
+        metrics.observe_stage("llm_total", latency, self.model)
+        
+        if budget:
+            # 流式响应不带usage，按输出文本估算
+            usage = self._record_usage(
+                budget, None, completion["reasoning"] + completion["raw_content"], finish_reason,
+                completion["reasoning"], latency
+            )
+            if attempt:
+                # 提前中止的尝试：每次都重新发送了提示词
+                usage["prompt_tokens"] *= attempt + 1
+                usage["completion_tokens"] += estimate_tokens(aborted_output)
+                usage["calls"] += attempt
+            completion["usage"] = usage
+        
+        if cache_key and self._is_cacheable(completion["raw_content"], finish_reason):
+            await generation_cache.put(
+                cache_key, {"raw_content": completion["raw_content"], "reasoning": completion["reasoning"]}
+            )
+    
+    async def _stream_extracted(
+        self,
+        request_messages: List[Dict],
+        budget: Optional[Dict],
+        completion: Dict,
+        extractor: StreamCodeExtractor
+    ) -> AsyncIterator[Dict]:
+        """在_stream_llm的事件中插入代码增量事件，输出异常时关闭上游流并抛出MalformedOutputError"""
+        events = self._stream_llm(request_messages, budget["max_tokens"] if budget else None)
+        # 关闭reasoning_split时思考过程写在正文的<think>中：在代码提取之前移到reasoning
+        splitter = ThinkSplitter()
+        started_at = time.perf_counter()
+        first_content = True
+        try:
+            async for event in events:
+                if event["event"] == "reasoning":
+                    completion["reasoning"] += event["data"]["delta"]
+                    yield event
+                    continue
+                if event["event"] == "finish":
+                    content_delta, reasoning_delta = splitter.flush()
+                elif event["event"] == "content":
+                    content_delta, reasoning_delta = splitter.feed(event["data"]["delta"])
+                else:
+                    yield event
+                    continue
+                
+                if reasoning_delta:
+                    completion["reasoning"] += reasoning_delta
+                    yield {"event": "reasoning", "data": {"delta": reasoning_delta}}
+                if content_delta:
+                    completion["raw_content"] += content_delta
+                    if first_content:
+                        first_content = False
+                        metrics.observe_stage("ttft", time.perf_counter() - started_at, self.model)
+                    yield {"event": "content", "data": {"delta": content_delta}}
+                    code_delta = extractor.feed(content_delta)
+                    if code_delta:
+                        yield {"event": "code", "data": {"delta": code_delta}}
+                    if extractor.malformed:
+                        raise MalformedOutputError(extractor.malformed)
+                if event["event"] == "finish":
+                    yield event
+        finally:
+            # 提前结束时立即关闭上游连接，不再等待无用的输出
+            await events.aclose()
+    
+    async def _stream_llm(self, request_messages: List[Dict], max_tokens: Optional[int] = None) -> AsyncIterator[Dict]:
+        """以流式方式调用LLM，产出reasoning/content增量事件，最后产出finish事件（结束原因）"""
+        params = self._completion_params(request_messages, max_tokens)
+        if llm_cassette.replaying:
+            async for event in llm_cassette.replay_stream(params):
+                yield event
+            return
+        
+        # 不设为当前span：生成器挂起期间调用方的代码不应挂到这个span下
+        span = tracer.span("llm.stream", model=self.model, max_tokens=params["max_tokens"])
+        started_at = time.perf_counter()
+        reasoning = ""
+        content_parts = []
+        ttft = None
+        finish_reason = None
+        stream = None
+        try:
+            # 只在收到响应头之前重试，已经开始输出的流不重放
+            stream = await llm_transport.call(lambda: self.llm.chat.completions.create(**params, stream=True))
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                
+                # 思考过程增量
+                if self.enable_reasoning and getattr(delta, 'reasoning_details', None):
+                    text = delta.reasoning_details[0].get('text', '')
+                    reasoning, reasoning_delta = self._merge_stream_text(reasoning, text)
+                    if reasoning_delta:
+                        yield {"event": "reasoning", "data": {"delta": reasoning_delta}}
+                
+                # 正文增量
+                if delta.content:
+                    if ttft is None:
+                        ttft = time.perf_counter() - started_at
+                    content_parts.append(delta.content)
+                    yield {"event": "content", "data": {"delta": delta.content}}
+        except BaseException as e:
+            if not isinstance(e, GeneratorExit):
+                span.record_error(e)
+            raise
+        finally:
+            if stream is not None:
+                await stream.response.aclose()
+            span.set_attribute("ttft_ms", round(ttft * 1000, 1) if ttft is not None else None)
+            span.set_attribute("finish_reason", finish_reason)
+            span.set_attribute("output_chars", sum(len(part) for part in content_parts))
+            span.end()
+        
+        if llm_cassette.recording:
+            await llm_cassette.record(
+                params,
+                {"raw_content": "".join(content_parts), "reasoning": reasoning, "finish_reason": finish_reason},
+                time.perf_counter() - started_at,
+                ttft
+            )
+        yield {"event": "finish", "data": {"finish_reason": finish_reason}}
+    
+    async def generate_complete_code(
+        self,
+        user_input: str,
+        assets=None,
+        config=None,
+        use_cache: bool = True
+    ) -> Dict:
+        """
+        场景1：从零生成完整表盘代码
+        
+        这是真正的Code Agent能力 - 不使用模板，从零创作
+        """
+        with metrics.stage("prompt_build", self.model):
+            request_messages = self._build_generation_messages(user_input, assets, config)
+        budget = token_budget.plan("generation", request_messages)
+        system_prompt = request_messages[0]["content"]
+        user_message = request_messages[1]["content"]
 
---- User Message (前200字符) ---
-{user_message[:200] + "..." if len(user_message) > 200 else user_message}"""
-            
-            print(request_info)
-            logger.info(request_info)
-            print("="*70 + "\n")
-            logger.info("="*70)
-            
-            response = self.llm.chat.completions.create(
-                model=self.model,
-                messages=request_messages,
+        try:
+            # 🔍 日志：记录发送给MiniMax的请求
+            log_payload(
+                f"🎨 📤 MiniMax 生成请求: model={self.model}, max_tokens={budget['max_tokens']}, "
+                f"预估输入 {budget['estimated_input']} tokens",
+                user_message,
                 temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                extra_body=extra_body
+                reasoning=self.enable_reasoning,
+                system_prompt_chars=len(system_prompt),
             )
             
-            # 🔍 日志：记录MiniMax的原始响应（同时写入文件和终端）
-            raw_content = response.choices[0].message.content
-            
-            # 打印完整的Text内容（用户需求）
-            print("\n" + "="*70)
-            print(f"📄 Agent返回的完整原始内容 (Text):")
-            print("="*70)
-            print(raw_content)
-            print("="*70 + "\n")
-            
-            response_log = f"""
-{"="*70}
-📥 MiniMax API 响应详情
-{"="*70}
-Response ID: {response.id if hasattr(response, 'id') else 'N/A'}
-Model: {response.model if hasattr(response, 'model') else 'N/A'}
-Finish Reason: {response.choices[0].finish_reason if response.choices else 'N/A'}
-
---- 原始内容 (前500字符) ---
-{raw_content[:500] + "..." if len(raw_content) > 500 else raw_content}
-
---- 原始内容统计 ---
-总长度: {len(raw_content)} 字符
-总行数: {len(raw_content.split(chr(10)))} 行"""
-            
-            print(response_log)
-            logger.info(response_log)
-            
-            # 提取生成的代码
-            code = self._extract_code_from_response(raw_content)
-            
-            # 🔍 日志：记录提取后的代码
-            code_log = f"""
---- 提取的代码 (前500字符) ---
-{code[:500] + "..." if len(code) > 500 else code}
-
---- 提取后代码统计 ---
-代码长度: {len(code)} 字符
-代码行数: {len(code.split(chr(10)))} 行"""
-            
-            print(code_log)
-            logger.info(code_log)
-            
-            # 获取Agent思考过程
-            reasoning = ""
-            if self.enable_reasoning and hasattr(response.choices[0].message, 'reasoning_details'):
-                if response.choices[0].message.reasoning_details:
-                    reasoning = response.choices[0].message.reasoning_details[0].get('text', '')
-                    
-                    reasoning_log = f"""
---- Agent思考过程 (前300字符) ---
-{reasoning[:300] + "..." if len(reasoning) > 300 else reasoning}
-思考过程总长度: {len(reasoning)} 字符"""
-                    
-                    print(reasoning_log)
-                    logger.info(reasoning_log)
+            completion = await self._call_llm(
+                request_messages, assets, use_cache, budget, hedge=settings.hedging_enabled
+            )
             
-            # 🔍 日志：记录最终生成结果
-            newline = '\n'
-            final_result_log = f"""
-✅ 代码生成完成
----
-成功: True
-代码行数: {len(code.split(newline))}
-代码字符数: {len(code)}
-包含思考过程: {bool(reasoning)}
-思考过程长度: {len(reasoning) if reasoning else 0} 字符
-{"="*70}
-"""
-            print(final_result_log)
-            logger.info(final_result_log)
+            # 🔍 日志：记录MiniMax的原始响应（默认截断，按比例采样全文）
+            raw_content = completion["raw_content"]
+            log_payload(
+                f"📥 MiniMax 生成响应: finish_reason={completion.get('finish_reason') or 'N/A'}, "
+                f"命中缓存={completion['cached']}",
+                raw_content,
+                response_id=completion.get('id'),
+                model=completion.get('model'),
+                lines=raw_content.count("\n") + 1,
+            )
             
-            return {
-                "success": True,
-                "code": code,
-                "reasoning": reasoning,
-                "raw_content": raw_content,  # 🆕 保存完整的原始content
-                "message": "✅ 完整表盘代码生成成功！",
-                "diff": None,  # 新建无diff
-                "stats": {
-                    "lines": len(code.split('\n')),
-                    "characters": len(code)
-                }
-            }
+            result = self._build_generation_result(raw_content, completion["reasoning"])
+            result["cached"] = completion["cached"]
+            result["usage"] = completion["usage"]
+            return result
             
         except Exception as e:
-            error_msg = str(e)
-            
-            # 友好的错误提示
-            if "timeout" in error_msg.lower() or "timed out" in error_msg.lower():
-                user_message = "⏱️ 请求超时：AI模型响应时间较长，请尝试简化指令或稍后重试"
-            elif "connection" in error_msg.lower():
-                user_message = "🔌 连接错误：无法连接到AI模型服务，请检查网络和API配置"
-            elif "api key" in error_msg.lower() or "unauthorized" in error_msg.lower():
-                user_message = "🔑 认证错误：API密钥无效或已过期"
-            else:
-                user_message = f"❌ 代码生成失败: {error_msg}"
-            
-            # 🔍 日志：记录详细错误信息
-            error_log = f"""
-{"="*70}
-❌ 代码生成失败
-{"="*70}
-错误类型: {type(e).__name__}
-错误消息: {error_msg}
-用户友好提示: {user_message}
-指令: {user_input}
-{"="*70}
-"""
-            print(error_log)
-            logger.error(error_log, exc_info=True)  # 包含完整堆栈跟踪
-            
-            return {
-                "success": False,
-                "code": None,
-                "reasoning": None,
-                "message": user_message,
-                "error": error_msg
-            }
+            return self._generation_error_result(e, user_input)
+    
+    @traced("agent.generate_variants")
+    async def generate_variants(
+        self,
+        user_input: str,
+        assets=None,
+        config=None,
+        count: int = 2,
+        use_cache: bool = True,
+        slot: Optional[Callable[[], AsyncContextManager]] = None
+    ) -> Dict:
+        """
+        多方案生成：共用同一个系统提示词和素材清单，以不同的temperature/风格方向并发生成count个方案
+        
+        各方案独立提取和校验代码，单个方案失败不影响其他方案。
+        slot为每个方案的LLM调用获取执行权（调度器排队），并发的方案各占一个名额、受并发上限约束；
+        获取失败（排队已满）的方案按失败处理。
+        
+        Returns:
+            与generate_complete_code相同的结果字典（取序号最小的成功方案），
+            附加variants（每个方案的结果，含variant序号、temperature、style_hint），usage为全部方案之和
+        """
+        route = model_router.route(user_input)
+        with model_router.use(route), metrics.stage("prompt_build", self.model):
+            base_messages = self._build_generation_messages(user_input, assets, config)
+            temperatures = settings.variant_temperatures or [self.temperature]
+        style_hints = settings.variant_style_hints or [""]
+        
+        async def run_variant(index: int) -> Dict:
+            temperature = temperatures[index % len(temperatures)]
+            style_hint = style_hints[index % len(style_hints)]
+            request_messages = base_messages
+            if style_hint:
+                request_messages = [
+                    base_messages[0],
+                    {"role": "user", "content": f"{base_messages[1]['content']}\n\n风格方向：{style_hint}"}
+                ]
+            budget = token_budget.plan("generation", request_messages)
+            try:
+                async with slot() if slot else nullcontext():
+                    completion = await self._call_llm(
+                        request_messages, assets, use_cache, budget, temperature=temperature
+                    )
+                result = self._build_generation_result(completion["raw_content"], completion["reasoning"])
+                problem = self.target.validate(result["code"])
+                if problem:
+                    result.update(success=False, message=f"⚠️ 方案输出不完整：{problem}")
+                result["cached"] = completion["cached"]
+                result["usage"] = completion["usage"]
+            except Exception as e:
+                result = self._generation_error_result(e, user_input)
+            result.update(variant=index + 1, temperature=temperature, style_hint=style_hint)
+            return result
+        
+        logger.info(f"🎲 多方案生成: {count} 个方案并发生成")
+        started_at = time.perf_counter()
+        with model_router.use(route):
+            variants = await asyncio.gather(*(run_variant(index) for index in range(count)))
+        
+        usage = None
+        for variant in variants:
+            usage = merge_usage(usage, variant.get("usage"))
+        succeeded = [variant for variant in variants if variant["success"]]
+        logger.info(f"🎲 多方案生成完成: 成功 {len(succeeded)}/{count}")
+        
+        primary = succeeded[0] if succeeded else variants[0]
+        result = {**primary, "variants": list(variants), "usage": usage}
+        model_router.record_outcome(route, time.perf_counter() - started_at, result)
+        result["route"] = route.to_dict() if route else None
+        return result
     
     async def edit_code(
         self, 
@@ -326,337 +613,622 @@ Finish Reason: {response.choices[0].finish_reason if response.choices else 'N/A'
         current_code: str,
         conversation_history: List[Dict],
         assets=None,
-        config=None
+        config=None,
+        use_cache: bool = True,
+        conversation_summary: Optional[str] = None
     ) -> Dict:
         """
         场景2：智能代码编辑
         
         Code Agent的关键能力 - 理解用户意图并智能修改代码
         """
-        print("✏️  Editing code intelligently...")
-        
-        # 使用导入的系统提示词（包含素材使用规则）
-        system_prompt = WATCHFACE_SYSTEM_PROMPT + """
-
-## 🔧 代码编辑特殊要求
-
-### 1. 最小化修改原则 🚨（最重要）
-
-**核心规则：只改用户要求的部分，保持其他部分完全不变！**
-
-- ✅ 用户说"秒针替换成图片" → 只修改秒针相关代码（找到秒针元素，替换为<img>）
-- ✅ 用户说"背景改成蓝色" → 只修改background属性
-- ✅ 用户说"添加日期显示" → 只添加日期元素，其他不变
-- ❌ 不要重新设计整个表盘！
-- ❌ 不要改变原有的布局、颜色、字体等！
-- ❌ 不要"顺便优化"其他部分！
-
-**修改步骤：**
-1. 仔细分析当前代码，找到需要修改的具体部分
-2. 只修改那一小部分代码
-3. 确保修改后的代码与原代码风格一致
-4. 保持HTML结构、CSS样式、JavaScript逻辑的其他部分完全不变
-
-### 2. 智能素材匹配 ⚠️（最重要）
-
-当用户提到素材时，你必须**智能推断**他们指的是哪个素材，**不要询问文件名**！
-
-**推断规则：**
-- 用户说"秒针" / "秒针图片" / "我的秒针" / "上传的秒针" 
-  → 查找素材清单中的"秒针图片: xxx.png"，直接使用！
-  
-- 用户说"时针" / "时针图片"
-  → 查找素材清单中的"时针图片: xxx.png"，直接使用！
-  
-- 用户说"分针" / "分针图片"
-  → 查找素材清单中的"分针图片: xxx.png"，直接使用！
-  
-- 用户说"背景" / "背景图" / "我上传的背景"
-  → 查找素材清单中的"背景图: xxx.png"，直接使用！
-  
-- 用户说"指针图片"（没说具体是哪根）
-  → 根据上下文判断，可能是时针、分针或秒针
-
-**禁止行为：**
-❌ 不要回复："请提供文件名"
-❌ 不要说："我需要知道具体的文件名"
-❌ 不要要求用户提供更多信息
-
-**正确做法：**
-✅ 直接查看素材清单
-✅ 找到对应的素材文件名
-✅ 在代码中使用该文件名
+        patch_mode = settings.edit_mode == "patch"
+        with metrics.stage("prompt_build", self.model):
+            request_messages = self._build_edit_messages(
+                user_input, current_code, conversation_history, assets, patch_mode, conversation_summary
+            )
+        budget = token_budget.plan("edit_patch" if patch_mode else "edit_full", request_messages, current_code)
 
-### 3. 意图理解示例
-- "把背景改成蓝色" → 只改背景颜色相关代码
-- "使用我上传的背景图" → 从素材清单找到背景图，用 background-image: url('./assets/xxx')
-- "秒针替换成我上传的指针图片" → 从素材清单找到秒针图片，替换为 <img src='./assets/xxx' />
-- "加个日期显示在右边" → 添加日期元素和相关逻辑
-- "指针太粗了" → 调整指针的宽度样式
+        try:
+            # 🔍 日志：记录编辑请求
+            logger.info(
+                f"✏️ 📤 MiniMax 编辑请求（{'补丁模式' if patch_mode else '完整代码模式'}）: model={self.model}, "
+                f"max_tokens={budget['max_tokens']}, 预估输入 {budget['estimated_input']} tokens",
+                extra={"fields": {
+                    "user_input": user_input,
+                    "current_code_chars": len(current_code),
+                    "history_turns": len(conversation_history) if conversation_history else 0,
+                }}
+            )
+            
+            completion = await self._call_llm(request_messages, assets, use_cache, budget)
+            
+            # 🔍 日志：记录编辑响应（默认截断，按比例采样全文）
+            raw_content = completion["raw_content"]
+            log_payload(
+                f"📥 MiniMax 编辑响应: 命中缓存={completion['cached']}",
+                raw_content,
+                response_id=completion.get('id'),
+            )
+            
+            with metrics.stage("extraction", self.model):
+                new_code = self._apply_edit_output(raw_content, current_code, patch_mode)
+            edit_mode = "patch" if patch_mode else "full"
+            
+            if new_code is None:
+                # 修改块无法应用：回退到完整代码重新生成
+                logger.warning("⚠️ 修改块无法应用，回退到完整代码模式重新生成")
+                with metrics.stage("prompt_build", self.model):
+                    request_messages = self._build_edit_messages(
+                        user_input, current_code, conversation_history, assets,
+                        patch_mode=False, conversation_summary=conversation_summary
+                    )
+                budget = token_budget.plan("edit_full", request_messages, current_code)
+                patch_usage = completion["usage"]
+                completion = await self._call_llm(request_messages, assets, use_cache, budget)
+                completion["usage"] = merge_usage(patch_usage, completion["usage"])
+                raw_content = completion["raw_content"]
+                with metrics.stage("extraction", self.model):
+                    new_code = self._extract_code_from_response(raw_content)
+                edit_mode = "patch_fallback"
+            
+            result = await self._build_edit_result(
+                raw_content, completion["reasoning"], current_code, new_code, edit_mode
+            )
+            result["cached"] = completion["cached"]
+            result["usage"] = completion["usage"]
+            return result
+            
+        except Exception as e:
+            return self._edit_error_result(e, user_input, current_code)
+    
+    @traced("agent.summarize_conversation")
+    async def summarize_conversation(self, previous_summary: str, turns: List[Dict]) -> Dict:
+        """
+        把新增的对话合并进项目的设计决策摘要（由conversation_summarizer在后台调用，不经过生成缓存）
+        
+        Args:
+            previous_summary: 已有摘要（首次合并时为空）
+            turns: 新增的对话记录（role、content，内容已截断）
+        
+        Returns:
+            {"summary": 模型输出的摘要, "model", "usage"}
+        """
+        request_messages = [
+            {"role": "system", "content": CONVERSATION_SUMMARY_SYSTEM_PROMPT},
+            {"role": "user", "content": build_summary_prompt(previous_summary, turns, settings.summary_max_chars)}
+        ]
+        budget = token_budget.plan("summary", request_messages)
+        route = model_router.fixed("summary", "background_summary")
+        started_at = time.perf_counter()
+        with model_router.use(route):
+            completion = await self._call_llm(request_messages, use_cache=False, budget=budget)
+            model = self.model
+        
+        result = {"summary": completion["raw_content"], "model": model, "usage": completion["usage"]}
+        model_router.record_outcome(route, time.perf_counter() - started_at, {**result, "success": True})
+        return result
+    
+    async def _call_llm(
+        self,
+        request_messages: List[Dict],
+        assets=None,
+        use_cache: bool = True,
+        budget: Optional[Dict] = None,
+        hedge: bool = False,
+        temperature: Optional[float] = None
+    ) -> Dict:
+        """
+        调用LLM并返回标准化的补全结果（前置生成缓存）
+        
+        budget为token_budget.plan()的结果，用于设置max_tokens并记录实际用量；
+        hedge为True时首个调用超过对冲延迟仍未返回则再发一个相同请求，先提取出完整代码的结果胜出；
+        temperature为空时使用配置的默认值
+        
+        Returns:
+            {"raw_content", "reasoning", "id", "model", "finish_reason", "cached", "usage"}
+            （usage为本次调用的用量，见utils.usage_tracker）
+        """
+        cache_key = self._cache_key(request_messages, assets, temperature) if use_cache else None
+        if cache_key:
+            cached = await generation_cache.get(cache_key)
+            metrics.record_cache(self.model, bool(cached))
+            if cached:
+                logger.info(f"⚡ 命中生成缓存: {cache_key[:12]}")
+                return {
+                    **cached, "id": None, "model": self.model, "finish_reason": "cached",
+                    "cached": True, "usage": empty_usage(True)
+                }
+        
+        max_tokens = budget["max_tokens"] if budget else None
+        started_at = time.perf_counter()
+        with metrics.stage("llm_total", self.model):
+            if hedge:
+                completion = await hedger.run(
+                    lambda: self._request_completion(request_messages, max_tokens, temperature),
+                    lambda c: self.target.looks_like_code(self._extract_code_from_response(c["raw_content"]))
+                )
+            else:
+                completion = await self._request_completion(request_messages, max_tokens, temperature)
+        
+        latency = time.perf_counter() - started_at
+        if budget:
+            completion["usage"] = self._record_usage(
+                budget,
+                completion["usage"],
+                completion["reasoning"] + completion["raw_content"],
+                completion["finish_reason"],
+                completion["reasoning"],
+                latency
+            )
+        else:
+            completion["usage"] = None
+        
+        if cache_key and self._is_cacheable(completion["raw_content"], completion["finish_reason"]):
+            await generation_cache.put(cache_key, {
+                "raw_content": completion["raw_content"],
+                "reasoning": completion["reasoning"]
+            })
+        
+        return completion
+    
+    def _is_cacheable(self, raw_content: str, finish_reason: Optional[str]) -> bool:
+        """
+        只缓存正常结束、且包含完整代码或可解析修改块的输出
+        
+        被max_tokens截断或没有代码的输出一旦写入缓存，相同请求在缓存有效期内都会回放这个错误结果
+        """
+        if finish_reason == "stop" and (
+            parse_search_replace_blocks(raw_content)
+            or self.target.looks_like_code(self._extract_code_from_response(raw_content))
+        ):
+            return True
+        logger.info(f"🚫 输出不完整或没有可用代码，不写入生成缓存（finish_reason={finish_reason}）")
+        return False
+    
+    async def _request_completion(
+        self,
+        request_messages: List[Dict],
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None
+    ) -> Dict:
+        """发起一次非流式LLM调用（不经过缓存；录制/回放模式下经过llm_cassette）"""
+        params = self._completion_params(request_messages, max_tokens, temperature)
+        if llm_cassette.replaying:
+            return self._split_think(await llm_cassette.replay(params))
+        
+        started_at = time.perf_counter()
+        with tracer.span("llm.request", model=self.model, max_tokens=params["max_tokens"]) as span:
+            response = await llm_transport.call(lambda: self.llm.chat.completions.create(**params))
+            usage = getattr(response, 'usage', None)
+            span.set_attribute("finish_reason", response.choices[0].finish_reason)
+            span.set_attribute("prompt_tokens", getattr(usage, "prompt_tokens", None))
+            span.set_attribute("completion_tokens", getattr(usage, "completion_tokens", None))
+        
+        completion = {
+            "raw_content": response.choices[0].message.content or "",
+            "reasoning": self._extract_reasoning(response.choices[0].message),
+            "id": getattr(response, 'id', None),
+            "model": getattr(response, 'model', None),
+            "finish_reason": response.choices[0].finish_reason,
+            "usage": getattr(response, 'usage', None),
+            "cached": False
+        }
+        if llm_cassette.recording:
+            await llm_cassette.record(params, completion, time.perf_counter() - started_at)
+        return self._split_think(completion)
+    
+    @staticmethod
+    def _split_think(completion: Dict) -> Dict:
+        """关闭reasoning_split时模型把<think>思考过程写在正文中：移到reasoning，避免思考中的草稿代码被提取或保存"""
+        content, think = split_think(completion["raw_content"])
+        if think:
+            completion["raw_content"] = content
+            completion["reasoning"] = completion["reasoning"] or think
+        return completion
+    
+    def _cache_key(
+        self,
+        request_messages: List[Dict],
+        assets=None,
+        temperature: Optional[float] = None
+    ) -> Optional[str]:
+        """计算生成缓存键，缓存未启用时返回None"""
+        if not settings.generation_cache_enabled:
+            return None
+        return generation_cache.make_key(
+            model=self.model,
+            temperature=self.temperature if temperature is None else temperature,
+            system_prompt=request_messages[0]["content"],
+            user_message=request_messages[1]["content"],
+            asset_manifest=self._asset_manifest(assets)
+        )
+    
+    @staticmethod
+    def _asset_manifest(assets) -> List[str]:
+        """素材清单：每个素材的存储文件名和大小"""
+        if not assets:
+            return []
+        manifest = []
+        for asset in [
+            assets.background_round, assets.background_square,
+            assets.pointer_hour, assets.pointer_minute, assets.pointer_second,
+            assets.preview_image,
+            *assets.digits, *assets.week_images, *assets.decorations
+        ]:
+            if asset:
+                manifest.append(f"{asset.stored_filename}:{asset.file_size}")
+        return manifest
+    
+    def _build_generation_messages(self, user_input: str, assets=None, config=None) -> List[Dict]:
+        """构建新建表盘的请求消息"""
+        # 使用提示词构建函数生成用户消息
+        if assets and config:
+            user_message = build_generation_prompt(user_input, assets, config, self.target)
+            logger.info(f"✓ 使用素材信息构建提示词")
+        else:
+            # 如果没有提供assets和config，使用简化版本
+            user_message = f"""请为我创建一个表盘：
 
-### 4. 输出要求
-返回修改后的完整HTML代码。
-保持代码风格一致，确保可以正常运行。"""
+{user_input}
 
+{self.target.simple_generation_request}"""
+            logger.warning("⚠️ 未提供素材和配置信息，使用简化提示词")
+        
+        return [
+            {"role": "system", "content": self.target.system_prompt},
+            {"role": "user", "content": user_message}
+        ]
+    
+    def _build_edit_messages(
+        self,
+        user_input: str,
+        current_code: str,
+        conversation_history: Optional[List[Dict]],
+        assets=None,
+        patch_mode: bool = False,
+        conversation_summary: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        构建代码编辑的请求消息（patch_mode时要求模型只返回SEARCH/REPLACE修改块）
+        
+        对话上下文 = 设计决策摘要（较早对话的长程信息，长度有上限） + 最近几条对话（每条截断）
+        """
+        code_context = self._select_edit_context(user_input, current_code) if patch_mode else None
+        if (
+            patch_mode and code_context is None
+            and estimate_tokens(current_code) > settings.input_token_budget
+        ):
+            # 完整代码已超出输入预算：不再要求片段足够聚焦，尽量切片
+            code_context = self._select_edit_context(user_input, current_code, max_ratio=1.0)
+        
         # 使用提示词构建函数
         if assets:
-            base_message = build_edit_prompt(current_code, user_input, assets)
+            base_message = build_edit_prompt(current_code, user_input, assets, patch_mode, code_context, self.target)
         else:
             # 简化版本
-            base_message = f"""当前表盘代码：
-```html
-{current_code}
-```
+            output_requirement = (
+                "只输出 SEARCH/REPLACE 修改块，不要返回完整代码。"
+                if patch_mode else
+                self.target.full_edit_request
+            )
+            code_section = code_context or f"""当前表盘代码：
+{self.target.code_block(current_code)}"""
+            base_message = f"""{code_section}
 
 用户修改要求：
 {user_input}
 
-请根据用户要求修改代码，返回完整的修改后 HTML 代码。"""
+请根据用户要求修改代码，{output_requirement}"""
+        
+        system_prompt = self.target.patch_edit_system_prompt if patch_mode else self.target.edit_system_prompt
         
         # 添加对话上下文
         context_summary = ""
-        if conversation_history:
-            recent = conversation_history[-3:]  # 最近3轮更聚焦
-            context_summary = "\n\n### 对话历史：\n"
+        available = settings.input_token_budget - estimate_tokens(system_prompt) - estimate_tokens(base_message)
+        if conversation_summary:
+            context_summary = f"\n\n### 设计决策摘要（之前的对话）：\n{conversation_summary}"
+            available -= estimate_tokens(context_summary)
+        if conversation_history and settings.summary_recent_messages > 0:
+            recent = conversation_history[-settings.summary_recent_messages:]  # 最近几条更聚焦
+            # 只保留放得进剩余输入预算的对话历史
+            recent = token_budget.trim_history(
+                [{**msg, "content": msg.get('content', '')[:200]} for msg in recent], available
+            )
+            context_summary += "\n\n### 对话历史：\n"
             for msg in recent:
                 role = "👤 用户" if msg.get('role') == 'user' else "🤖 助手"
-                content = msg.get('content', '')[:200]
-                context_summary += f"{role}: {content}\n"
+                context_summary += f"{role}: {msg['content']}\n"
+        
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": base_message + context_summary}
+        ]
+    
+    def _select_edit_context(
+        self,
+        user_input: str,
+        current_code: str,
+        max_ratio: Optional[float] = None
+    ) -> Optional[str]:
+        """
+        代码较长时只选取与指令相关的片段（仅用于补丁模式，修改块会被应用回完整代码）
+        
+        Returns:
+            结构大纲+相关片段；不需要或无法切片时返回None（发送完整代码）
+        """
+        if not settings.edit_context_slicing or len(current_code) < settings.edit_slice_min_chars:
+            return None
+        
+        sliced = build_sliced_context(
+            current_code, user_input, max_ratio or settings.edit_slice_max_ratio, self.target.fence_lang
+        )
+        if sliced is None:
+            logger.info("✂️ 未找到足够聚焦的相关片段，发送完整代码")
+            return None
+        
+        logger.info(
+            f"✂️ 上下文切片: 选中 {sliced['selected']}/{sliced['regions']} 个区域, "
+            f"{sliced['chars']}/{len(current_code)} 字符"
+        )
+        return sliced["context"]
+    
+    def _completion_params(
+        self,
+        messages: List[Dict],
+        max_tokens: Optional[int] = None,
+        temperature: Optional[float] = None
+    ) -> Dict:
+        """构建chat.completions.create的调用参数（max_tokens/temperature为空时使用配置的值）"""
+        extra_body = {}
+        if self.enable_reasoning:
+            extra_body["reasoning_split"] = True
+        
+        return {
+            "model": self.model,
+            "messages": messages,
+            "temperature": self.temperature if temperature is None else temperature,
+            "max_tokens": max_tokens or self.max_tokens,
+            "extra_body": extra_body
+        }
+    
+    def _extract_reasoning(self, message) -> str:
+        """从响应消息中提取Agent思考过程"""
+        reasoning = ""
+        if self.enable_reasoning and getattr(message, 'reasoning_details', None):
+            reasoning = message.reasoning_details[0].get('text', '')
+            log_payload("💭 Agent思考过程", reasoning)
+        
+        return reasoning
+    
+    @staticmethod
+    def _merge_stream_text(buffer: str, incoming: str) -> Tuple[str, str]:
+        """
+        合并流式文本片段
+        
+        MiniMax的reasoning_details在流式模式下可能返回累计全文而非增量，
+        这里统一转换为(新的累计文本, 本次增量)。
+        """
+        if buffer and incoming.startswith(buffer):
+            return incoming, incoming[len(buffer):]
+        return buffer + incoming, incoming
+    
+    def _build_generation_result(self, raw_content: str, reasoning: str) -> Dict:
+        """从模型原始输出构建新建表盘的结果"""
+        # 提取生成的代码
+        with metrics.stage("extraction", self.model):
+            code = self._extract_code_from_response(raw_content)
+        
+        # 🔍 日志：记录最终生成结果
+        logger.info(
+            f"✅ 代码生成完成: {code.count(chr(10)) + 1} 行, {len(code)} 字符",
+            extra={"fields": {"reasoning_chars": len(reasoning) if reasoning else 0}}
+        )
+        
+        return {
+            "success": True,
+            "code": code,
+            "reasoning": reasoning,
+            "raw_content": raw_content,  # 🆕 保存完整的原始content
+            "message": "✅ 完整表盘代码生成成功！",
+            "diff": None,  # 新建无diff
+            "stats": {
+                "lines": len(code.split('\n')),
+                "characters": len(code)
+            }
+        }
+    
+    def _apply_edit_output(self, raw_content: str, current_code: str, patch_mode: bool) -> Optional[str]:
+        """
+        根据模型输出得到修改后的完整代码
+        
+        Returns:
+            修改后的代码；补丁模式下修改块无法应用时返回None（调用方应回退到完整代码模式）
+        """
+        if not patch_mode:
+            return self._extract_code_from_response(raw_content)
+        
+        blocks = parse_search_replace_blocks(raw_content)
+        if not blocks:
+            # 模型没有按补丁格式输出：如果返回的是完整代码则直接采用
+            code = self._extract_code_from_response(raw_content)
+            # 切片上下文下模型可能只“补全”了片段，明显短于原文的结果不采用
+            if self.target.looks_like_code(code) and len(code) >= len(current_code) * 0.5:
+                logger.info("ℹ️ 补丁模式下模型返回了完整代码，直接使用")
+                return code
+            logger.warning("⚠️ 补丁模式下未找到任何修改块")
+            return None
         
-        user_message = base_message + context_summary
-
         try:
-            extra_body = {}
-            if self.enable_reasoning:
-                extra_body["reasoning_split"] = True
-            
-            request_messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message}
-            ]
-            
-            # 🔍 日志：记录编辑请求（同时写入文件和终端）
-            request_log = f"""
-{"="*70}
-📤 MiniMax API 编辑请求详情
-{"="*70}
-模型: {self.model}
-场景: 代码编辑
-用户指令: {user_input}
-当前代码长度: {len(current_code)} 字符
-对话历史: {len(conversation_history) if conversation_history else 0} 轮
-{"="*70}"""
-            
-            print(request_log)
-            logger.info(request_log)
-            
-            response = self.llm.chat.completions.create(
-                model=self.model,
-                messages=request_messages,
-                temperature=self.temperature,
-                max_tokens=self.max_tokens,
-                extra_body=extra_body
+            new_code = apply_search_replace_blocks(
+                current_code, blocks, settings.patch_fuzzy_threshold
             )
-            
-            # 🔍 日志：记录编辑响应（同时写入文件和终端）
-            raw_content = response.choices[0].message.content
-            
-            # 打印完整的Text内容（用户需求）
-            print("\n" + "="*70)
-            print(f"📄 Agent返回的完整原始内容 (Text) - 编辑模式:")
-            print("="*70)
-            print(raw_content)
-            print("="*70 + "\n")
-            
-            edit_response_log = f"""
-{"="*70}
-📥 MiniMax API 编辑响应详情
-{"="*70}
-Response ID: {response.id if hasattr(response, 'id') else 'N/A'}
-原始响应长度: {len(raw_content)} 字符
-
---- 原始响应内容 (前500字符) ---
-{raw_content[:500] + "..." if len(raw_content) > 500 else raw_content}"""
-            
-            print(edit_response_log)
-            logger.info(edit_response_log)
-            
-            # 提取修改后的代码
-            new_code = self._extract_code_from_response(raw_content)
-            
-            extracted_log = f"""
---- 提取后的新代码 (前500字符) ---
-{new_code[:500] + "..." if len(new_code) > 500 else new_code}
-新代码长度: {len(new_code)} 字符"""
-            
-            print(extracted_log)
-            logger.info(extracted_log)
-            
-            # 获取思考过程
-            reasoning = ""
-            if self.enable_reasoning and hasattr(response.choices[0].message, 'reasoning_details'):
-                if response.choices[0].message.reasoning_details:
-                    reasoning = response.choices[0].message.reasoning_details[0].get('text', '')
-                    
-                    thinking_log = f"""
---- Agent思考过程 (前300字符) ---
-{reasoning[:300] + "..." if len(reasoning) > 300 else reasoning}"""
-                    
-                    print(thinking_log)
-                    logger.info(thinking_log)
-                    print(f"💭 Agent Thinking: {reasoning[:200]}...")
-            
-            # 计算代码差异
-            diff = self._compute_diff(current_code, new_code)
-            
-            # 🔍 日志：记录代码差异（同时写入文件和终端）
-            diff_log = f"""
---- 代码差异分析 ---
-新增行数: {len(diff['added_lines'])}
-删除行数: {len(diff['removed_lines'])}
-总变更数: {diff['total_changes']}"""
-            
-            if diff['added_lines']:
-                diff_log += "\n\n新增的行（前5行）:"
-                for line in diff['added_lines'][:5]:
-                    diff_log += f"\n  + 第{line['line_number']}行: {line['content'][:60]}"
-            
-            if diff['removed_lines']:
-                diff_log += "\n\n删除的行（前5行）:"
-                for line in diff['removed_lines'][:5]:
-                    diff_log += f"\n  - 第{line['line_number']}行: {line['content'][:60]}"
-            
-            # 生成友好的修改说明
-            change_summary = self._generate_change_summary(diff)
-            
-            diff_log += f"\n\n修改摘要: {change_summary}\n{'='*70}\n"
-            
-            print(diff_log)
-            logger.info(diff_log)
-            
-            # 🔍 日志：记录最终编辑结果
-            newline = '\n'
-            final_edit_log = f"""
-✅ 代码编辑完成
----
-成功: True
-新代码行数: {len(new_code.split(newline))}
-新代码字符数: {len(new_code)}
-总变更数: {diff['total_changes']}
-新增行数: {len(diff['added_lines'])}
-删除行数: {len(diff['removed_lines'])}
-包含思考过程: {bool(reasoning)}
-修改摘要: {change_summary}
-{"="*70}
-"""
-            print(final_edit_log)
-            logger.info(final_edit_log)
-            
-            return {
-                "success": True,
-                "code": new_code,
-                "reasoning": reasoning,
-                "raw_content": raw_content,  # 🆕 保存完整的原始content
-                "diff": diff,
-                "message": f"✅ 代码修改完成！{change_summary}",
-                "stats": {
-                    "lines": len(new_code.split(newline)),
-                    "changes": diff['total_changes']
-                }
-            }
-            
-        except Exception as e:
-            error_msg = str(e)
-            
-            # 🔍 日志：记录详细错误信息
-            error_log = f"""
-{"="*70}
-❌ 代码编辑失败
-{"="*70}
-错误类型: {type(e).__name__}
-错误消息: {error_msg}
-用户指令: {user_input}
-当前代码长度: {len(current_code)} 字符
-{"="*70}
-"""
-            print(error_log)
-            logger.error(error_log, exc_info=True)  # 包含完整堆栈跟踪
-            
-            return {
-                "success": False,
-                "code": current_code,  # 失败时返回原代码
-                "reasoning": None,
-                "diff": None,
-                "message": f"❌ 代码修改失败: {error_msg}",
-                "error": error_msg
+        except PatchApplyError as e:
+            logger.warning(f"⚠️ {e}")
+            return None
+        
+        logger.info(f"🩹 已应用 {len(blocks)} 个修改块")
+        return new_code
+    
+    async def _build_edit_result(
+        self,
+        raw_content: str,
+        reasoning: str,
+        current_code: str,
+        new_code: Optional[str] = None,
+        edit_mode: str = "full"
+    ) -> Dict:
+        """从模型原始输出构建代码编辑的结果（包含差异分析）"""
+        # 提取修改后的代码（补丁模式下由调用方传入已应用补丁的代码）
+        if new_code is None:
+            with metrics.stage("extraction", self.model):
+                new_code = self._extract_code_from_response(raw_content)
+        
+        # 计算代码差异
+        diff = await self._compute_diff(current_code, new_code)
+        
+        # 🔍 日志：变更行预览只在DEBUG级别记录
+        if logger.isEnabledFor(logging.DEBUG):
+            preview = [f"+ 第{line['line_number']}行: {line['content'][:60]}" for line in diff['added_lines'][:5]]
+            preview += [f"- 第{line['line_number']}行: {line['content'][:60]}" for line in diff['removed_lines'][:5]]
+            logger.debug("🔍 代码差异预览", extra={"fields": {"preview": preview}})
+        
+        # 生成友好的修改说明
+        change_summary = self._generate_change_summary(diff)
+        
+        # 🔍 日志：记录最终编辑结果
+        newline = '\n'
+        logger.info(
+            f"✅ 代码编辑完成: {change_summary}",
+            extra={"fields": {
+                "new_code_chars": len(new_code),
+                "added_lines": len(diff['added_lines']),
+                "removed_lines": len(diff['removed_lines']),
+                "total_changes": diff['total_changes'],
+                "has_reasoning": bool(reasoning),
+            }}
+        )
+        
+        return {
+            "success": True,
+            "code": new_code,
+            "reasoning": reasoning,
+            "raw_content": raw_content,  # 🆕 保存完整的原始content
+            "diff": diff,
+            "edit_mode": edit_mode,
+            "message": f"✅ 代码修改完成！{change_summary}",
+            "stats": {
+                "lines": len(new_code.split(newline)),
+                "changes": diff['total_changes']
             }
+        }
     
-    def _extract_code_from_response(self, response_text: str) -> str:
-        """从LLM响应中提取代码"""
-        # 处理markdown代码块
-        if "```html" in response_text:
-            start = response_text.find("```html") + 7
-            end = response_text.find("```", start)
-            if end != -1:
-                return response_text[start:end].strip()
-        
-        if "```" in response_text:
-            start = response_text.find("```") + 3
-            # 跳过可能的语言标识符
-            if response_text[start:start+10].strip().split()[0] in ['html', 'xml']:
-                start = response_text.find('\n', start) + 1
-            end = response_text.find("```", start)
-            if end != -1:
-                return response_text[start:end].strip()
-        
-        # 尝试找到<!DOCTYPE html>
-        if "<!DOCTYPE html>" in response_text or "<html>" in response_text:
-            start = response_text.find("<!DOCTYPE html>")
-            if start == -1:
-                start = response_text.find("<html>")
-            if start != -1:
-                # 找到</html>结束
-                end = response_text.rfind("</html>")
-                if end != -1:
-                    return response_text[start:end+7].strip()
-        
-        # 如果都没找到，返回全部内容
-        return response_text.strip()
-    
-    def _compute_diff(self, old_code: str, new_code: str) -> Dict:
-        """计算代码差异"""
-        old_lines = old_code.split('\n')
-        new_lines = new_code.split('\n')
-        
-        differ = difflib.Differ()
-        diff = list(differ.compare(old_lines, new_lines))
-        
-        changes = {
-            "added_lines": [],
-            "removed_lines": [],
-            "modified_sections": [],
-            "total_changes": 0
+    def _generation_error_result(self, e: Exception, user_input: str) -> Dict:
+        """将生成异常转换为友好的失败结果"""
+        error_msg = str(e)
+        
+        # 友好的错误提示
+        if isinstance(e, CircuitOpenError):
+            user_message = f"🚧 AI模型服务暂时不可用，请约 {e.retry_after:.0f} 秒后重试"
+        elif isinstance(e, MalformedOutputError):
+            user_message = "🧩 AI模型输出异常（没有生成有效代码），请调整指令后重试"
+        elif "timeout" in error_msg.lower() or "timed out" in error_msg.lower():
+            user_message = "⏱️ 请求超时：AI模型响应时间较长，请尝试简化指令或稍后重试"
+        elif "connection" in error_msg.lower():
+            user_message = "🔌 连接错误：无法连接到AI模型服务，请检查网络和API配置"
+        elif "api key" in error_msg.lower() or "unauthorized" in error_msg.lower():
+            user_message = "🔑 认证错误：API密钥无效或已过期"
+        else:
+            user_message = f"❌ 代码生成失败: {error_msg}"
+        
+        # 🔍 日志：记录详细错误信息（包含完整堆栈跟踪）
+        logger.error(
+            f"❌ 代码生成失败: {type(e).__name__}: {error_msg}",
+            exc_info=e,
+            extra={"fields": {"user_message": user_message, "user_input": user_input}}
+        )
+        
+        return {
+            "success": False,
+            "code": None,
+            "reasoning": None,
+            "message": user_message,
+            "error": error_msg
         }
+
+    def _edit_error_result(self, e: Exception, user_input: str, current_code: str) -> Dict:
+        """将编辑异常转换为失败结果（保留原代码）"""
+        error_msg = str(e)
+        
+        # 🔍 日志：记录详细错误信息（包含完整堆栈跟踪）
+        logger.error(
+            f"❌ 代码编辑失败: {type(e).__name__}: {error_msg}",
+            exc_info=e,
+            extra={"fields": {"user_input": user_input, "current_code_chars": len(current_code)}}
+        )
+        
+        return {
+            "success": False,
+            "code": current_code,  # 失败时返回原代码
+            "reasoning": None,
+            "diff": None,
+            "message": f"❌ 代码修改失败: {error_msg}",
+            "error": error_msg
+        }
+
+    def _extract_code_from_response(self, response_text: str) -> str:
+        """从LLM响应中提取代码（与流式提取使用同一个提取器，单次扫描）"""
+        return self.target.extract(response_text)
+    
+    async def _compute_diff(self, old_code: str, new_code: str) -> Dict:
+        """计算代码差异（大文件放到线程池中计算，不阻塞事件循环）"""
+        with metrics.stage("diff", self.model):
+            if len(old_code) + len(new_code) > settings.diff_offload_chars:
+                return await asyncio.to_thread(compute_line_diff, old_code, new_code)
+            return compute_line_diff(old_code, new_code)
+    
+    def _record_usage(
+        self,
+        budget: Dict,
+        usage,
+        output_text: str,
+        finish_reason: Optional[str],
+        reasoning: str = "",
+        latency: float = 0.0
+    ) -> Dict:
+        """
+        记录实际token用量（更新token_budget的学习值并计入指标）
         
-        line_num = 0
-        for line in diff:
-            if line.startswith('+ '):
-                changes["added_lines"].append({
-                    "line_number": line_num,
-                    "content": line[2:]
-                })
-                changes["total_changes"] += 1
-                line_num += 1
-            elif line.startswith('- '):
-                changes["removed_lines"].append({
-                    "line_number": line_num,
-                    "content": line[2:]
-                })
-                changes["total_changes"] += 1
-            elif line.startswith('  '):
-                line_num += 1
-        
-        return changes
+        Returns:
+            本次调用的用量字典（见utils.usage_tracker），由调用方附在结果中按客户端/项目归属
+        """
+        # 思考token：优先取usage中的completion_tokens_details，没有时按思考过程文本估算
+        details = getattr(usage, "completion_tokens_details", None)
+        if isinstance(details, dict):
+            reasoning_tokens = details.get("reasoning_tokens")
+        else:
+            reasoning_tokens = getattr(details, "reasoning_tokens", None)
+        reasoning_estimated = reasoning_tokens is None
+        if reasoning_estimated:
+            reasoning_tokens = estimate_tokens(reasoning)
+        
+        record = token_budget.record(budget, usage, output_text, finish_reason, reasoning_tokens)
+        prompt_tokens = record["actual_input"] or record["estimated_input"]
+        metrics.record_tokens(self.model, prompt_tokens, record["actual_output"])
+        
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": record["actual_output"],
+            "reasoning_tokens": reasoning_tokens,
+            "llm_latency": latency,
+            "calls": 1,
+            "cached": False,
+            "estimated": (
+                record["actual_input"] is None
+                or record["output_source"] != "usage"
+                or (reasoning_estimated and bool(reasoning))
+            ),
+        }
     
     def _generate_change_summary(self, diff: Dict) -> str:
         """生成易读的修改摘要"""
@@ -3,7 +3,7 @@ Configuration Settings for WatchFace Code Agent Backend
 """
 import os
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 
 class Settings(BaseSettings):
@@ -19,6 +19,7 @@ class Settings(BaseSettings):
     PORT: int = 10030
     backend_port: int = 10030
     frontend_url: str = "http://10.11.17.19:10031"
+    STORAGE_ROOT: str = ""                  # 运行时数据目录（项目、上传、缓存、任务、用量等），留空为仓库下的 storage/
     
     # MiniMax-M2 Configuration
     MINIMAX_BASE_URL: str = "https://api.minimaxi.com/v1"
@@ -38,8 +39,158 @@ class Settings(BaseSettings):
     max_tokens: int = 10000
     enable_reasoning: bool = True
     
-    # Logging Configuration
+    # LLM Client Pool Configuration（按API Key复用Agent，共享HTTP连接池）
+    llm_pool_max_agents: int = 64           # 池中最多保留的Agent数（LRU淘汰）
+    llm_pool_idle_ttl: float = 1800.0       # Agent空闲多久后被清理（秒）
+    llm_max_connections: int = 100
+    llm_max_keepalive_connections: int = 20
+    llm_keepalive_expiry: float = 120.0     # 空闲keep-alive连接保留时间（秒）
+    
+    # Generation Cache Configuration（相同提示词+素材直接复用历史补全结果）
+    generation_cache_enabled: bool = True
+    generation_cache_max_entries: int = 500
+    generation_cache_max_bytes: int = 200 * 1024 * 1024  # 200MB
+    generation_cache_ttl: float = 7 * 24 * 3600.0        # 7天
+    
+    # Edit Mode Configuration
+    edit_mode: str = "patch"                # "patch": 模型只返回SEARCH/REPLACE修改块；"full": 返回完整代码
+    patch_fuzzy_threshold: float = 0.85     # 修改块模糊定位所需的最低相似度
+    edit_context_slicing: bool = True       # 补丁模式下大文件只发送与指令相关的代码片段
+    edit_slice_min_chars: int = 6000        # 代码超过该长度才切片
+    edit_slice_max_ratio: float = 0.6       # 相关片段超过全文该比例时仍发送完整代码
+    
+    # Model Routing Configuration（按指令类型选择模型档位）
+    routing_enabled: bool = True
+    routing_profiles: Dict[str, Dict[str, Any]] = {  # 档位 → {model, temperature, reasoning}，缺省字段沿用默认配置
+        "generation": {},                   # 从零生成
+        "structural": {},                   # 结构性修改（增删元素、替换素材、改布局）
+        "cosmetic": {"temperature": 0.3, "reasoning": False},  # 样式微调：关闭reasoning_split，可配置更快的model
+        "summary": {"temperature": 0.2, "reasoning": False},   # 后台对话摘要
+    }
+    routing_cosmetic_max_chars: int = 30    # 超过该长度的指令不视为样式微调
+    routing_cosmetic_max_clauses: int = 2   # 子句数超过该值的复合修改不视为样式微调
+    routing_cosmetic_keywords: List[str] = [  # 只用多字短语：单字（如"高"、"长"）会命中"高级"、"长按"等非样式指令
+        "颜色", "配色", "色调", "红色", "橙色", "黄色", "绿色", "青色", "蓝色", "紫色", "粉色", "黑色", "白色",
+        "灰色", "金色", "银色", "太粗", "太细", "粗一点", "细一点", "粗些", "细些", "变粗", "变细", "加粗",
+        "大一点", "小一点", "大些", "小些", "大小", "字体", "字号", "透明", "亮一点", "暗一点", "调亮", "调暗",
+        "亮度", "阴影", "圆角", "边框", "间距", "对齐", "居中", "往上", "往下", "往左", "往右",
+        "宽一点", "窄一点", "高一点", "矮一点", "长一点", "短一点", "宽度", "高度", "长度",
+    ]
+    routing_structural_keywords: List[str] = [
+        "添加", "增加", "加个", "加一个", "加上", "新增", "删除", "删掉", "去掉", "移除", "替换",
+        "图片", "素材", "上传", "布局", "重新", "重做", "重写", "指针式", "数字式", "动画", "点击", "交互",
+        "日期", "星期", "天气", "步数", "心率", "电量", "倒计时",
+    ]
+    routing_stats_window: int = 200         # 每个档位保留的最近耗时样本数（用于分位数）
+    
+    # Token Budget Configuration（按预期输出大小设置max_tokens）
+    adaptive_max_tokens: bool = True        # 关闭时所有请求使用固定的max_tokens
+    input_token_budget: int = 48000         # 提示词输入预算，超出时裁剪对话历史/切片代码
+    min_output_tokens: int = 1024
+    max_output_tokens: int = 32000
+    output_token_headroom: float = 1.5      # max_tokens = 预期输出 × 该系数
+    token_ema_alpha: float = 0.2            # 学习预期输出的指数移动平均系数
+    reasoning_token_allowance: int = 2000   # 思考token的初始预留（MiniMax-M2的completion_tokens和max_tokens都包含思考过程）
+    truncation_boost: float = 1.5           # 某类请求被max_tokens截断后，该类max_tokens的放大倍数（可累积）
+    truncation_boost_max: float = 4.0       # 累积放大倍数上限，之后每次正常结束逐步回落到1
+    
+    # Conversation Summary Configuration（按项目维护设计决策摘要，编辑提示词大小有界）
+    summary_enabled: bool = True
+    summary_max_chars: int = 1200           # 摘要最大长度（字符）
+    summary_turn_chars: int = 600           # 合并摘要时每条对话记录最多取的字符数
+    summary_recent_messages: int = 3        # 编辑提示词中原样附带的最近对话条数（对话不超过该条数时不生成摘要）
+    
+    # LLM Transport Configuration（超时、重试、熔断）
+    llm_connect_timeout: float = 10.0       # 建立连接超时（秒）
+    llm_read_timeout: float = 180.0         # 读取超时（秒）- AI代码生成可能需要较长时间
+    llm_write_timeout: float = 30.0
+    llm_pool_timeout: float = 10.0          # 等待连接池空闲连接的超时（秒）
+    llm_max_retries: int = 2                # 超时/连接错误/5xx/429的最大重试次数
+    llm_retry_base_delay: float = 0.5       # 指数退避基数（秒），实际等待时间带随机抖动
+    llm_retry_max_delay: float = 8.0
+    llm_breaker_failure_threshold: int = 5  # 连续多少次上游故障后熔断
+    llm_breaker_reset_timeout: float = 30.0 # 熔断多久后放行探测请求（秒）
+    
+    # Scheduler Configuration（LLM调用准入控制与公平排队）
+    scheduler_max_concurrent: int = 16      # 全局同时进行的LLM调用上限
+    scheduler_max_per_client: int = 4       # 每个客户端同时进行的上限（不小于variants_max，多方案生成可一次并发完成）
+    scheduler_max_per_key: int = 8          # 每个API Key同时进行的上限（共享默认Key时尤其重要）
+    scheduler_max_queue: int = 200          # 全局排队上限，超出返回429
+    scheduler_max_queue_per_client: int = 30  # 每个客户端排队上限（未带X-Client-ID的请求共用default客户端，需留足余量）
+    scheduler_client_weights: Dict[str, float] = {}  # 客户端ID → 调度权重（默认1.0）
+    
+    # Job Configuration（异步任务）
+    job_workers: int = 4                    # 后台执行任务的worker数
+    job_max_attempts: int = 3               # 任务因重启中断后最多执行的次数
+    job_ttl: float = 7 * 24 * 3600.0        # 已结束任务的保留时间（秒）
+    job_long_poll_max: float = 60.0         # 长轮询最长等待时间（秒）
+    
+    # Batch Generation Configuration（批量生成）
+    batch_max_items: int = 50               # 单个批次最多包含的表盘数
+    batch_max_concurrency: int = 4          # 批次内同时生成的表盘数（仍受调度器的客户端并发上限约束）
+    batch_queue_retries: int = 5            # 单个表盘排队已满（429）时等待后重试的次数
+    
+    # Variant Generation Configuration（多方案并行生成）
+    variants_max: int = 4                   # 单次请求最多生成的方案数
+    variant_temperatures: List[float] = [0.7, 0.9, 1.0, 0.8]  # 各方案的采样温度（按序号循环使用）
+    variant_style_hints: List[str] = [      # 各方案附加的风格方向（第一个方案为空，与普通生成一致）
+        "",
+        "极简风格：大面积留白、细线条、克制的配色",
+        "科技风格：深色背景、霓虹高亮、数据化的信息展示",
+        "复古拟物风格：表盘刻度、金属/皮革质感、衬线字体",
+    ]
+    
+    # Hedging Configuration（生成请求长尾对冲）
+    hedging_enabled: bool = False           # 首个调用超过对冲延迟仍未返回时再发一个相同请求
+    hedge_delay_percentile: float = 0.9     # 对冲延迟取最近补全耗时的该分位数
+    hedge_min_delay: float = 5.0            # 对冲延迟下限（秒）
+    hedge_initial_delay: float = 90.0       # 样本不足时的对冲延迟（秒）
+    hedge_min_samples: int = 20             # 使用分位数前至少需要的样本数
+    hedge_budget_ratio: float = 0.1         # 触发对冲的请求最多占比
+    
+    # LLM Cassette Configuration（LLM调用录制/回放）
+    llm_cassette_mode: str = "off"          # off / record（录制真实调用）/ replay（只从语料回放，不访问网络）
+    llm_cassette_path: str = ""             # 语料文件（JSONL），为空时使用 storage/cassettes/llm.jsonl
+    llm_cassette_replay_latency: bool = False  # 回放时按录制的首字/总耗时等待（性能基准用）
+    
+    # Stream Extraction Configuration（流式代码提取与异常输出提前中止）
+    stream_abort_enabled: bool = True       # 流式输出明显异常时提前中止并重新生成
+    stream_abort_prose_tokens: int = 1000   # 正文超过该token数仍未出现代码时中止
+    stream_abort_repeat_lines: int = 40     # 代码中连续出现该行数的相同内容时中止（模型陷入循环）
+    stream_malformed_retries: int = 1       # 提前中止后重新生成的次数
+    
+    # Diff Configuration（代码差异计算）
+    diff_context_lines: int = 3             # hunk中变更前后保留的上下文行数
+    diff_max_edit_distance: int = 1000      # Myers差分的编辑距离上限，超出时整段按删除+新增处理
+    diff_offload_chars: int = 20000         # 新旧代码总字符数超过该值时在线程池中计算差异
+    
+    # Metrics Configuration（Prometheus指标）
+    metrics_enabled: bool = True  # 是否记录HTTP请求指标并开放 /metrics
+    
+    # Tracing Configuration（请求级链路追踪）
+    tracing_exporter: str = "file"  # off / file（本地JSON行文件）/ otlp（OTLP/HTTP JSON收集器）
+    tracing_file: str = ""  # file导出路径，留空为 storage/traces/traces.jsonl
+    tracing_file_max_bytes: int = 50 * 1024 * 1024  # 追踪文件大小上限，超过后轮转（保留一个旧文件）
+    tracing_otlp_endpoint: str = "http://127.0.0.1:4318/v1/traces"  # OTLP收集器地址
+    tracing_sample_rate: float = 1.0  # 请求采样比例
+    tracing_queue_size: int = 1000  # 待导出trace队列长度，队列满时丢弃
+    
+    # Usage Accounting Configuration（按客户端/项目统计token用量）
+    usage_tracking_enabled: bool = True
+    usage_flush_interval: float = 5.0  # 用量记录批量写盘的间隔（秒）
+    usage_record_retention_days: int = 90  # 逐条用量记录保留天数（每日汇总长期保留）
+    usage_query_max_days: int = 400  # 单次汇总查询最多覆盖的天数
+    usage_top_n: int = 20  # 汇总查询返回的客户端/项目排行条数
+    
+    # Logging Configuration（异步结构化日志）
     log_level: str = "INFO"
+    log_json: bool = True  # 日志文件使用JSON行格式
+    log_max_bytes: int = 20 * 1024 * 1024  # 单个日志文件大小上限，超过后轮转
+    log_backup_count: int = 5  # 保留的轮转日志文件数
+    log_queue_size: int = 10000  # 日志队列长度，队列满时丢弃新日志而不阻塞请求
+    log_max_message_chars: int = 4000  # 单条日志消息最大字符数
+    log_payload_max_chars: int = 500  # LLM原始输出等大段内容默认只记录的字符数
+    log_payload_sample_rate: float = 0.01  # 记录大段内容全文的采样比例
     
     # CORS Configuration
     cors_origins: list = [
@@ -1,5 +1,5 @@
 """
-表盘项目文件生成器 - 生成标准 HTML 项目
+表盘项目文件生成器 - 按项目的输出目标生成 HTML / BlueOS .ux 项目
 """
 
 import json
@@ -12,28 +12,32 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from models.project import WatchfaceConfig, ProjectMetadata
 from models.assets import WatchfaceAssets
+from targets import get_target
+from utils.tracing import traced
 
 
 class WatchfaceProjectGenerator:
-    """表盘项目生成器 - 生成 HTML 项目"""
+    """表盘项目生成器 - 入口文件和README由项目的输出目标决定"""
     
     def __init__(self, metadata: ProjectMetadata):
         self.metadata = metadata
         self.config = metadata.config
         self.assets = metadata.assets
+        self.target = get_target(metadata.target)
     
-    def generate_file_structure(self, html_content: str) -> Dict[str, str]:
+    @traced("generator.generate_file_structure")
+    def generate_file_structure(self, code_content: str) -> Dict[str, str]:
         """
         生成文件结构
         
         Args:
-            html_content: index.html 文件内容
+            code_content: 入口文件（index.html / index.ux）内容
             
         Returns:
             文件路径 -> 文件内容的字典
         """
         files = {
-            "index.html": html_content,
+            self.target.entry_file: code_content,
             "README.md": self._generate_readme(),
         }
         
@@ -47,41 +51,9 @@ class WatchfaceProjectGenerator:
     def _generate_readme(self) -> str:
         """生成 README 文件"""
         asset_count = len(self.assets.get_all_filenames())
-        
-        return f"""# {self.config.watchface_name}
-
-## AI 生成的智能表盘
-
-使用 AI 智能生成的表盘 UI，支持多种样式和功能。
-
-### 运行方式
-
-直接在浏览器中打开 `index.html` 文件即可预览表盘。
-
-### 项目特点
-
-- ✨ AI 智能生成代码
-- 🎨 灵活的样式定制
-- 📱 响应式设计
-- ⚡ 纯前端实现，无需服务器
-
-### 素材
-
-- 素材文件数量: {asset_count}
-- 素材目录: `assets/`
-
-### 技术栈
-
-- HTML5
-- CSS3
-- JavaScript (ES6+)
-- SVG / Canvas（可选）
-
-### 自定义
-
-可以通过编辑 `index.html` 来调整表盘样式和功能。
-"""
+        return self.target.readme(self.config.watchface_name, asset_count)
     
+    @traced("generator.generate_file_tree")
     def generate_file_tree(self, files: Dict[str, str]) -> Dict[str, Any]:
         """生成文件树结构"""
         tree = {
@@ -128,6 +100,8 @@ class WatchfaceProjectGenerator:
         """根据文件路径检测语言类型"""
         if file_path.endswith('.html'):
             return 'html'
+        elif file_path.endswith('.ux'):
+            return get_target('ux').language
         elif file_path.endswith('.json'):
             return 'json'
         elif file_path.endswith('.js'):
@@ -1,9 +1,28 @@
 """
 日志配置模块
+
+日志写入不在请求的关键路径上：业务代码只把记录放入内存队列（队列满时丢弃并计数，绝不阻塞），
+由后台线程（QueueListener）统一格式化并写入终端和按大小轮转的日志文件。
+
+- 日志文件每行一条JSON记录，带请求ID（request_id_var，由main.py的中间件按请求设置）
+- 单条消息超过 log_max_message_chars 时截断
+- LLM原始输出等大段内容通过 log_payload 记录：默认只保留前 log_payload_max_chars 个字符，
+  按 log_payload_sample_rate 的比例采样记录全文
 """
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
+import random
 import sys
+import uuid
+from contextvars import ContextVar, Token
+from datetime import datetime
 from pathlib import Path
+from typing import Optional
+
+from config import settings
 
 # 日志目录
 LOG_DIR = Path(__file__).parent.parent / "logs"
@@ -12,46 +31,176 @@ LOG_DIR.mkdir(exist_ok=True)
 # 日志文件路径
 LOG_FILE = LOG_DIR / "backend.log"
 
+# 当前请求ID（按asyncio任务上下文隔离）
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+
+def bind_request_id(request_id: Optional[str] = None) -> Token:
+    """为当前上下文设置请求ID（未提供时随机生成），返回用于恢复的token"""
+    return request_id_var.set(request_id or uuid.uuid4().hex[:16])
+
+
+def get_request_id() -> Optional[str]:
+    """获取当前上下文的请求ID"""
+    return request_id_var.get()
+
+
+def _truncate(text: str, limit: int) -> str:
+    if limit and len(text) > limit:
+        return f"{text[:limit]}...（已截断，共 {len(text)} 字符）"
+    return text
+
+
+class _ContextFilter(logging.Filter):
+    """在调用方线程中补充请求ID并截断过长的消息（此时上下文变量仍然可用）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        if not getattr(record, "full_payload", False):
+            message = record.getMessage()
+            if len(message) > settings.log_max_message_chars:
+                record.msg = _truncate(message, settings.log_max_message_chars)
+                record.args = None
+        return True
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """只做最少的工作就放入队列；队列满时丢弃记录而不是阻塞请求"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 异常堆栈必须在调用方线程中格式化，其余格式化交给后台线程
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录一行JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", None),
+            "message": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """终端可读格式：时间 - 名称 - 级别 - [请求ID] 消息，附加字段截断显示"""
+
+    def __init__(self):
+        super().__init__(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+            datefmt='%Y-%m-%d %H:%M:%S'
+        )
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            head, sep, tail = text.partition(f" - {record.levelname} - ")
+            text = f"{head}{sep}[{request_id}] {tail}"
+        fields = getattr(record, "fields", None)
+        if fields:
+            text += "\n" + "\n".join(f"    {key}: {_truncate(str(value), 300)}" for key, value in fields.items())
+        return text
+
+
+def log_payload(message: str, payload: Optional[str], level: int = logging.INFO, **fields):
+    """
+    记录大段内容（LLM原始输出、思考过程等）
+
+    默认只记录前 log_payload_max_chars 个字符；按 log_payload_sample_rate 的比例采样记录全文，
+    采样记录带 payload_sampled=true，便于离线分析真实的输出分布。
+
+    Args:
+        message: 日志消息
+        payload: 大段内容
+        level: 日志级别
+        **fields: 其他结构化字段
+    """
+    if not logger.isEnabledFor(level):
+        return
+    payload = payload or ""
+    sampled = random.random() < settings.log_payload_sample_rate
+    fields.update(
+        payload=payload if sampled else _truncate(payload, settings.log_payload_max_chars),
+        payload_chars=len(payload),
+        payload_sampled=sampled,
+    )
+    logger.log(level, message, extra={"fields": fields, "full_payload": sampled})
+
 
 def setup_logging():
-    """配置日志系统"""
-    
+    """配置日志系统：业务线程只入队，后台线程写终端和轮转文件"""
+
     # 创建logger
     logger = logging.getLogger("watchface_backend")
-    logger.setLevel(logging.INFO)
-    
+    logger.setLevel(settings.log_level.upper())
+
     # 清除已有的handlers
     logger.handlers.clear()
-    
-    # 文件handler
-    file_handler = logging.FileHandler(LOG_FILE, encoding='utf-8')
-    file_handler.setLevel(logging.INFO)
-    
+
+    # 文件handler（按大小轮转）
+    file_handler = logging.handlers.RotatingFileHandler(
+        LOG_FILE,
+        maxBytes=settings.log_max_bytes,
+        backupCount=settings.log_backup_count,
+        encoding='utf-8'
+    )
+    file_handler.setFormatter(JsonFormatter() if settings.log_json else ConsoleFormatter())
+
     # 终端handler
     console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(logging.INFO)
-    
-    # 格式化
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
-    
-    # 添加handlers
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-    
-    return logger
+    console_handler.setFormatter(ConsoleFormatter())
+
+    # 队列handler：调用方只入队
+    queue_handler = _NonBlockingQueueHandler(queue.Queue(maxsize=settings.log_queue_size))
+    queue_handler.addFilter(_ContextFilter())
+    logger.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(queue_handler.queue, file_handler, console_handler)
+    listener.start()
+    # 进程退出时写完队列中剩余的日志
+    atexit.register(listener.stop)
+
+    return logger, queue_handler
 
 
 # 全局logger
-logger = setup_logging()
+logger, _queue_handler = setup_logging()
 
 
 def get_logger():
     """获取logger实例"""
     return logger
 
+
+def get_logging_stats() -> dict:
+    """日志队列统计（积压数、因队列已满丢弃的记录数）"""
+    return {
+        "queued": _queue_handler.queue.qsize(),
+        "dropped": _queue_handler.dropped,
+        "queue_size": settings.log_queue_size,
+    }
@@ -4,13 +4,19 @@
 """
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.routing import APIRoute
+from fastapi.responses import FileResponse, StreamingResponse, Response
 from pydantic import BaseModel
-from typing import Optional, List, Dict
-from datetime import datetime
+from typing import AsyncIterator, Optional, List, Dict, Tuple
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from starlette.routing import Match
 import uvicorn
+import asyncio
+import time
 import uuid
 import shutil
+from urllib.parse import quote
 from pathlib import Path
 import zipfile
 import io
@@ -18,7 +24,7 @@ import os
 import json
 
 from config import settings
-from logging_config import get_logger
+from logging_config import get_logger, get_logging_stats, bind_request_id, get_request_id, request_id_var
 from code_agent import WatchFaceCodeAgent
 from models import (
     AssetType,
@@ -28,48 +34,138 @@ from models import (
     ProjectMetadata,
     ConversationItem,
     GenerateProjectRequest,
+    BatchGenerateItem,
+    BatchGenerateRequest,
     EditProjectRequest,
     ProjectFile,
     GenerateProjectResponse
 )
 from generators import WatchfaceProjectGenerator
+from targets import OutputTarget, get_target
 from utils import save_project, load_project, generate_unique_filename, list_projects, load_project_with_conversation
 from utils.storage import get_upload_path, delete_project, delete_all_projects
 from utils.api_key_manager import api_key_manager
+from utils.llm_client_pool import llm_client_pool, hash_api_key
+from utils.generation_cache import generation_cache
+from utils.single_flight import single_flight
+from utils.token_budget import token_budget
+from utils.hedging import hedger
+from utils.llm_cassette import llm_cassette
+from utils.llm_transport import llm_transport
+from utils.scheduler import llm_scheduler, SchedulerRejected, Ticket, ticket_var
+from utils.job_store import job_store, JobRetryLater
+from utils.metrics import metrics, endpoint_var
+from utils.tracing import tracer, traced
+from utils.usage_tracker import usage_tracker
+from utils.model_router import model_router
+from utils.conversation_summary import conversation_summarizer
 
 # Initialize logger
 logger = get_logger()
 
-# 默认Code Agent（使用系统配置的API Key）
-default_code_agent = None
-
-def get_code_agent_for_client(client_id: Optional[str] = None) -> WatchFaceCodeAgent:
+@traced("agent.get_for_client")
+def get_code_agent_for_client(client_id: Optional[str] = None, target: str = "html") -> WatchFaceCodeAgent:
     """
     根据客户端ID获取对应的Code Agent实例
     
+    Agent按API Key + 输出目标从llm_client_pool中复用，所有Agent共享同一个HTTP连接池。
+    
     Args:
         client_id: 客户端ID（从请求header中获取）
+        target: 输出目标（html / ux）
         
     Returns:
         WatchFaceCodeAgent实例
     """
-    global default_code_agent
-    
     if client_id:
         # 尝试获取客户端设置的API Key
         api_key = api_key_manager.get_api_key(client_id)
         
         if api_key:
-            # 使用客户端的API Key创建专属agent
             logger.info(f"🔑 使用客户端API Key: {client_id[:16]}...")
-            return WatchFaceCodeAgent(api_key=api_key, client_id=client_id)
+            return llm_client_pool.get_agent(api_key=api_key, client_id=client_id, target=target)
     
     # 使用默认API Key
-    if default_code_agent is None:
-        logger.info(f"🔑 使用默认API Key")
-        default_code_agent = WatchFaceCodeAgent()
+    return llm_client_pool.get_agent(target=target)
+
+
+def _api_key_hash(client_id: Optional[str]) -> str:
+    """客户端实际使用的API Key标识（用于按Key限制并发），使用默认Key时为default"""
+    api_key = api_key_manager.get_api_key(client_id) if client_id else None
+    return hash_api_key(api_key) if api_key else "default"
+
+
+def _record_usage(
+    kind: str,
+    client_id: Optional[str],
+    project_id: str,
+    code_agent: WatchFaceCodeAgent,
+    result: Dict,
+    ticket: Ticket
+):
+    """记录一次请求的token用量，按客户端、API Key和项目归属（结果中没有usage时跳过）"""
+    usage = result.get("usage")
+    if not usage:
+        return
+    usage_tracker.record(
+        kind=kind,
+        client_id=client_id or "default",
+        api_key_hash=_api_key_hash(client_id),
+        project_id=project_id,
+        model=(result.get("route") or {}).get("model") or code_agent.model,
+        usage=usage,
+        queue_wait=ticket.wait_time,
+        success=bool(result.get("success"))
+    )
+
+
+def _schedule_summary(project_id: str, client_id: Optional[str], target: str):
+    """保存后在后台更新项目的设计决策摘要（使用客户端自己的Agent和API Key）"""
+    conversation_summarizer.schedule(
+        project_id,
+        get_code_agent_for_client(client_id, target),
+        client_id,
+        _api_key_hash(client_id)
+    )
+
+
+def _queue_full_error(e: SchedulerRejected) -> HTTPException:
+    return HTTPException(
+        429,
+        f"服务繁忙，请 {e.retry_after} 秒后重试",
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+
+@asynccontextmanager
+async def _llm_slot(client_id: Optional[str]) -> AsyncIterator[Ticket]:
+    """
+    获取一次LLM调用的执行权（全局/客户端/API Key并发上限 + 公平排队）
     
-    return default_code_agent
+    Raises:
+        HTTPException(429): 排队已满，带Retry-After
+    """
+    try:
+        ticket = llm_scheduler.enqueue(client_id or "default", _api_key_hash(client_id))
+    except SchedulerRejected as e:
+        raise _queue_full_error(e)
+    
+    with tracer.span("scheduler.queue_wait"):
+        await llm_scheduler.wait(ticket)
+    metrics.observe_stage("queue_wait", ticket.wait_time, settings.minimax_model)
+    token = ticket_var.set(ticket)
+    try:
+        yield ticket
+    finally:
+        ticket_var.reset(token)
+        llm_scheduler.release(ticket)
+
+class TracedRoute(APIRoute):
+    """路由处理函数记录为追踪span，与根span对比即可区分处理函数本身和之后的响应序列化耗时"""
+    
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, traced(f"handler {path}")(endpoint), **kwargs)
+
 
 # Create FastAPI app
 app = FastAPI(
@@ -77,6 +173,7 @@ app = FastAPI(
     version="2.0.0",
     description="AI-powered watchface code generation with HTML/CSS/JS"
 )
+app.router.route_class = TracedRoute
 
 # Configure CORS
 app.add_middleware(
@@ -88,6 +185,88 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def tracing_middleware(request: Request, call_next):
+    """
+    为每个请求开始一条trace（兼容W3C traceparent），响应体发送完毕时结束根span
+    
+    流式响应的生成过程发生在响应头之后，因此根span在响应体迭代结束时才结束。
+    """
+    root = tracer.start_trace(
+        f"{request.method} {_route_template(request)}",
+        request.headers.get("traceparent"),
+        request_id=get_request_id(),
+        method=request.method,
+    )
+    root.activate()
+    try:
+        response = await call_next(request)
+    except Exception as e:
+        root.record_error(e)
+        root.end()
+        raise
+    finally:
+        root.deactivate()
+    
+    root.set_attribute("status_code", response.status_code)
+    if root.trace_id:
+        response.headers["X-Trace-ID"] = root.trace_id
+    body_iterator = response.body_iterator
+    
+    async def traced_body():
+        try:
+            async for chunk in body_iterator:
+                yield chunk
+        finally:
+            root.end()
+    
+    response.body_iterator = traced_body()
+    return response
+
+
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    """为每个请求绑定请求ID（优先使用客户端传入的 X-Request-ID），日志记录中携带该ID"""
+    token = bind_request_id(request.headers.get("X-Request-ID"))
+    try:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = get_request_id()
+        return response
+    finally:
+        request_id_var.reset(token)
+
+
+def _route_template(request: Request) -> str:
+    """匹配到的路由模板（如 /api/project/{project_id}），用作指标标签，避免按ID产生大量时间序列"""
+    for route in app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return getattr(route, "path", "other")
+    return "unmatched"
+
+
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """记录请求数和耗时，并把路由模板写入endpoint_var供流水线各阶段的指标使用"""
+    if not settings.metrics_enabled:
+        return await call_next(request)
+    
+    endpoint = _route_template(request)
+    token = endpoint_var.set(endpoint)
+    started_at = time.perf_counter()
+    status = "5xx"
+    try:
+        response = await call_next(request)
+        status = f"{response.status_code // 100}xx"
+        return response
+    finally:
+        metrics.http_request_seconds.observe(
+            time.perf_counter() - started_at, endpoint=endpoint, method=request.method
+        )
+        metrics.http_requests.inc(endpoint=endpoint, method=request.method, status=status)
+        endpoint_var.reset(token)
+
+
 # ============= 基础接口 =============
 
 @app.get("/")
@@ -101,6 +280,11 @@ async def root():
             "upload_asset": "POST /api/upload-asset",
             "generate_project": "POST /api/generate-project",
             "edit_project": "POST /api/edit-project",
+            "generate_project_stream": "POST /api/generate-project/stream (SSE)",
+            "edit_project_stream": "POST /api/edit-project/stream (SSE)",
+            "submit_generate_job": "POST /api/jobs/generate-project",
+            "submit_edit_job": "POST /api/jobs/edit-project",
+            "get_job": "GET /api/jobs/{job_id}?wait=30",
             "download_project": "GET /api/download-project/{project_id}",
             "get_session": "GET /api/session/{session_id}"
         }
@@ -109,14 +293,143 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """健康检查"""
+    """健康检查（包含LLM上游熔断器状态）"""
+    breaker = llm_transport.breaker.get_state()
     return {
-        "status": "healthy",
+        "status": "healthy" if breaker["state"] == "closed" else "degraded",
         "timestamp": datetime.now().isoformat(),
-        "agent_status": "ready"
+        "agent_status": "ready" if breaker["state"] != "open" else "circuit_open",
+        "llm_circuit": breaker
     }
 
 
+@app.get("/api/llm-transport/stats")
+async def llm_transport_stats():
+    """LLM传输层统计（调用次数、重试次数、按类型的失败次数、熔断器状态）"""
+    return llm_transport.get_stats()
+
+
+@app.get("/api/llm-pool/stats")
+async def llm_pool_stats():
+    """LLM客户端池统计（Agent复用命中率、HTTP连接复用情况）"""
+    return llm_client_pool.get_stats()
+
+
+@app.get("/api/generation-cache/stats")
+async def generation_cache_stats():
+    """生成缓存统计（命中/未命中次数、条目数、占用空间）"""
+    return generation_cache.get_stats()
+
+
+@app.get("/api/single-flight/stats")
+async def single_flight_stats():
+    """请求合并统计（进行中的调用数、被合并的重复请求数）"""
+    return single_flight.get_stats()
+
+
+@app.get("/api/scheduler/stats")
+async def scheduler_stats():
+    """LLM调度统计（运行中/排队中的请求数、等待时间分位数、拒绝次数、各客户端状态）"""
+    return llm_scheduler.get_stats()
+
+
+@app.get("/api/token-budget/stats")
+async def token_budget_stats():
+    """Token预算统计（各类请求的预估与实际用量、截断次数、当前学习值）"""
+    return token_budget.get_stats()
+
+
+@app.get("/api/routing/stats")
+async def routing_stats():
+    """模型路由统计（各档位的决策次数、成功率、耗时分位数、平均token，用于调整分类阈值）"""
+    return model_router.get_stats()
+
+
+@app.get("/api/conversation-summary/stats")
+async def conversation_summary_stats():
+    """对话摘要统计（进行中的任务数、更新/回退/排队已满/失败次数、摘要长度上限）"""
+    return conversation_summarizer.get_stats()
+
+
+@app.get("/api/hedging/stats")
+async def hedging_stats():
+    """对冲统计（对冲次数、对冲胜出次数、当前对冲延迟、延迟分位数）"""
+    return hedger.get_stats()
+
+
+@app.get("/api/llm-cassette/stats")
+async def llm_cassette_stats():
+    """LLM录制/回放统计（当前模式、语料路径、录制/回放/未命中次数）"""
+    return llm_cassette.get_stats()
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus指标（文本格式）"""
+    if not settings.metrics_enabled:
+        raise HTTPException(404, "指标未开启")
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/tracing/stats")
+async def tracing_stats():
+    """链路追踪统计（导出方式、已记录/已导出/丢弃的trace数）"""
+    return tracer.get_stats()
+
+
+@app.get("/api/logging/stats")
+async def logging_stats():
+    """日志队列统计（积压数、因队列已满丢弃的记录数）"""
+    return get_logging_stats()
+
+
+@app.get("/api/usage/stats")
+async def usage_stats():
+    """Token用量记录统计（已记录/待写盘的记录数、今天尚未写盘的用量）"""
+    return usage_tracker.get_stats()
+
+
+@app.get("/api/usage/daily")
+async def usage_daily(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    days: int = 30,
+    client_id: Optional[str] = None,
+    project_id: Optional[str] = None
+):
+    """
+    按天汇总的token用量（只读取每日汇总，查询数月范围也很快）
+    
+    Args:
+        start / end: 日期范围 YYYY-MM-DD（含两端），end默认今天，start默认end之前days天
+        days: 未指定start时统计的天数
+        client_id: 只统计该客户端
+        project_id: 只统计该项目
+    """
+    try:
+        end_date = date.fromisoformat(end) if end else date.today()
+        start_date = date.fromisoformat(start) if start else end_date - timedelta(days=max(days, 1) - 1)
+    except ValueError:
+        raise HTTPException(400, "日期格式应为 YYYY-MM-DD")
+    if start_date > end_date:
+        raise HTTPException(400, "start不能晚于end")
+    if (end_date - start_date).days + 1 > settings.usage_query_max_days:
+        raise HTTPException(400, f"查询范围不能超过 {settings.usage_query_max_days} 天")
+    return await usage_tracker.query(start_date, end_date, client_id, project_id)
+
+
+@app.on_event("shutdown")
+async def close_llm_client_pool():
+    """
+    应用关闭时先停止后台任务（未完成的任务下次启动时恢复）和对话摘要任务（下次保存时继续合并），
+    写出待写盘的用量记录，再释放共享的HTTP连接池
+    """
+    await job_store.stop()
+    await conversation_summarizer.stop()
+    await usage_tracker.flush()
+    await llm_client_pool.aclose()
+
+
 # ============= 素材上传接口 =============
 
 @app.post("/api/upload-asset")
@@ -165,6 +478,7 @@ async def upload_asset(
             file_size=file_path.stat().st_size,
             mime_type=file.content_type or "image/png"
         )
+        metrics.upload_bytes.observe(asset_file.file_size, endpoint=endpoint_var.get())
         
         logger.info(f"✅ 素材上传成功: {stored_filename}")
         
@@ -222,6 +536,7 @@ async def upload_batch_assets(
         with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as temp_zip:
             shutil.copyfileobj(file.file, temp_zip)
             temp_zip_path = temp_zip.name
+        metrics.upload_bytes.observe(os.path.getsize(temp_zip_path), endpoint=endpoint_var.get())
         
         try:
             # 解压ZIP文件
@@ -314,6 +629,241 @@ async def upload_batch_assets(
 
 # ============= 项目生成接口 =============
 
+def _build_project_metadata(request: GenerateProjectRequest, client_id: Optional[str]) -> ProjectMetadata:
+    """为新建项目创建元数据"""
+    return ProjectMetadata(
+        project_id=str(uuid.uuid4()),
+        session_id=request.session_id,
+        client_id=client_id or "default",  # 保存客户端ID
+        created_at=datetime.now().isoformat(),
+        updated_at=datetime.now().isoformat(),
+        config=request.config or WatchfaceConfig(),
+        assets=request.assets,
+        target=request.target,
+        last_instruction=request.instruction
+    )
+
+
+def _build_file_list(files: Dict[str, str], generator: WatchfaceProjectGenerator) -> List[ProjectFile]:
+    """构建响应中的文件列表（跳过二进制素材）"""
+    return [
+        ProjectFile(
+            path=path,
+            content=content,
+            language=generator.detect_language(path)
+        )
+        for path, content in files.items()
+        if content != "[BINARY_FILE]"
+    ]
+
+
+def _variant_path(variant: int, target: OutputTarget) -> str:
+    """方案代码文件路径（variants/variant_N.html / variants/variant_N.ux）"""
+    return f"variants/variant_{variant}{os.path.splitext(target.entry_file)[1]}"
+
+
+def _variant_files(variants: List[Dict], target: OutputTarget) -> Dict[str, str]:
+    """多方案生成中成功方案的代码文件"""
+    return {
+        _variant_path(variant["variant"], target): variant["code"]
+        for variant in variants
+        if variant["success"]
+    }
+
+
+def _variant_summaries(variants: List[Dict], target: OutputTarget) -> List[Dict]:
+    """保存到metadata的各方案摘要（不含代码）"""
+    return [
+        {
+            "variant": variant["variant"],
+            "file": _variant_path(variant["variant"], target) if variant["success"] else None,
+            "success": variant["success"],
+            "message": variant.get("message", ""),
+            "temperature": variant["temperature"],
+            "style_hint": variant["style_hint"],
+            "cached": variant.get("cached", False),
+            "stats": variant.get("stats"),
+        }
+        for variant in variants
+    ]
+
+
+async def _save_generated_project(
+    metadata: ProjectMetadata,
+    instruction: str,
+    result: Dict
+) -> GenerateProjectResponse:
+    """
+    将Code Agent的生成结果保存为新项目并构建响应
+    
+    Args:
+        metadata: 新项目元数据
+        instruction: 用户指令
+        result: process_instruction返回的结果字典（需已成功）
+    """
+    started_at = time.perf_counter()
+    code_content = result.get("code", "")
+    
+    # 生成完整项目结构
+    generator = WatchfaceProjectGenerator(metadata)
+    files = generator.generate_file_structure(code_content)
+    if result.get("variants"):
+        # 多方案：各方案作为同级版本保存，入口文件为当前采用的方案
+        files.update(_variant_files(result["variants"], generator.target))
+        metadata.variants = _variant_summaries(result["variants"], generator.target)
+        metadata.selected_variant = result.get("variant")
+    file_tree = generator.generate_file_tree(files)
+    
+    # 添加对话历史（保留agent完整的生成内容）
+    assistant_message = result.get("message", "✅ 项目生成成功")
+    
+    # 构建完整的assistant回复内容
+    assistant_full_content = f"{assistant_message}\n\n"
+    if result.get("stats"):
+        stats = result.get("stats")
+        assistant_full_content += f"📊 代码统计：{stats.get('lines', 0)}行 | {stats.get('characters', 0)}字符"
+    if result.get("variants"):
+        succeeded = sum(1 for variant in result["variants"] if variant["success"])
+        assistant_full_content += (
+            f"\n🎲 共生成 {succeeded}/{len(result['variants'])} 个方案，当前采用方案 {result.get('variant')}"
+        )
+    
+    conversation_history = [
+        ConversationItem(
+            role="user",
+            content=instruction,
+            timestamp=datetime.now().isoformat()
+        ),
+        ConversationItem(
+            role="assistant",
+            content=assistant_full_content.strip(),  # 保存完整的assistant回复内容
+            timestamp=datetime.now().isoformat(),
+            reasoning=result.get("reasoning", ""),  # 思考过程
+            raw_content=result.get("raw_content", ""),  # 🆕 Agent返回的完整原始内容
+            code_snapshot=code_content[:500] if code_content else "",  # 代码快照
+            full_message=result.get("message", "")  # 原始message
+        )
+    ]
+    metadata.conversation_history = conversation_history
+    metadata.generation_count = 1
+    
+    # 保存项目
+    save_started_at = time.perf_counter()
+    await save_project(metadata.project_id, files, metadata)
+    save_time = time.perf_counter() - save_started_at
+    metrics.observe_stage("save_project", save_time)
+    _schedule_summary(metadata.project_id, metadata.client_id, generator.target.name)
+    
+    # 构建响应
+    file_list = _build_file_list(files, generator)
+    
+    logger.info(f"✅ 项目生成成功")
+    logger.info(f"   文件数: {len(file_list)}")
+    
+    response = GenerateProjectResponse(
+        project_id=metadata.project_id,
+        files=file_list,
+        file_tree=file_tree,
+        reasoning=result.get("reasoning", ""),
+        success=True,
+        message="项目生成成功",
+        conversation_history=[item.dict() for item in metadata.conversation_history],
+        variants=metadata.variants or None,
+        target=generator.target.name,
+        entry_file=generator.target.entry_file
+    )
+    metrics.observe_stage("response_build", time.perf_counter() - started_at - save_time)
+    return response
+
+
+async def _run_generate_project(
+    request: GenerateProjectRequest,
+    x_client_id: Optional[str]
+) -> GenerateProjectResponse:
+    """生成新项目：调度排队 → 调用Code Agent → 保存项目（同步接口和后台任务共用）"""
+    # 根据客户端ID和输出目标获取对应的Code Agent
+    code_agent = get_code_agent_for_client(x_client_id, request.target)
+    
+    # 创建项目元数据
+    metadata = _build_project_metadata(request, x_client_id)
+    
+    logger.info(f"   项目ID: {metadata.project_id}")
+    logger.info(f"   项目名称: {metadata.config.watchface_name}")
+    
+    variant_count = min(max(request.variants, 1), settings.variants_max)
+    
+    async def run_variants() -> Tuple[Dict, Ticket]:
+        # 每个方案单独经调度器排队，并发的方案各占一个执行权
+        tickets: List[Ticket] = []
+        rejections: List[HTTPException] = []
+        
+        @asynccontextmanager
+        async def variant_slot() -> AsyncIterator[Ticket]:
+            try:
+                async with _llm_slot(x_client_id) as variant_ticket:
+                    tickets.append(variant_ticket)
+                    yield variant_ticket
+            except HTTPException as e:
+                if e.status_code == 429:
+                    rejections.append(e)
+                raise
+        
+        result = await code_agent.generate_variants(
+            user_input=request.instruction,
+            assets=metadata.assets,
+            config=metadata.config,
+            count=variant_count,
+            use_cache=request.use_cache,
+            slot=variant_slot
+        )
+        if not tickets:
+            # 所有方案都没有排上队
+            raise rejections[0]
+        # 排队信息以最先获得执行权的方案为准
+        return result, tickets[0]
+    
+    async def run_generation() -> GenerateProjectResponse:
+        # 调用Code Agent生成代码（经调度器排队）
+        if variant_count > 1:
+            result, ticket = await run_variants()
+        else:
+            async with _llm_slot(x_client_id) as ticket:
+                result = await code_agent.process_instruction(
+                    user_input=request.instruction,
+                    current_code=None,
+                    conversation_history=[],
+                    assets=metadata.assets,
+                    config=metadata.config,
+                    use_cache=request.use_cache
+                )
+        _record_usage(
+            "variants" if variant_count > 1 else "generate",
+            x_client_id, metadata.project_id, code_agent, result, ticket
+        )
+        
+        if not result.get("success"):
+            raise HTTPException(500, result.get("message", "代码生成失败"))
+        
+        response = await _save_generated_project(metadata, request.instruction, result)
+        response.queue_position = ticket.position
+        response.queue_wait = round(ticket.wait_time, 3)
+        return response
+    
+    # 合并进行中的相同请求（双击/重试），只调用一次LLM、只创建一个项目
+    flight_key = single_flight.make_key(
+        "generate",
+        metadata.client_id,
+        request.session_id,
+        request.instruction,
+        request.json(include={"assets", "config", "variants", "target"})
+    )
+    response, shared = await single_flight.do(flight_key, run_generation)
+    if shared:
+        logger.info(f"🔗 合并重复的生成请求，复用项目: {response.project_id}")
+    
+    return response
+
+
 @app.post("/api/generate-project", response_model=GenerateProjectResponse)
 async def generate_project(
     request: GenerateProjectRequest,
@@ -332,97 +882,7 @@ async def generate_project(
     logger.info(f"   客户端ID: {x_client_id[:16] if x_client_id else 'None'}...")
     
     try:
-        # 根据客户端ID获取对应的Code Agent
-        code_agent = get_code_agent_for_client(x_client_id)
-        
-        # 创建项目元数据
-        metadata = ProjectMetadata(
-            project_id=str(uuid.uuid4()),
-            session_id=request.session_id,
-            client_id=x_client_id or "default",  # 保存客户端ID
-            created_at=datetime.now().isoformat(),
-            updated_at=datetime.now().isoformat(),
-            config=request.config or WatchfaceConfig(),
-            assets=request.assets,
-            last_instruction=request.instruction
-        )
-        
-        logger.info(f"   项目ID: {metadata.project_id}")
-        logger.info(f"   项目名称: {metadata.config.watchface_name}")
-        
-        # 调用Code Agent生成 HTML 代码
-        result = await code_agent.process_instruction(
-            user_input=request.instruction,
-            current_code=None,
-            conversation_history=[],
-            assets=metadata.assets,
-            config=metadata.config
-        )
-        
-        if not result.get("success"):
-            raise HTTPException(500, result.get("message", "代码生成失败"))
-        
-        html_content = result.get("code", "")
-        
-        # 生成完整项目结构
-        generator = WatchfaceProjectGenerator(metadata)
-        files = generator.generate_file_structure(html_content)
-        file_tree = generator.generate_file_tree(files)
-        
-        # 添加对话历史（保留agent完整的生成内容）
-        assistant_message = result.get("message", "✅ 项目生成成功")
-        
-        # 构建完整的assistant回复内容
-        assistant_full_content = f"{assistant_message}\n\n"
-        if result.get("stats"):
-            stats = result.get("stats")
-            assistant_full_content += f"📊 代码统计：{stats.get('lines', 0)}行 | {stats.get('characters', 0)}字符"
-        
-        conversation_history = [
-            ConversationItem(
-                role="user",
-                content=request.instruction,
-                timestamp=datetime.now().isoformat()
-            ),
-            ConversationItem(
-                role="assistant",
-                content=assistant_full_content.strip(),  # 保存完整的assistant回复内容
-                timestamp=datetime.now().isoformat(),
-                reasoning=result.get("reasoning", ""),  # 思考过程
-                raw_content=result.get("raw_content", ""),  # 🆕 Agent返回的完整原始内容
-                code_snapshot=html_content[:500] if html_content else "",  # 代码快照
-                full_message=result.get("message", "")  # 原始message
-            )
-        ]
-        metadata.conversation_history = conversation_history
-        metadata.generation_count = 1
-        
-        # 保存项目
-        await save_project(metadata.project_id, files, metadata)
-        
-        # 构建响应
-        file_list = [
-            ProjectFile(
-                path=path,
-                content=content,
-                language=generator.detect_language(path)
-            )
-            for path, content in files.items()
-            if content != "[BINARY_FILE]"
-        ]
-        
-        logger.info(f"✅ 项目生成成功")
-        logger.info(f"   文件数: {len(file_list)}")
-        
-        return GenerateProjectResponse(
-            project_id=metadata.project_id,
-            files=file_list,
-            file_tree=file_tree,
-            reasoning=result.get("reasoning", ""),
-            success=True,
-            message="项目生成成功",
-            conversation_history=[item.dict() for item in metadata.conversation_history]
-        )
+        return await _run_generate_project(request, x_client_id)
         
     except HTTPException:
         raise
@@ -435,6 +895,229 @@ async def generate_project(
 
 # ============= 项目编辑接口 =============
 
+async def _load_project_for_edit(request: EditProjectRequest, client_id: Optional[str]) -> Dict:
+    """
+    加载待编辑项目，校验权限并合并新上传的素材
+    
+    Returns:
+        编辑上下文字典：metadata_dict, files, metadata, target, current_code, conversation_history,
+        summary（设计决策摘要，尚未生成时为None）, client_id
+    """
+    # 加载现有项目
+    project_data = await load_project(request.project_id)
+    if not project_data:
+        raise HTTPException(404, "项目不存在")
+    
+    metadata_dict = project_data["metadata"]
+    files = project_data["files"]
+    
+    # 验证权限：检查项目是否属于当前客户端
+    project_client_id = metadata_dict.get("client_id", "default")
+    current_client_id = client_id or "default"
+    if project_client_id != current_client_id:
+        logger.warning(f"⚠️ 客户端 {current_client_id} 尝试访问客户端 {project_client_id} 的项目")
+        raise HTTPException(403, "无权访问此项目")
+    
+    logger.info(f"✅ 权限验证通过: 客户端 {current_client_id}")
+    
+    # 转换metadata为ProjectMetadata对象以获取assets、config和输出目标（旧项目没有target字段，为html）
+    metadata = ProjectMetadata(**metadata_dict)
+    target = get_target(metadata.target)
+    
+    # 查找入口文件（index.html / index.ux）
+    if target.entry_file not in files:
+        raise HTTPException(404, f"{target.entry_file} 文件不存在")
+    
+    # 合并新上传的素材（如果有）
+    if request.assets:
+        # 将新素材合并到现有素材中
+        if metadata.assets:
+            # 更新现有素材
+            if request.assets.background_round:
+                metadata.assets.background_round = request.assets.background_round
+            if request.assets.background_square:
+                metadata.assets.background_square = request.assets.background_square
+            if request.assets.pointer_hour:
+                metadata.assets.pointer_hour = request.assets.pointer_hour
+            if request.assets.pointer_minute:
+                metadata.assets.pointer_minute = request.assets.pointer_minute
+            if request.assets.pointer_second:
+                metadata.assets.pointer_second = request.assets.pointer_second
+            if request.assets.digits:
+                metadata.assets.digits = request.assets.digits
+            if request.assets.week_images:
+                metadata.assets.week_images = request.assets.week_images
+            if request.assets.decorations:
+                metadata.assets.decorations = request.assets.decorations
+        else:
+            # 如果之前没有素材，直接使用新素材
+            metadata.assets = request.assets
+    
+    return {
+        "metadata_dict": metadata_dict,
+        "files": files,
+        "metadata": metadata,
+        "target": target,
+        "current_code": files[target.entry_file],
+        "conversation_history": metadata_dict.get("conversation_history", []),
+        "summary": (await conversation_summarizer.load(request.project_id) or {}).get("summary"),
+        "client_id": current_client_id,
+    }
+
+
+async def _save_edited_project(
+    request: EditProjectRequest,
+    edit_context: Dict,
+    result: Dict
+) -> GenerateProjectResponse:
+    """
+    将Code Agent的编辑结果写回项目并构建响应
+    
+    Args:
+        request: 编辑项目请求
+        edit_context: _load_project_for_edit返回的编辑上下文
+        result: process_instruction返回的结果字典（需已成功）
+    """
+    started_at = time.perf_counter()
+    entry_file = edit_context["target"].entry_file
+    metadata_dict = edit_context["metadata_dict"]
+    files = edit_context["files"]
+    metadata = edit_context["metadata"]
+    conversation_history = edit_context["conversation_history"]
+    
+    new_code = result.get("code", edit_context["current_code"])
+    
+    # 更新项目文件
+    files[entry_file] = new_code
+    metadata_dict["updated_at"] = datetime.now().isoformat()
+    metadata_dict["generation_count"] = metadata_dict.get("generation_count", 0) + 1
+    metadata_dict["last_instruction"] = request.instruction
+    
+    # 确保 client_id 存在（兼容旧项目）
+    if "client_id" not in metadata_dict or not metadata_dict["client_id"]:
+        metadata_dict["client_id"] = edit_context["client_id"]
+    
+    # 更新metadata中的assets（确保新素材被保存）
+    if metadata.assets:
+        metadata_dict["assets"] = metadata.assets.dict()
+    
+    # 追加对话历史（保留agent完整的生成内容）
+    assistant_message = result.get("message", "✅ 项目编辑成功")
+    
+    # 如果message中包含详细信息，保留完整内容
+    assistant_full_content = f"{assistant_message}\n\n"
+    
+    # 处理diff信息（如果有）
+    if result.get("diff"):
+        diff_data = result.get("diff")
+        if isinstance(diff_data, dict):
+            total_changes = diff_data.get("total_changes", 0)
+            added_count = len(diff_data.get("added_lines", []))
+            removed_count = len(diff_data.get("removed_lines", []))
+            assistant_full_content += f"📝 代码变更：+{added_count}行 -{removed_count}行（共{total_changes}处修改）\n\n"
+    
+    # 处理统计信息
+    if result.get("stats"):
+        stats = result.get("stats")
+        assistant_full_content += f"📊 代码统计：{stats.get('lines', 0)}行 | {stats.get('characters', 0)}字符"
+    
+    new_conversation = [
+        {
+            "role": "user",
+            "content": request.instruction,
+            "timestamp": datetime.now().isoformat()
+        },
+        {
+            "role": "assistant",
+            "content": assistant_full_content.strip(),  # 保存完整的assistant回复内容
+            "timestamp": datetime.now().isoformat(),
+            "reasoning": result.get("reasoning", ""),  # 思考过程
+            "raw_content": result.get("raw_content", ""),  # 🆕 Agent返回的完整原始内容
+            "code_snapshot": new_code[:500] if new_code else "",  # 代码快照
+            "full_message": result.get("message", "")  # 原始message
+        }
+    ]
+    conversation_history.extend(new_conversation)
+    metadata_dict["conversation_history"] = conversation_history
+    
+    # 保存项目
+    save_started_at = time.perf_counter()
+    await save_project(request.project_id, files, metadata_dict)
+    save_time = time.perf_counter() - save_started_at
+    metrics.observe_stage("save_project", save_time)
+    _schedule_summary(request.project_id, edit_context["client_id"], edit_context["target"].name)
+    
+    # 重新构建metadata对象用于generator
+    metadata = ProjectMetadata(**metadata_dict)
+    generator = WatchfaceProjectGenerator(metadata)
+    file_tree = generator.generate_file_tree(files)
+    
+    # 构建响应
+    file_list = _build_file_list(files, generator)
+    
+    logger.info(f"✅ 项目编辑成功")
+    
+    response = GenerateProjectResponse(
+        project_id=request.project_id,
+        files=file_list,
+        file_tree=file_tree,
+        reasoning=result.get("reasoning", ""),
+        success=True,
+        message="项目编辑成功",
+        conversation_history=conversation_history,  # 返回更新后的对话历史
+        target=generator.target.name,
+        entry_file=generator.target.entry_file
+    )
+    metrics.observe_stage("response_build", time.perf_counter() - started_at - save_time)
+    return response
+
+
+async def _run_edit_project(
+    request: EditProjectRequest,
+    x_client_id: Optional[str]
+) -> GenerateProjectResponse:
+    """编辑项目：加载校验 → 调度排队 → 调用Code Agent → 保存项目（同步接口和后台任务共用）"""
+    edit_context = await _load_project_for_edit(request, x_client_id)
+    # 根据客户端ID和项目的输出目标获取对应的Code Agent
+    code_agent = get_code_agent_for_client(x_client_id, edit_context["target"].name)
+    
+    async def run_edit() -> GenerateProjectResponse:
+        # 调用Code Agent编辑（经调度器排队）
+        async with _llm_slot(x_client_id) as ticket:
+            result = await code_agent.process_instruction(
+                user_input=request.instruction,
+                current_code=edit_context["current_code"],
+                conversation_history=edit_context["conversation_history"],
+                assets=edit_context["metadata"].assets,  # 使用合并后的素材
+                config=edit_context["metadata"].config,
+                use_cache=request.use_cache,
+                conversation_summary=edit_context["summary"]
+            )
+        _record_usage("edit", x_client_id, request.project_id, code_agent, result, ticket)
+        
+        if not result.get("success"):
+            raise HTTPException(500, result.get("message", "代码编辑失败"))
+        
+        response = await _save_edited_project(request, edit_context, result)
+        response.queue_position = ticket.position
+        response.queue_wait = round(ticket.wait_time, 3)
+        return response
+    
+    # 合并进行中的相同编辑（同一客户端、项目、指令和当前代码），避免重复调用和并发覆盖metadata.json
+    flight_key = single_flight.make_key(
+        "edit",
+        edit_context["client_id"],
+        request.project_id,
+        request.instruction,
+        edit_context["current_code"]
+    )
+    response, shared = await single_flight.do(flight_key, run_edit)
+    if shared:
+        logger.info(f"🔗 合并重复的编辑请求: {request.project_id}")
+    
+    return response
+
+
 @app.post("/api/edit-project", response_model=GenerateProjectResponse)
 async def edit_project(
     request: EditProjectRequest,
@@ -453,163 +1136,7 @@ async def edit_project(
     logger.info(f"   客户端ID: {x_client_id[:16] if x_client_id else 'None'}...")
     
     try:
-        # 根据客户端ID获取对应的Code Agent
-        code_agent = get_code_agent_for_client(x_client_id)
-        # 加载现有项目
-        project_data = await load_project(request.project_id)
-        if not project_data:
-            raise HTTPException(404, "项目不存在")
-        
-        # 获取当前index.html
-        metadata_dict = project_data["metadata"]
-        files = project_data["files"]
-        
-        # 验证权限：检查项目是否属于当前客户端
-        project_client_id = metadata_dict.get("client_id", "default")
-        current_client_id = x_client_id or "default"
-        if project_client_id != current_client_id:
-            logger.warning(f"⚠️ 客户端 {current_client_id} 尝试访问客户端 {project_client_id} 的项目")
-            raise HTTPException(403, "无权访问此项目")
-        
-        logger.info(f"✅ 权限验证通过: 客户端 {current_client_id}")
-        
-        # 查找 HTML 文件
-        html_key = "index.html"
-        
-        if html_key not in files:
-            raise HTTPException(404, "index.html 文件不存在")
-        
-        current_html = files[html_key]
-        
-        # 转换metadata为ProjectMetadata对象以获取assets和config
-        from models.project import ProjectMetadata
-        metadata = ProjectMetadata(**metadata_dict)
-        
-        # 合并新上传的素材（如果有）
-        if request.assets:
-            # 将新素材合并到现有素材中
-            if metadata.assets:
-                # 更新现有素材
-                if request.assets.background_round:
-                    metadata.assets.background_round = request.assets.background_round
-                if request.assets.background_square:
-                    metadata.assets.background_square = request.assets.background_square
-                if request.assets.pointer_hour:
-                    metadata.assets.pointer_hour = request.assets.pointer_hour
-                if request.assets.pointer_minute:
-                    metadata.assets.pointer_minute = request.assets.pointer_minute
-                if request.assets.pointer_second:
-                    metadata.assets.pointer_second = request.assets.pointer_second
-                if request.assets.digits:
-                    metadata.assets.digits = request.assets.digits
-                if request.assets.week_images:
-                    metadata.assets.week_images = request.assets.week_images
-                if request.assets.decorations:
-                    metadata.assets.decorations = request.assets.decorations
-            else:
-                # 如果之前没有素材，直接使用新素材
-                metadata.assets = request.assets
-        
-        # 获取对话历史
-        conversation_history = metadata_dict.get("conversation_history", [])
-        
-        # 调用Code Agent编辑
-        result = await code_agent.process_instruction(
-            user_input=request.instruction,
-            current_code=current_html,
-            conversation_history=conversation_history,
-            assets=metadata.assets,  # 使用合并后的素材
-            config=metadata.config
-        )
-        
-        if not result.get("success"):
-            raise HTTPException(500, result.get("message", "代码编辑失败"))
-        
-        new_html = result.get("code", current_html)
-        
-        # 更新项目文件
-        files[html_key] = new_html
-        metadata_dict["updated_at"] = datetime.now().isoformat()
-        metadata_dict["generation_count"] = metadata_dict.get("generation_count", 0) + 1
-        metadata_dict["last_instruction"] = request.instruction
-        
-        # 确保 client_id 存在（兼容旧项目）
-        if "client_id" not in metadata_dict or not metadata_dict["client_id"]:
-            metadata_dict["client_id"] = current_client_id
-        
-        # 更新metadata中的assets（确保新素材被保存）
-        if metadata.assets:
-            metadata_dict["assets"] = metadata.assets.dict()
-        
-        # 追加对话历史（保留agent完整的生成内容）
-        assistant_message = result.get("message", "✅ 项目编辑成功")
-        
-        # 如果message中包含详细信息，保留完整内容
-        assistant_full_content = f"{assistant_message}\n\n"
-        
-        # 处理diff信息（如果有）
-        if result.get("diff"):
-            diff_data = result.get("diff")
-            if isinstance(diff_data, dict):
-                total_changes = diff_data.get("total_changes", 0)
-                added_count = len(diff_data.get("added_lines", []))
-                removed_count = len(diff_data.get("removed_lines", []))
-                assistant_full_content += f"📝 代码变更：+{added_count}行 -{removed_count}行（共{total_changes}处修改）\n\n"
-        
-        # 处理统计信息
-        if result.get("stats"):
-            stats = result.get("stats")
-            assistant_full_content += f"📊 代码统计：{stats.get('lines', 0)}行 | {stats.get('characters', 0)}字符"
-        
-        new_conversation = [
-            {
-                "role": "user",
-                "content": request.instruction,
-                "timestamp": datetime.now().isoformat()
-            },
-            {
-                "role": "assistant",
-                "content": assistant_full_content.strip(),  # 保存完整的assistant回复内容
-                "timestamp": datetime.now().isoformat(),
-                "reasoning": result.get("reasoning", ""),  # 思考过程
-                "raw_content": result.get("raw_content", ""),  # 🆕 Agent返回的完整原始内容
-                "code_snapshot": new_html[:500] if new_html else "",  # 代码快照
-                "full_message": result.get("message", "")  # 原始message
-            }
-        ]
-        conversation_history.extend(new_conversation)
-        metadata_dict["conversation_history"] = conversation_history
-        
-        # 保存项目
-        await save_project(request.project_id, files, metadata_dict)
-        
-        # 重新构建metadata对象用于generator
-        metadata = ProjectMetadata(**metadata_dict)
-        generator = WatchfaceProjectGenerator(metadata)
-        file_tree = generator.generate_file_tree(files)
-        
-        # 构建响应
-        file_list = [
-            ProjectFile(
-                path=path,
-                content=content,
-                language=generator.detect_language(path)
-            )
-            for path, content in files.items()
-            if content != "[BINARY_FILE]"
-        ]
-        
-        logger.info(f"✅ 项目编辑成功")
-        
-        return GenerateProjectResponse(
-            project_id=request.project_id,
-            files=file_list,
-            file_tree=file_tree,
-            reasoning=result.get("reasoning", ""),
-            success=True,
-            message="项目编辑成功",
-            conversation_history=conversation_history  # 返回更新后的对话历史
-        )
+        return await _run_edit_project(request, x_client_id)
         
     except HTTPException:
         raise
@@ -620,6 +1147,417 @@ async def edit_project(
         raise HTTPException(500, f"项目编辑失败: {str(e)}")
 
 
+# ============= 异步任务接口 =============
+
+def _job_runner(run, request_model):
+    """把同步接口的执行函数包装为后台任务的runner"""
+    async def runner(job: Dict) -> Dict:
+        request = request_model(**job["payload"])
+        # 后台任务的指标以任务类型作为endpoint标签，每次执行一条trace
+        token = endpoint_var.set(f"job:{job['kind']}")
+        try:
+            with tracer.start_trace(f"job {job['kind']}", job_id=job["job_id"], attempt=job["attempts"]):
+                response = await run(request, job["client_id"])
+        except HTTPException as e:
+            if e.status_code == 429:
+                # 调度排队已满：任务保持queued，稍后重试
+                raise JobRetryLater(float((e.headers or {}).get("Retry-After", 10)))
+            raise
+        finally:
+            endpoint_var.reset(token)
+        return response.dict()
+    return runner
+
+
+def _job_view(job: Dict) -> Dict:
+    """任务对外展示的字段（不含请求体）"""
+    return {
+        key: job.get(key)
+        for key in (
+            "job_id", "kind", "status", "attempts", "result", "error", "error_status",
+            "created_at", "updated_at", "started_at", "finished_at"
+        )
+    }
+
+
+@app.on_event("startup")
+async def start_job_workers():
+    """启动后台任务worker，并恢复上次未完成的任务"""
+    job_store.register_runner("generate", _job_runner(_run_generate_project, GenerateProjectRequest))
+    job_store.register_runner("edit", _job_runner(_run_edit_project, EditProjectRequest))
+    await job_store.start()
+
+
+@app.on_event("startup")
+async def load_generation_cache():
+    """扫描生成缓存目录建立内存索引（之后的淘汰和统计不再扫描目录）"""
+    await generation_cache.load()
+
+
+@app.post("/api/jobs/generate-project", status_code=202)
+async def submit_generate_job(
+    request: GenerateProjectRequest,
+    x_client_id: Optional[str] = Header(None, alias="X-Client-ID"),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """
+    以后台任务方式生成新项目，立即返回任务ID
+    
+    相同的Idempotency-Key重复提交时返回同一个任务，不会重复生成。
+    """
+    logger.info(f"📋 接收生成任务: {request.instruction}")
+    job = await job_store.submit("generate", request.dict(), x_client_id, idempotency_key)
+    return _job_view(job)
+
+
+@app.post("/api/jobs/edit-project", status_code=202)
+async def submit_edit_job(
+    request: EditProjectRequest,
+    x_client_id: Optional[str] = Header(None, alias="X-Client-ID"),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """以后台任务方式编辑项目，立即返回任务ID（提交时即校验项目是否存在及权限）"""
+    logger.info(f"📋 接收编辑任务: {request.project_id} - {request.instruction}")
+    await _load_project_for_edit(request, x_client_id)
+    job = await job_store.submit("edit", request.dict(), x_client_id, idempotency_key)
+    return _job_view(job)
+
+
+@app.get("/api/jobs/stats")
+async def job_stats():
+    """后台任务统计（worker数、待执行任务数、各状态任务数）"""
+    return job_store.get_stats()
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(
+    job_id: str,
+    wait: float = 0,
+    x_client_id: Optional[str] = Header(None, alias="X-Client-ID")
+):
+    """
+    查询任务状态
+    
+    Args:
+        job_id: 任务ID
+        wait: 长轮询等待秒数（任务未结束时最多等待该时间，状态变化立即返回）
+    """
+    job = await job_store.wait(job_id, min(max(wait, 0), settings.job_long_poll_max))
+    if job is None:
+        raise HTTPException(404, "任务不存在")
+    if job.get("client_id") != x_client_id:
+        raise HTTPException(403, "无权访问此任务")
+    return _job_view(job)
+
+
+# ============= 流式生成接口（SSE） =============
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",  # 关闭nginx缓冲，保证事件实时下发
+}
+
+
+def _sse_event(event: str, data: Dict) -> str:
+    """格式化一条Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _check_llm_admission(client_id: Optional[str]):
+    """流式接口在开始响应前做准入检查，排队已满时直接返回429"""
+    try:
+        llm_scheduler.admit(client_id or "default")
+    except SchedulerRejected as e:
+        raise _queue_full_error(e)
+
+
+@asynccontextmanager
+async def _llm_stream_slot(client_id: Optional[str]):
+    """
+    流式接口的LLM执行权：先入队并返回 (ticket, queued事件)，由调用方下发queued事件后再等待执行权
+    
+    获得执行权前客户端断开时自动退出队列，结束时归还执行权。
+    """
+    try:
+        ticket = llm_scheduler.enqueue(client_id or "default", _api_key_hash(client_id))
+    except SchedulerRejected as e:
+        raise _queue_full_error(e)
+    
+    queued_event = None
+    if ticket.position:
+        queued_event = _sse_event("queued", {
+            "position": ticket.position,
+            "running": llm_scheduler.get_stats()["running"]
+        })
+    
+    try:
+        yield ticket, queued_event
+    finally:
+        if ticket.granted.done():
+            llm_scheduler.release(ticket)
+
+
+@app.post("/api/generate-project/stream")
+async def generate_project_stream(
+    request: GenerateProjectRequest,
+    x_client_id: Optional[str] = Header(None, alias="X-Client-ID")
+):
+    """
+    流式生成新的表盘项目（SSE）
+    
+    事件序列：start → reasoning/content（增量，多次）→ done（完整项目）或 error
+    
+    Args:
+        request: 生成项目请求
+        x_client_id: 客户端ID（从header获取）
+    """
+    logger.info(f"🌊 接收流式生成项目请求")
+    logger.info(f"   指令: {request.instruction}")
+    logger.info(f"   客户端ID: {x_client_id[:16] if x_client_id else 'None'}...")
+    
+    if request.variants > 1:
+        raise HTTPException(400, "流式接口不支持多方案生成，请使用 /api/generate-project")
+    
+    code_agent = get_code_agent_for_client(x_client_id, request.target)
+    metadata = _build_project_metadata(request, x_client_id)
+    _check_llm_admission(x_client_id)
+    
+    async def event_stream():
+        yield _sse_event("start", {"project_id": metadata.project_id})
+        
+        try:
+            async with _llm_stream_slot(x_client_id) as (ticket, queued_event):
+                if queued_event:
+                    yield queued_event
+                with tracer.span("scheduler.queue_wait"):
+                    await llm_scheduler.wait(ticket)
+                metrics.observe_stage("queue_wait", ticket.wait_time, code_agent.model)
+                
+                async for event in code_agent.stream_instruction(
+                    user_input=request.instruction,
+                    current_code=None,
+                    conversation_history=[],
+                    assets=metadata.assets,
+                    config=metadata.config,
+                    use_cache=request.use_cache
+                ):
+                    if event["event"] != "result":
+                        yield _sse_event(event["event"], event["data"])
+                        continue
+                    
+                    result = event["data"]
+                    _record_usage("generate", x_client_id, metadata.project_id, code_agent, result, ticket)
+                    if not result.get("success"):
+                        yield _sse_event("error", {"message": result.get("message", "代码生成失败")})
+                        return
+            
+            response = await _save_generated_project(metadata, request.instruction, result)
+            response.queue_position = ticket.position
+            response.queue_wait = round(ticket.wait_time, 3)
+            yield _sse_event("done", response.dict())
+                
+        except Exception as e:
+            logger.error(f"❌ 流式项目生成失败: {str(e)}")
+            import traceback
+            logger.error(traceback.format_exc())
+            yield _sse_event("error", {"message": f"项目生成失败: {str(e)}"})
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@app.post("/api/edit-project/stream")
+async def edit_project_stream(
+    request: EditProjectRequest,
+    x_client_id: Optional[str] = Header(None, alias="X-Client-ID")
+):
+    """
+    流式编辑现有项目（SSE）
+    
+    事件序列：start → reasoning/content（增量，多次）→ done（完整项目）或 error
+    
+    Args:
+        request: 编辑项目请求
+        x_client_id: 客户端ID（从header获取）
+    """
+    logger.info(f"🌊 接收流式编辑项目请求")
+    logger.info(f"   项目ID: {request.project_id}")
+    logger.info(f"   指令: {request.instruction}")
+    
+    # 在开始流式响应前完成加载、权限校验和准入检查，以便直接返回404/403/429
+    edit_context = await _load_project_for_edit(request, x_client_id)
+    code_agent = get_code_agent_for_client(x_client_id, edit_context["target"].name)
+    _check_llm_admission(x_client_id)
+    
+    async def event_stream():
+        yield _sse_event("start", {"project_id": request.project_id})
+        
+        try:
+            async with _llm_stream_slot(x_client_id) as (ticket, queued_event):
+                if queued_event:
+                    yield queued_event
+                with tracer.span("scheduler.queue_wait"):
+                    await llm_scheduler.wait(ticket)
+                metrics.observe_stage("queue_wait", ticket.wait_time, code_agent.model)
+                
+                async for event in code_agent.stream_instruction(
+                    user_input=request.instruction,
+                    current_code=edit_context["current_code"],
+                    conversation_history=edit_context["conversation_history"],
+                    assets=edit_context["metadata"].assets,
+                    config=edit_context["metadata"].config,
+                    use_cache=request.use_cache,
+                    conversation_summary=edit_context["summary"]
+                ):
+                    if event["event"] != "result":
+                        yield _sse_event(event["event"], event["data"])
+                        continue
+                    
+                    result = event["data"]
+                    _record_usage("edit", x_client_id, request.project_id, code_agent, result, ticket)
+                    if not result.get("success"):
+                        yield _sse_event("error", {"message": result.get("message", "代码编辑失败")})
+                        return
+            
+            response = await _save_edited_project(request, edit_context, result)
+            response.queue_position = ticket.position
+            response.queue_wait = round(ticket.wait_time, 3)
+            yield _sse_event("done", response.dict())
+                
+        except Exception as e:
+            logger.error(f"❌ 流式项目编辑失败: {str(e)}")
+            import traceback
+            logger.error(traceback.format_exc())
+            yield _sse_event("error", {"message": f"项目编辑失败: {str(e)}"})
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+# ============= 批量生成接口 =============
+
+async def _run_batch_item(
+    index: int,
+    item: BatchGenerateItem,
+    request: BatchGenerateRequest,
+    x_client_id: Optional[str]
+) -> Dict:
+    """
+    生成批次中的一个表盘，返回该表盘的结果摘要（失败时不抛出异常）
+
+    排队已满（429）时按Retry-After等待后重试，不影响批次中的其他表盘。
+    """
+    item_request = GenerateProjectRequest(
+        instruction=item.instruction,
+        assets=item.assets or WatchfaceAssets(),
+        config=item.config,
+        session_id=request.session_id,
+        use_cache=request.use_cache,
+        target=request.target
+    )
+    # 每个表盘使用独立的请求ID（批次请求ID-序号），便于在日志中区分
+    token = bind_request_id(f"{get_request_id()}-{index}")
+    started_at = time.perf_counter()
+    try:
+        for attempt in range(settings.batch_queue_retries + 1):
+            try:
+                response = await _run_generate_project(item_request, x_client_id)
+                break
+            except HTTPException as e:
+                if e.status_code != 429 or attempt >= settings.batch_queue_retries:
+                    raise
+                retry_after = float((e.headers or {}).get("Retry-After", 5))
+                logger.info(f"⏳ 批量生成第 {index} 项排队已满，{retry_after:.0f} 秒后重试")
+                await asyncio.sleep(retry_after)
+
+        return {
+            "index": index,
+            "success": True,
+            "project_id": response.project_id,
+            "file_count": len(response.files),
+            "queue_wait": response.queue_wait,
+            "elapsed": round(time.perf_counter() - started_at, 3),
+        }
+    except Exception as e:
+        status = e.status_code if isinstance(e, HTTPException) else 500
+        message = e.detail if isinstance(e, HTTPException) else f"{type(e).__name__}: {e}"
+        logger.error(f"❌ 批量生成第 {index} 项失败: {message}", exc_info=status >= 500)
+        return {
+            "index": index,
+            "success": False,
+            "status": status,
+            "message": message,
+            "elapsed": round(time.perf_counter() - started_at, 3),
+        }
+    finally:
+        request_id_var.reset(token)
+
+
+@app.post("/api/generate-batch")
+async def generate_batch(
+    request: BatchGenerateRequest,
+    x_client_id: Optional[str] = Header(None, alias="X-Client-ID")
+):
+    """
+    批量生成表盘项目（SSE）
+
+    各表盘在并发上限内同时生成（仍经过调度器排队），每个表盘单独保存为一个项目；
+    单个表盘失败不会中止批次。
+
+    事件序列：start → item_done / item_error（每个表盘一次，按完成顺序）→ done（批次汇总）
+
+    Args:
+        request: 批量生成请求
+        x_client_id: 客户端ID（从header获取）
+    """
+    if not request.items:
+        raise HTTPException(400, "批次不能为空")
+    if len(request.items) > settings.batch_max_items:
+        raise HTTPException(400, f"单个批次最多 {settings.batch_max_items} 个表盘")
+    concurrency = max(1, min(request.concurrency or settings.batch_max_concurrency, settings.batch_max_concurrency))
+
+    logger.info(
+        f"📦 接收批量生成请求: {len(request.items)} 个表盘, 并发 {concurrency}",
+        extra={"fields": {"client_id": x_client_id, "session_id": request.session_id}}
+    )
+    _check_llm_admission(x_client_id)
+    batch_id = get_request_id()
+
+    async def event_stream():
+        started_at = time.perf_counter()
+        yield _sse_event("start", {"batch_id": batch_id, "total": len(request.items), "concurrency": concurrency})
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_item(index: int, item: BatchGenerateItem) -> Dict:
+            async with semaphore:
+                return await _run_batch_item(index, item, request, x_client_id)
+
+        tasks = [asyncio.create_task(run_item(index, item)) for index, item in enumerate(request.items)]
+        results = []
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                results.append(result)
+                yield _sse_event("item_done" if result["success"] else "item_error", result)
+        finally:
+            # 客户端断开：取消尚未完成的表盘
+            for task in tasks:
+                task.cancel()
+
+        succeeded = sum(1 for result in results if result["success"])
+        logger.info(f"📦 批量生成完成: 成功 {succeeded}/{len(results)}")
+        yield _sse_event("done", {
+            "batch_id": batch_id,
+            "total": len(results),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "elapsed": round(time.perf_counter() - started_at, 3),
+            "results": sorted(results, key=lambda result: result["index"]),
+        })
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
 # ============= 项目下载接口 =============
 
 @app.get("/api/download-project/{project_id}")
@@ -656,7 +1594,7 @@ async def download_project(
         # 创建内存ZIP文件
         zip_buffer = io.BytesIO()
         
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        with metrics.stage("zip_build"), zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
             # 添加文本文件
             for file_path, content in files.items():
                 if content != "[BINARY_FILE]":
@@ -681,7 +1619,8 @@ async def download_project(
         return StreamingResponse(
             zip_buffer,
             media_type="application/zip",
-            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+            # 中文文件名按RFC 5987编码（HTTP头只能是latin-1）
+            headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"}
         )
         
     except HTTPException:
@@ -739,7 +1678,8 @@ async def get_projects(
     
     try:
         # 获取所有项目
-        all_projects = await list_projects(session_id)
+        with metrics.stage("list_projects"):
+            all_projects = await list_projects(session_id)
         
         # 按客户端ID过滤项目
         filtered_projects = []
@@ -1031,6 +1971,7 @@ async def get_project(
             "files": [f.dict() for f in file_list],
             "file_tree": file_tree,
             "conversation": conversation,
+            "summary": await conversation_summarizer.load(project_id),
             "config": metadata.get("config"),
             "assets": metadata.get("assets")
         }
@@ -1044,6 +1985,52 @@ async def get_project(
         raise HTTPException(500, f"获取项目详情失败: {str(e)}")
 
 
+@app.post("/api/project/{project_id}/variants/{variant}/select")
+async def select_project_variant(
+    project_id: str,
+    variant: int,
+    x_client_id: Optional[str] = Header(None, alias="X-Client-ID")
+):
+    """
+    采用多方案生成中的某个方案：把 variants/variant_N 复制为入口文件（index.html / index.ux）
+    
+    Args:
+        project_id: 项目ID
+        variant: 方案序号（从1开始）
+        x_client_id: 客户端ID（从header获取）
+    """
+    project_data = await load_project(project_id)
+    if not project_data:
+        raise HTTPException(404, "项目不存在")
+    
+    metadata_dict = project_data["metadata"]
+    files = project_data["files"]
+    current_client_id = x_client_id or "default"
+    if metadata_dict.get("client_id", "default") != current_client_id:
+        logger.warning(f"⚠️ 客户端 {current_client_id} 尝试访问客户端 {metadata_dict.get('client_id')} 的项目")
+        raise HTTPException(403, "无权访问此项目")
+    
+    target = get_target(metadata_dict.get("target", "html"))
+    variant_path = _variant_path(variant, target)
+    if variant_path not in files:
+        raise HTTPException(404, f"方案 {variant} 不存在")
+    
+    files[target.entry_file] = files[variant_path]
+    metadata_dict["selected_variant"] = variant
+    metadata_dict["updated_at"] = datetime.now().isoformat()
+    await save_project(project_id, files, metadata_dict)
+    logger.info(f"🎲 项目 {project_id} 采用方案 {variant}")
+    
+    return {
+        "success": True,
+        "project_id": project_id,
+        "selected_variant": variant,
+        "file": ProjectFile(
+            path=target.entry_file, content=files[target.entry_file], language=target.language
+        ),
+    }
+
+
 # ============= API Key管理接口 =============
 
 class SetApiKeyRequest(BaseModel):
@@ -1106,21 +2093,19 @@ async def test_api_key_endpoint(request: TestApiKeyRequest):
     logger.info(f"🧪 测试API Key有效性...")
     
     try:
-        # 简单测试：尝试创建一个临时的客户端
+        # 简单测试：尝试创建一个临时的客户端（用完即关闭，不留下未关闭的HTTP连接）
         from openai import AsyncOpenAI
-        import os
         
-        test_client = AsyncOpenAI(
-            base_url=os.getenv('MINIMAX_BASE_URL', 'https://api.minimaxi.com/v1'),
+        async with AsyncOpenAI(
+            base_url=settings.minimax_base_url,
             api_key=request.api_key
-        )
-        
-        # 发送一个简单的测试请求
-        response = await test_client.chat.completions.create(
-            model="MiniMax-Text-01",
-            messages=[{"role": "user", "content": "hi"}],
-            max_tokens=10
-        )
+        ) as test_client:
+            # 发送一个简单的测试请求
+            response = await test_client.chat.completions.create(
+                model="MiniMax-Text-01",
+                messages=[{"role": "user", "content": "hi"}],
+                max_tokens=10
+            )
         
         logger.info(f"✅ API Key验证成功")
         return {
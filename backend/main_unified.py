@@ -7,6 +7,7 @@ from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse
 from main import app  # 导入原有的FastAPI应用
+from utils.llm_transport import llm_transport
 
 # 静态文件目录
 STATIC_DIR = Path(__file__).parent / "static"
@@ -53,11 +54,13 @@ async def serve_watchagent_spa(full_path: str):
 @app.get("/health")
 async def health_check_unified():
     """统一服务健康检查"""
+    breaker = llm_transport.breaker.get_state()
     return {
-        "status": "healthy",
+        "status": "healthy" if breaker["state"] == "closed" else "degraded",
         "service": "watchface-agent-unified",
         "frontend": STATIC_DIR.exists(),
-        "backend": True
+        "backend": True,
+        "llm_circuit": breaker
     }
 
 print("🚀 统一服务启动:")
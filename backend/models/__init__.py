@@ -6,6 +6,8 @@ from .assets import AssetType, AssetFile, WatchfaceAssets
 from .project import WatchfaceConfig, ProjectMetadata, ConversationItem
 from .api import (
     GenerateProjectRequest,
+    BatchGenerateItem,
+    BatchGenerateRequest,
     EditProjectRequest,
     ProjectFile,
     GenerateProjectResponse
@@ -19,6 +21,8 @@ __all__ = [
     'ProjectMetadata',
     'ConversationItem',
     'GenerateProjectRequest',
+    'BatchGenerateItem',
+    'BatchGenerateRequest',
     'EditProjectRequest',
     'ProjectFile',
     'GenerateProjectResponse',
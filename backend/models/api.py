@@ -3,7 +3,7 @@ API请求响应数据模型
 """
 
 from pydantic import BaseModel
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Literal, Optional, Any
 from .assets import WatchfaceAssets
 from .project import WatchfaceConfig
 
@@ -14,6 +14,25 @@ class GenerateProjectRequest(BaseModel):
     assets: WatchfaceAssets           # 素材集合
     config: Optional[WatchfaceConfig] = None
     session_id: str                    # 会话ID
+    use_cache: bool = True             # 是否允许复用生成缓存
+    variants: int = 1                  # 并行生成的方案数（>1时为多方案模式，最多variants_max个）
+    target: Literal["html", "ux"] = "html"  # 输出目标：html（浏览器HTML表盘）/ ux（vivo BlueOS表盘）
+
+
+class BatchGenerateItem(BaseModel):
+    """批量生成中的一个表盘"""
+    instruction: str                   # 用户指令
+    assets: Optional[WatchfaceAssets] = None  # 素材集合（可选）
+    config: Optional[WatchfaceConfig] = None
+
+
+class BatchGenerateRequest(BaseModel):
+    """批量生成请求"""
+    items: List[BatchGenerateItem]     # 待生成的表盘列表
+    session_id: str                    # 会话ID（所有表盘共用）
+    use_cache: bool = True             # 是否允许复用生成缓存
+    concurrency: Optional[int] = None  # 同时生成的数量（默认且最多为batch_max_concurrency）
+    target: Literal["html", "ux"] = "html"  # 输出目标（所有表盘共用）
 
 
 class EditProjectRequest(BaseModel):
@@ -22,6 +41,7 @@ class EditProjectRequest(BaseModel):
     session_id: str                    # 会话ID
     project_id: str                    # 项目ID
     assets: Optional[WatchfaceAssets] = None  # 新上传的素材（可选）
+    use_cache: bool = True             # 是否允许复用生成缓存
 
 
 class ProjectFile(BaseModel):
@@ -52,4 +72,9 @@ class GenerateProjectResponse(BaseModel):
     success: bool                      # 是否成功
     message: str = ""                  # 提示信息
     conversation_history: List[Dict[str, Any]] = []  # 对话历史
+    queue_position: Optional[int] = None  # 入队时的排队位置（0表示无需排队）
+    queue_wait: Optional[float] = None     # 排队等待时间（秒）
+    variants: Optional[List[Dict[str, Any]]] = None  # 多方案模式下各方案的摘要
+    target: str = "html"               # 输出目标
+    entry_file: str = "index.html"     # 入口文件（index.html / index.ux）
 
@@ -3,7 +3,7 @@
 """
 
 from pydantic import BaseModel, Field, validator
-from typing import Literal, Optional, List
+from typing import Any, Dict, Literal, Optional, List
 import re
 from .assets import WatchfaceAssets
 
@@ -46,9 +46,12 @@ class ProjectMetadata(BaseModel):
     updated_at: str                    # 更新时间
     config: WatchfaceConfig            # 项目配置
     assets: WatchfaceAssets            # 素材集合
+    target: str = "html"               # 输出目标（html / ux），决定入口文件 index.html / index.ux
     generation_count: int = 0          # 生成次数
     last_instruction: str = ""         # 最后一次指令
     conversation_history: List[ConversationItem] = []  # 完整对话历史
+    variants: List[Dict[str, Any]] = []  # 多方案生成的各方案摘要（代码保存在 variants/variant_N.<入口文件扩展名>）
+    selected_variant: Optional[int] = None  # 入口文件当前采用的方案序号
     
     class Config:
         extra = "ignore"
@@ -2,12 +2,23 @@
 提示词模块
 """
 
-from .system_prompt import VIVO_WATCHFACE_SYSTEM_PROMPT
-from .user_prompt import build_generation_prompt, build_edit_prompt
+from .system_prompt import (
+    WATCHFACE_SYSTEM_PROMPT,
+    UX_WATCHFACE_SYSTEM_PROMPT,
+    VIVO_WATCHFACE_SYSTEM_PROMPT,
+    PATCH_EDIT_FORMAT_PROMPT,
+    CONVERSATION_SUMMARY_SYSTEM_PROMPT,
+)
+from .user_prompt import build_generation_prompt, build_edit_prompt, build_summary_prompt
 
 __all__ = [
+    'WATCHFACE_SYSTEM_PROMPT',
+    'UX_WATCHFACE_SYSTEM_PROMPT',
     'VIVO_WATCHFACE_SYSTEM_PROMPT',
+    'PATCH_EDIT_FORMAT_PROMPT',
+    'CONVERSATION_SUMMARY_SYSTEM_PROMPT',
     'build_generation_prompt',
     'build_edit_prompt',
+    'build_summary_prompt',
 ]
 
@@ -1,8 +1,8 @@
 """
-用户提示词构建 - 生成标准 HTML 表盘
+用户提示词构建 - 与代码格式相关的措辞（输出要求、素材写法、代码块语言）由输出目标提供，默认HTML
 """
 
-from typing import List
+from typing import Dict, List, Optional
 import sys
 import os
 
@@ -12,12 +12,22 @@ from models.assets import WatchfaceAssets, AssetFile
 from models.project import WatchfaceConfig
 
 
+def _resolve_target(target):
+    """未指定输出目标时使用HTML（延迟导入：targets依赖本包的系统提示词）"""
+    if target is not None:
+        return target
+    from targets import get_target
+    return get_target()
+
+
 def build_generation_prompt(
     instruction: str,
     assets: WatchfaceAssets,
-    config: WatchfaceConfig
+    config: WatchfaceConfig,
+    target=None
 ) -> str:
-    """构建生成提示词"""
+    """构建生成提示词（target为输出目标，默认HTML）"""
+    target = _resolve_target(target)
     
     # 素材清单
     assets_list = []
@@ -58,15 +68,15 @@ def build_generation_prompt(
         # 构建更详细的素材使用说明
         usage_instructions = []
         if assets.background_round:
-            usage_instructions.append(f"✓ 表盘背景必须使用: background-image: url('./assets/{assets.background_round.stored_filename}');")
+            usage_instructions.append(f"✓ 表盘背景必须使用: {target.background_usage(assets.background_round.stored_filename)}")
         if assets.background_square:
-            usage_instructions.append(f"✓ 备用背景可用: background-image: url('./assets/{assets.background_square.stored_filename}');")
+            usage_instructions.append(f"✓ 备用背景可用: {target.background_usage(assets.background_square.stored_filename)}")
         if assets.pointer_hour:
-            usage_instructions.append(f"✓ 时针必须使用: <img src='./assets/{assets.pointer_hour.stored_filename}' />")
+            usage_instructions.append(f"✓ 时针必须使用: {target.image_usage(assets.pointer_hour.stored_filename)}")
         if assets.pointer_minute:
-            usage_instructions.append(f"✓ 分针必须使用: <img src='./assets/{assets.pointer_minute.stored_filename}' />")
+            usage_instructions.append(f"✓ 分针必须使用: {target.image_usage(assets.pointer_minute.stored_filename)}")
         if assets.pointer_second:
-            usage_instructions.append(f"✓ 秒针必须使用: <img src='./assets/{assets.pointer_second.stored_filename}' />")
+            usage_instructions.append(f"✓ 秒针必须使用: {target.image_usage(assets.pointer_second.stored_filename)}")
         
         prompt = f"""用户需求：
 {instruction}
@@ -78,13 +88,13 @@ def build_generation_prompt(
 {chr(10).join(usage_instructions) if usage_instructions else ''}
 
 🚨 代码生成前检查清单：
-1. 如果有背景图，代码中必须包含 background-image: url('./assets/xxx')
+1. 如果有背景图，代码中必须包含 {target.background_check}
 2. 不允许使用渐变色（linear-gradient）或纯色替代背景图
 3. 如果是指针表盘，数字位置必须正确：12在上、3在右、6在下、9在左
 4. 使用三角函数计算数字位置，不要随意摆放
 5. 所有指针的旋转中心必须在表盘正中心
 
-请生成一个完整的HTML表盘文件，可以直接在浏览器中运行。
+{target.generation_request}
 """
     else:
         prompt = f"""用户需求：
@@ -93,7 +103,7 @@ def build_generation_prompt(
 可用素材：
 （无素材，请用纯代码实现）
 
-请生成一个完整的HTML表盘文件，可以直接在浏览器中运行。
+{target.generation_request}
 - 请根据用户需求智能决定表盘样式（指针/数字/混合）
 - 请根据用户需求决定是否显示日期、星期等元素
 - 发挥创意，实现符合用户期望的表盘效果
@@ -105,9 +115,27 @@ def build_generation_prompt(
 def build_edit_prompt(
     current_code: str,
     instruction: str,
-    assets: WatchfaceAssets
+    assets: WatchfaceAssets,
+    patch_mode: bool = False,
+    code_context: Optional[str] = None,
+    target=None
 ) -> str:
-    """构建编辑提示词"""
+    """
+    构建编辑提示词（patch_mode时要求模型只输出SEARCH/REPLACE修改块）
+    
+    code_context: 代码较长时由上下文切片得到的“结构大纲+相关片段”，替代完整代码
+    target: 输出目标，默认HTML
+    """
+    target = _resolve_target(target)
+    
+    code_section = code_context or f"""当前表盘代码：
+{target.code_block(current_code)}"""
+    
+    output_requirement = (
+        "请只输出 SEARCH/REPLACE 修改块，不要返回完整代码。"
+        if patch_mode else
+        f"请{target.full_edit_request}"
+    )
     
     # 收集可用素材（详细说明）
     available_assets = []
@@ -116,33 +144,33 @@ def build_edit_prompt(
     # 背景素材
     if assets.background_round:
         available_assets.append(f"- 圆形背景图: {assets.background_round.stored_filename}")
-        usage_instructions.append(f"✓ 圆形背景: background-image: url('./assets/{assets.background_round.stored_filename}');")
+        usage_instructions.append(f"✓ 圆形背景: {target.background_usage(assets.background_round.stored_filename)}")
     if assets.background_square:
         available_assets.append(f"- 方形背景图: {assets.background_square.stored_filename}")
-        usage_instructions.append(f"✓ 方形背景: background-image: url('./assets/{assets.background_square.stored_filename}');")
+        usage_instructions.append(f"✓ 方形背景: {target.background_usage(assets.background_square.stored_filename)}")
     
     # 指针素材（关键：明确说明用户说"指针"/"秒针"等时应该用哪个）
     if assets.pointer_hour:
         available_assets.append(f"- 时针图片: {assets.pointer_hour.stored_filename}")
-        usage_instructions.append(f"✓ 时针: <img src='./assets/{assets.pointer_hour.stored_filename}' class='hour-hand' />")
+        usage_instructions.append(f"✓ 时针: {target.image_usage(assets.pointer_hour.stored_filename, 'hour-hand')}")
     if assets.pointer_minute:
         available_assets.append(f"- 分针图片: {assets.pointer_minute.stored_filename}")
-        usage_instructions.append(f"✓ 分针: <img src='./assets/{assets.pointer_minute.stored_filename}' class='minute-hand' />")
+        usage_instructions.append(f"✓ 分针: {target.image_usage(assets.pointer_minute.stored_filename, 'minute-hand')}")
     if assets.pointer_second:
         available_assets.append(f"- 秒针图片: {assets.pointer_second.stored_filename}")
-        usage_instructions.append(f"✓ 秒针: <img src='./assets/{assets.pointer_second.stored_filename}' class='second-hand' />")
+        usage_instructions.append(f"✓ 秒针: {target.image_usage(assets.pointer_second.stored_filename, 'second-hand')}")
     
     # 数字素材
     if assets.digits:
         digit_files = [f.stored_filename for f in assets.digits]
         available_assets.append(f"- 数字图片(0-9): {', '.join(digit_files)}")
-        usage_instructions.append(f"✓ 数字显示: 使用 <img src='./assets/digit_X.png' /> 其中X为0-9")
+        usage_instructions.append(f"✓ 数字显示: 使用 {target.image_usage('digit_X.png')} 其中X为0-9")
     
     # 星期素材
     if assets.week_images:
         week_files = [f.stored_filename for f in assets.week_images]
         available_assets.append(f"- 星期图片(1-7): {', '.join(week_files)}")
-        usage_instructions.append(f"✓ 星期显示: 使用 <img src='./assets/week_X.png' /> 其中X为1-7（周一到周日）")
+        usage_instructions.append(f"✓ 星期显示: 使用 {target.image_usage('week_X.png')} 其中X为1-7（周一到周日）")
     
     # 装饰素材
     if assets.decorations:
@@ -152,10 +180,7 @@ def build_edit_prompt(
     has_assets = len(available_assets) > 0
     
     if has_assets:
-        prompt = f"""当前表盘代码：
-```html
-{current_code}
-```
+        prompt = f"""{code_section}
 
 用户修改要求：
 {instruction}
@@ -177,16 +202,13 @@ def build_edit_prompt(
 🚨 最小化修改原则（极其重要）：
 1. **只修改用户明确要求修改的部分**
 2. **保持代码的整体结构、样式、布局完全不变**
-3. 例如：用户说"秒针替换成图片" → 只找到秒针元素，改成 <img src='./assets/xxx' />，其他一切保持原样
+3. 例如：用户说"秒针替换成图片" → 只找到秒针元素，改成 {target.image_usage('xxx')}，其他一切保持原样
 4. **不要重新设计、不要"优化"、不要改变风格**
 
-请返回完整的修改后 HTML 代码。
+{output_requirement}
 """
     else:
-        prompt = f"""当前表盘代码：
-```html
-{current_code}
-```
+        prompt = f"""{code_section}
 
 用户修改要求：
 {instruction}
@@ -194,7 +216,29 @@ def build_edit_prompt(
 可用素材：
 （无额外素材）
 
-请根据用户要求修改代码，返回完整的修改后 HTML 代码。
+请根据用户要求修改代码。{output_requirement}
 """
     
     return prompt
+
+
+def build_summary_prompt(previous_summary: str, turns: List[Dict], max_chars: int) -> str:
+    """
+    构建对话摘要提示词
+    
+    previous_summary: 已有摘要（首次合并时为空）
+    turns: 新增的对话记录（role、content，内容已截断）
+    max_chars: 摘要最大长度
+    """
+    dialogue = []
+    for turn in turns:
+        role = "👤 用户" if turn.get("role") == "user" else "🤖 助手"
+        dialogue.append(f"{role}: {turn.get('content', '')}")
+    
+    return f"""已有摘要：
+{previous_summary or '（暂无）'}
+
+新增对话：
+{chr(10).join(dialogue)}
+
+请输出合并后的完整设计决策摘要，不超过 {max_chars} 个字符。"""
@@ -0,0 +1,27 @@
+"""
+输出目标模块 - Code Agent可生成的表盘代码格式
+"""
+
+from typing import Dict
+
+from .base import OutputTarget
+from .html import HtmlTarget
+from .ux import UxTarget
+
+DEFAULT_TARGET = "html"
+
+# 创建全局实例
+TARGETS: Dict[str, OutputTarget] = {
+    target.name: target for target in (HtmlTarget(), UxTarget())
+}
+
+
+def get_target(name: str = DEFAULT_TARGET) -> OutputTarget:
+    """按名称获取输出目标，未知名称抛出ValueError"""
+    target = TARGETS.get((name or DEFAULT_TARGET).lower())
+    if target is None:
+        raise ValueError(f"不支持的输出目标: {name}（可选: {', '.join(TARGETS)}）")
+    return target
+
+
+__all__ = ['OutputTarget', 'HtmlTarget', 'UxTarget', 'TARGETS', 'DEFAULT_TARGET', 'get_target']
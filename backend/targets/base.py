@@ -0,0 +1,87 @@
+"""
+输出目标基类 - 描述一种表盘代码格式
+
+同一个Code Agent引擎（传输、流式输出、缓存、差异计算）通过输出目标区分：
+- 系统提示词 / 编辑提示词，以及用户提示词中与格式相关的措辞
+- 入口文件名、代码块语言标识
+- 代码提取（流式/一次性）、完整性校验
+"""
+
+from abc import ABC, abstractmethod
+from typing import List, Optional
+
+from prompts.system_prompt import PATCH_EDIT_FORMAT_PROMPT
+from utils.stream_extractor import CodeFormat, HTML_FORMAT, StreamCodeExtractor, extract_code
+
+
+class OutputTarget(ABC):
+    """输出目标（子类通过类属性描述格式，并实现素材写法/校验/README）"""
+
+    name: str = ""                       # 目标标识（请求参数/项目元数据中使用）
+    label: str = ""                      # 提示词中的代码名称
+    entry_file: str = ""                 # 项目入口文件
+    language: str = ""                   # 前端代码高亮语言
+    fence_lang: str = ""                 # 提示词中代码块的语言标识
+    code_format: CodeFormat = HTML_FORMAT
+    system_prompt: str = ""
+    edit_rules_prompt: str = ""          # 追加在系统提示词之后的编辑规则
+    generation_request: str = ""         # 生成提示词结尾的输出要求
+    simple_generation_request: str = ""  # 未提供素材/配置时简化提示词的输出要求
+    background_check: str = ""           # 生成前检查清单中背景图的写法
+
+    def __init__(self):
+        self.edit_system_prompt = self.system_prompt + self.edit_rules_prompt
+        self.patch_edit_system_prompt = self.edit_system_prompt + PATCH_EDIT_FORMAT_PROMPT
+
+    def __repr__(self) -> str:
+        return f"<OutputTarget {self.name}>"
+
+    # ---------- 提示词片段 ----------
+
+    @property
+    def full_edit_request(self) -> str:
+        """完整代码编辑模式的输出要求"""
+        return f"返回完整的修改后 {self.label} 代码。"
+
+    def code_block(self, code: str) -> str:
+        """把代码放进带语言标识的代码块"""
+        return f"```{self.fence_lang}\n{code}\n```"
+
+    @abstractmethod
+    def background_usage(self, filename: str) -> str:
+        """背景图素材的写法"""
+
+    @abstractmethod
+    def image_usage(self, filename: str, css_class: Optional[str] = None) -> str:
+        """图片素材（指针/数字/星期）的写法"""
+
+    # ---------- 代码提取与校验 ----------
+
+    def extract(self, response_text: str) -> str:
+        """一次性提取完整响应中的代码"""
+        return extract_code(response_text, self.code_format)
+
+    def stream_extractor(self, patch_mode: bool = False, for_stream: bool = True) -> StreamCodeExtractor:
+        """创建流式代码提取器（for_stream为False时只提取不做异常判定，用于回放缓存）"""
+        if for_stream:
+            return StreamCodeExtractor.for_stream(patch_mode, self.code_format)
+        return StreamCodeExtractor(patch_mode, code_format=self.code_format)
+
+    @abstractmethod
+    def looks_like_code(self, code: str) -> bool:
+        """提取结果看起来是完整代码（而不是说明文字/片段）"""
+
+    @abstractmethod
+    def validation_errors(self, code: str) -> List[str]:
+        """检查代码完整性，返回全部问题"""
+
+    def validate(self, code: str) -> Optional[str]:
+        """检查代码完整性，返回问题描述（没有问题时返回None）"""
+        errors = self.validation_errors(code or "")
+        return "，".join(errors) if errors else None
+
+    # ---------- 项目文件 ----------
+
+    @abstractmethod
+    def readme(self, watchface_name: str, asset_count: int) -> str:
+        """项目README"""
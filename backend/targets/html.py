@@ -0,0 +1,78 @@
+"""
+HTML输出目标 - 可直接在浏览器中运行的单文件 HTML/CSS/JS 表盘
+"""
+
+from typing import List, Optional
+
+from prompts.system_prompt import WATCHFACE_SYSTEM_PROMPT, EDIT_RULES_PROMPT
+from utils.stream_extractor import HTML_FORMAT
+from .base import OutputTarget
+
+
+class HtmlTarget(OutputTarget):
+    """HTML表盘（index.html）"""
+
+    name = "html"
+    label = "HTML"
+    entry_file = "index.html"
+    language = "html"
+    fence_lang = "html"
+    code_format = HTML_FORMAT
+    system_prompt = WATCHFACE_SYSTEM_PROMPT
+    edit_rules_prompt = EDIT_RULES_PROMPT
+    generation_request = "请生成一个完整的HTML表盘文件，可以直接在浏览器中运行。"
+    simple_generation_request = "直接生成完整的HTML代码，让我能在浏览器中看到效果。"
+    background_check = "background-image: url('./assets/xxx')"
+
+    def background_usage(self, filename: str) -> str:
+        return f"background-image: url('./assets/{filename}');"
+
+    def image_usage(self, filename: str, css_class: Optional[str] = None) -> str:
+        class_attr = f" class='{css_class}'" if css_class else ""
+        return f"<img src='./assets/{filename}'{class_attr} />"
+
+    def looks_like_code(self, code: str) -> bool:
+        return "<html" in code.lower()
+
+    def validation_errors(self, code: str) -> List[str]:
+        lowered = code.lower()
+        if "<html" not in lowered:
+            return ["缺少<html>标签"]
+        if "</html>" not in lowered:
+            return ["HTML未闭合（输出可能被截断）"]
+        return []
+
+    def readme(self, watchface_name: str, asset_count: int) -> str:
+        return f"""# {watchface_name}
+
+## AI 生成的智能表盘
+
+使用 AI 智能生成的表盘 UI，支持多种样式和功能。
+
+### 运行方式
+
+直接在浏览器中打开 `index.html` 文件即可预览表盘。
+
+### 项目特点
+
+- ✨ AI 智能生成代码
+- 🎨 灵活的样式定制
+- 📱 响应式设计
+- ⚡ 纯前端实现，无需服务器
+
+### 素材
+
+- 素材文件数量: {asset_count}
+- 素材目录: `assets/`
+
+### 技术栈
+
+- HTML5
+- CSS3
+- JavaScript (ES6+)
+- SVG / Canvas（可选）
+
+### 自定义
+
+可以通过编辑 `index.html` 来调整表盘样式和功能。
+"""
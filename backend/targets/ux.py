@@ -0,0 +1,77 @@
+"""
+BlueOS .ux输出目标 - vivo手表快应用表盘（<template> + <script> + <style>）
+"""
+
+from typing import List, Optional
+
+from prompts.system_prompt import UX_WATCHFACE_SYSTEM_PROMPT, UX_EDIT_RULES_PROMPT
+from utils.stream_extractor import UX_FORMAT
+from .base import OutputTarget
+
+
+class UxTarget(OutputTarget):
+    """vivo BlueOS表盘（index.ux）"""
+
+    name = "ux"
+    label = ".ux"
+    entry_file = "index.ux"
+    language = "html"  # 前端编辑器没有.ux高亮，按HTML显示
+    fence_lang = "ux"
+    code_format = UX_FORMAT
+    system_prompt = UX_WATCHFACE_SYSTEM_PROMPT
+    edit_rules_prompt = UX_EDIT_RULES_PROMPT
+    generation_request = "请生成一个完整的 vivo BlueOS 表盘 index.ux 文件，依次包含 <template>、<script>、<style> 三部分。"
+    simple_generation_request = "直接生成完整的 index.ux 代码，可以在 vivo 手表上运行。"
+    background_check = "<image src='./assets/xxx'> 背景图片组件"
+
+    def background_usage(self, filename: str) -> str:
+        return f"<image class='bg' src='./assets/{filename}'></image>"
+
+    def image_usage(self, filename: str, css_class: Optional[str] = None) -> str:
+        class_attr = f" class='{css_class}'" if css_class else ""
+        return f"<image src='./assets/{filename}'{class_attr}></image>"
+
+    def looks_like_code(self, code: str) -> bool:
+        lowered = code.lower()
+        return "<template" in lowered and "<script" in lowered
+
+    def validation_errors(self, code: str) -> List[str]:
+        errors = []
+        for tag in ("template", "script", "style"):
+            if f"<{tag}" not in code:
+                errors.append(f"缺少<{tag}>标签")
+            elif f"</{tag}>" not in code:
+                errors.append(f"缺少</{tag}>标签")
+        if "export default" not in code:
+            errors.append("script标签中缺少export default")
+        if "onInit" not in code:
+            errors.append("缺少onInit生命周期函数")
+        return errors
+
+    def readme(self, watchface_name: str, asset_count: int) -> str:
+        return f"""# {watchface_name}
+
+## AI 生成的 vivo BlueOS 表盘
+
+使用 AI 智能生成的 BlueOS 快应用表盘。
+
+### 运行方式
+
+将 `index.ux` 和 `assets/` 目录放入 BlueOS 表盘工程的页面目录，使用 BlueOS Studio 编译后安装到手表预览。
+
+### 素材
+
+- 素材文件数量: {asset_count}
+- 素材目录: `assets/`
+
+### 技术栈
+
+- BlueOS 快应用框架（.ux）
+- <template> 声明式界面
+- <script> 数据与生命周期（onInit / onDestroy）
+- <style> CSS 子集样式
+
+### 自定义
+
+可以通过编辑 `index.ux` 来调整表盘样式和功能。
+"""
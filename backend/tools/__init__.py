@@ -0,0 +1,3 @@
+"""
+开发与测试工具（本地LLM桩服务、并发检查等）
+"""
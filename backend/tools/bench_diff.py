@@ -0,0 +1,144 @@
+"""
+代码差异基准测试 - 对比 difflib.Differ 与 utils.line_diff 在大型合成表盘上的耗时
+
+合成表盘由大量结构相似的CSS规则（重复的属性行）、DOM节点和脚本组成，模拟生成结果中常见的重复行。
+测试场景：
+- small_edit：改动一处颜色
+- scattered：随机改动/插入/删除约2%的行
+- reorder：交换两大段CSS规则的位置
+- rewrite：整体重写（几乎没有公共行）
+
+用法：
+    python tools/bench_diff.py --lines 1000 2000 5000 20000 --repeat 3 --differ-max-lines 1000
+"""
+
+import argparse
+import difflib
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.line_diff import compute_line_diff
+
+
+def synthetic_watchface(lines: int, seed: int = 0) -> str:
+    """生成约lines行的合成表盘HTML：约一半CSS、三分之一DOM、其余脚本"""
+    rng = random.Random(seed)
+    css, dom, script = [], [], []
+    colors = ["#fff", "#000", "#e94560", "#1a1a2e", "#ffd369"]
+
+    index = 0
+    while len(css) < lines // 2:
+        css += [
+            f"  .tick-{index} {{",
+            "    position: absolute;",
+            "    left: 50%;",
+            "    top: 0;",
+            f"    background: {rng.choice(colors)};",
+            f"    transform: rotate({index * 6}deg);",
+            "  }",
+        ]
+        index += 1
+    while len(dom) < lines // 3:
+        dom += ['  <div class="tick">', f'    <span class="tick-{len(dom)}"></span>', "  </div>"]
+    while len(css) + len(dom) + len(script) < lines:
+        script += [
+            "    if (now.getSeconds() % 2 === 0) {",
+            f"      el{len(script)}.style.opacity = 1;",
+            "    }",
+        ]
+
+    return "\n".join(
+        ["<!DOCTYPE html>", "<html>", "<head>", "<style>"] + css + ["</style>", "</head>", "<body>"]
+        + dom + ["<script>", "  function tick() {", "    const now = new Date();"] + script
+        + ["  }", "</script>", "</body>", "</html>"]
+    )
+
+
+def mutate(code: str, scenario: str, seed: int = 1) -> str:
+    rng = random.Random(seed)
+    lines = code.split("\n")
+    if scenario == "small_edit":
+        index = next(i for i, line in enumerate(lines) if "background:" in line)
+        lines[index] = "    background: #00ff00;"
+    elif scenario == "scattered":
+        for _ in range(max(1, len(lines) // 50)):
+            index = rng.randrange(len(lines))
+            choice = rng.random()
+            if choice < 0.4:
+                lines[index] = lines[index].replace("50%", "48%") + " /* edited */"
+            elif choice < 0.7:
+                lines.insert(index, "    border-radius: 2px;")
+            else:
+                del lines[index]
+    elif scenario == "reorder":
+        start = lines.index("<style>") + 1
+        quarter = len(lines) // 8
+        block_a = lines[start:start + quarter]
+        block_b = lines[start + quarter:start + 2 * quarter]
+        lines[start:start + 2 * quarter] = block_b + block_a
+    elif scenario == "rewrite":
+        return synthetic_watchface(len(lines), seed=seed + 100).replace("tick", "mark")
+    return "\n".join(lines)
+
+
+def differ_diff(old: str, new: str) -> int:
+    """原_compute_diff的核心：difflib.Differ逐行比较"""
+    diff = list(difflib.Differ().compare(old.split("\n"), new.split("\n")))
+    return sum(1 for line in diff if line.startswith(("+ ", "- ")))
+
+
+def _best_time(fn, repeat: int, timeout: float):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        if elapsed > timeout:
+            break
+    return best, result
+
+
+def run_bench(args):
+    print("=" * 86)
+    print("📊 代码差异基准测试（最佳耗时，秒）")
+    print("=" * 86)
+    print(f"{'行数':>8}  {'场景':<12}{'Differ':>12}{'line_diff':>12}{'加速比':>10}{'Differ变更':>12}{'line_diff变更':>14}")
+    for lines in args.lines:
+        old = synthetic_watchface(lines)
+        for scenario in args.scenarios:
+            new = mutate(old, scenario)
+            fast_time, result = _best_time(lambda: compute_line_diff(old, new), args.repeat, args.timeout)
+            if lines > args.differ_max_lines:
+                # Differ在大输入上可能需要数分钟，默认跳过
+                print(
+                    f"{lines:>8}  {scenario:<12}{'跳过':>10}{fast_time:>12.4f}{'-':>10}{'-':>12}"
+                    f"{result['total_changes']:>14}",
+                    flush=True,
+                )
+                continue
+            differ_time, differ_changes = _best_time(lambda: differ_diff(old, new), args.repeat, args.timeout)
+            print(
+                f"{lines:>8}  {scenario:<12}{differ_time:>12.4f}{fast_time:>12.4f}"
+                f"{differ_time / max(fast_time, 1e-9):>9.1f}x{differ_changes:>12}{result['total_changes']:>14}",
+                flush=True,
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="代码差异基准测试")
+    parser.add_argument("--lines", type=int, nargs="+", default=[1000, 2000, 5000, 20000], help="合成表盘行数")
+    parser.add_argument(
+        "--scenarios", nargs="+", default=["small_edit", "scattered", "reorder", "rewrite"], help="测试场景"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="每个场景重复次数（取最佳）")
+    parser.add_argument("--timeout", type=float, default=30.0, help="单次耗时超过该值时不再重复")
+    parser.add_argument("--differ-max-lines", type=int, default=1000, help="超过该行数时跳过difflib.Differ")
+    args = parser.parse_args()
+
+    run_bench(args)
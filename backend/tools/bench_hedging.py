@@ -0,0 +1,109 @@
+"""
+对冲请求基准测试 - 对比开启/关闭对冲时生成请求的p50/p95/p99延迟
+
+启动一个带长尾延迟的本地LLM桩服务（大部分补全耗时 --delay，--tail-ratio 比例的补全耗时 --tail-delay），
+分别在关闭和开启对冲的情况下调用 WatchFaceCodeAgent.generate_complete_code，统计延迟分位数。
+
+用法：
+    python tools/bench_hedging.py --requests 200 --concurrency 10 --delay 0.2 --tail-ratio 0.05 --tail-delay 3
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.concurrency_check import _free_port, _serve_in_thread
+
+
+def _percentile(ordered: list, p: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+async def _run_round(agent, requests: int, concurrency: int) -> list:
+    """以固定并发发起generate_complete_code，返回每个请求的耗时"""
+    latencies = []
+    queue = list(range(requests))
+
+    async def worker():
+        while queue:
+            queue.pop()
+            start = time.perf_counter()
+            result = await agent.generate_complete_code("创建一个简约的指针表盘", use_cache=False)
+            if not result["success"]:
+                raise RuntimeError(result.get("error"))
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return sorted(latencies)
+
+
+async def run_bench(args) -> None:
+    stub_port = _free_port()
+    os.environ["MINIMAX_BASE_URL"] = f"http://127.0.0.1:{stub_port}/v1"
+    os.environ.setdefault("MINIMAX_API_KEY", "stub-key")
+
+    import code_agent
+    from config import settings
+    from tools.stub_llm_server import create_app
+    from utils.hedging import Hedger
+
+    _serve_in_thread(create_app(args.delay, args.tail_ratio, args.tail_delay, seed=args.seed), stub_port)
+
+    settings.generation_cache_enabled = False
+    settings.hedge_delay_percentile = args.percentile
+    settings.hedge_budget_ratio = args.budget
+    settings.hedge_min_delay = 0.0
+    settings.hedge_initial_delay = args.delay * 2
+    logging.getLogger("watchface_backend").setLevel(logging.ERROR)
+
+    agent = code_agent.WatchFaceCodeAgent(api_key="stub-key")
+    results = {}
+
+    for label, enabled in (("关闭对冲", False), ("开启对冲", True)):
+        settings.hedging_enabled = enabled
+        code_agent.hedger = Hedger()
+        with contextlib.redirect_stdout(io.StringIO()):
+            # 预热：积累对冲延迟所需的样本，不计入结果
+            await _run_round(agent, settings.hedge_min_samples, args.concurrency)
+            latencies = await _run_round(agent, args.requests, args.concurrency)
+        results[label] = (latencies, code_agent.hedger.get_stats())
+
+    print("=" * 70)
+    print("📊 对冲请求基准测试")
+    print("=" * 70)
+    print(
+        f"桩服务: 常规 {args.delay}s, {args.tail_ratio:.0%} 长尾 {args.tail_delay}s | "
+        f"请求数 {args.requests}, 并发 {args.concurrency} | 对冲延迟分位 p{args.percentile * 100:.0f}, "
+        f"对冲预算 {args.budget:.0%}"
+    )
+    print(f"{'':<10}{'p50':>10}{'p95':>10}{'p99':>10}{'对冲次数':>10}")
+    for label, (latencies, stats) in results.items():
+        print(
+            f"{label:<10}"
+            f"{_percentile(latencies, 0.5):>10.3f}"
+            f"{_percentile(latencies, 0.95):>10.3f}"
+            f"{_percentile(latencies, 0.99):>10.3f}"
+            f"{stats['hedges']:>12}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对冲请求基准测试")
+    parser.add_argument("--requests", type=int, default=200, help="每轮请求数")
+    parser.add_argument("--concurrency", type=int, default=10, help="并发数")
+    parser.add_argument("--delay", type=float, default=0.2, help="常规补全耗时（秒）")
+    parser.add_argument("--tail-ratio", type=float, default=0.05, help="长尾补全占比")
+    parser.add_argument("--tail-delay", type=float, default=3.0, help="长尾补全耗时（秒）")
+    parser.add_argument("--percentile", type=float, default=0.9, help="对冲延迟取历史耗时的该分位数")
+    parser.add_argument("--budget", type=float, default=0.1, help="触发对冲的请求最多占比")
+    parser.add_argument("--seed", type=int, default=42, help="桩服务随机种子")
+    args = parser.parse_args()
+
+    asyncio.run(run_bench(args))
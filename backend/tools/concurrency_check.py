@@ -0,0 +1,185 @@
+"""
+并发响应性检查 - 验证LLM生成期间其他接口不被阻塞
+
+启动一个本地LLM桩服务和后端服务，由多个客户端（不同X-Client-ID）同时发起指令各不相同的
+/api/generate-project 请求（相同指令会被合并为一次调用，无法反映真实并发），
+期间持续探测 /health 和 /api/projects，若探测延迟超过阈值则判定事件循环被阻塞。
+
+调度器限制了同时进行的LLM调用数，总耗时按调度器上限计算出的批次数判断，而不是要求全部同时完成。
+
+项目没有单元测试套件，本脚本就是LLM调用不阻塞事件循环的回归检查：不需要API密钥和外部服务，
+运行时数据写入临时目录，通过时退出码为0、失败为1，可直接作为CI步骤运行。
+
+用法（在backend目录下）：
+    python tools/concurrency_check.py
+    python tools/concurrency_check.py --generations 20 --clients 5 --delay 5
+"""
+
+import argparse
+import asyncio
+import math
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _serve_in_thread(app, port: int):
+    """在后台线程中启动uvicorn服务，返回server对象"""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def _probe(client, url: str, stop: asyncio.Event, latencies: list):
+    """循环探测某个接口，记录每次响应耗时"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = await client.get(url)
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.1)
+
+
+def _expected_waves(generations: int, clients: int) -> int:
+    """按调度器上限估算全部生成需要的批次数（桩服务共用同一个API Key）"""
+    from config import settings
+
+    per_client = math.ceil(generations / clients)
+    capacity = min(
+        settings.scheduler_max_concurrent,
+        settings.scheduler_max_per_key,
+        clients * settings.scheduler_max_per_client
+    )
+    return max(
+        math.ceil(generations / capacity),
+        math.ceil(per_client / settings.scheduler_max_per_client)
+    )
+
+
+async def run_check(generations: int, clients: int, delay: float, max_probe_latency: float) -> bool:
+    stub_port = _free_port()
+    backend_port = _free_port()
+
+    # 必须在导入main/config之前设置，让后端指向本地桩服务，项目等运行时数据写入临时目录
+    os.environ["MINIMAX_BASE_URL"] = f"http://127.0.0.1:{stub_port}/v1"
+    os.environ.setdefault("MINIMAX_API_KEY", "stub-key")
+    storage_root = tempfile.mkdtemp(prefix="concurrency-check-")
+    os.environ["STORAGE_ROOT"] = storage_root
+    try:
+        return await _run_check(generations, clients, delay, max_probe_latency, stub_port, backend_port)
+    finally:
+        shutil.rmtree(storage_root, ignore_errors=True)
+
+
+async def _run_check(
+    generations: int,
+    clients: int,
+    delay: float,
+    max_probe_latency: float,
+    stub_port: int,
+    backend_port: int
+) -> bool:
+    import httpx
+
+    from tools.stub_llm_server import create_app
+    from main import app as backend_app
+
+    _serve_in_thread(create_app(delay), stub_port)
+    _serve_in_thread(backend_app, backend_port)
+
+    base_url = f"http://127.0.0.1:{backend_port}"
+    clients = max(1, min(clients, generations))
+    waves = _expected_waves(generations, clients)
+
+    def generate(index: int):
+        client_id = f"concurrency-check-{index % clients}"
+        payload = {
+            "instruction": f"创建一个简约的指针表盘，编号 {index + 1}",
+            "assets": {},
+            "session_id": client_id,
+            "use_cache": False,
+        }
+        return client.post("/api/generate-project", json=payload, headers={"X-Client-ID": client_id})
+
+    health_latencies: list = []
+    list_latencies: list = []
+    stop = asyncio.Event()
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=delay * 10 + 60) as client:
+        probes = [
+            asyncio.create_task(_probe(client, "/health", stop, health_latencies)),
+            asyncio.create_task(_probe(client, "/api/projects", stop, list_latencies)),
+        ]
+
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[generate(index) for index in range(generations)])
+        elapsed = time.perf_counter() - start
+
+        stop.set()
+        await asyncio.gather(*probes)
+
+        # 清理生成的项目（使用创建项目时的客户端ID，否则没有删除权限）
+        deleted = 0
+        for response in responses:
+            if response.status_code == 200:
+                cleanup = await client.delete(
+                    f"/api/project/{response.json()['project_id']}",
+                    headers={"X-Client-ID": response.request.headers["X-Client-ID"]}
+                )
+                deleted += cleanup.status_code == 200
+
+    succeeded = sum(1 for r in responses if r.status_code == 200)
+    # 每个请求都应创建自己的项目（没有被合并）
+    distinct_projects = len({r.json()["project_id"] for r in responses if r.status_code == 200})
+    rejected = sum(1 for r in responses if r.status_code == 429)
+    max_health = max(health_latencies) if health_latencies else float("inf")
+    max_list = max(list_latencies) if list_latencies else float("inf")
+
+    print("=" * 70)
+    print("📊 并发响应性检查结果")
+    print("=" * 70)
+    print(f"并发生成数: {generations}，客户端数: {clients} (成功 {succeeded}，独立项目 {distinct_projects}，429 {rejected})")
+    print(f"单次模拟耗时: {delay:.1f}s | 全部完成耗时: {elapsed:.1f}s（按调度器上限预计 {waves} 批）")
+    print(f"/health 探测 {len(health_latencies)} 次，最大延迟 {max_health * 1000:.0f}ms")
+    print(f"清理项目: {deleted}/{succeeded}")
+    print(f"/api/projects 探测 {len(list_latencies)} 次，最大延迟 {max_list * 1000:.0f}ms")
+
+    ok = (
+        succeeded == generations
+        and distinct_projects == generations
+        and deleted == succeeded
+        and elapsed < delay * (waves + 1) + 5  # 按调度器上限分批并行完成，而非串行
+        and max_health < max_probe_latency
+        and max_list < max_probe_latency
+    )
+    print("✅ 通过：生成期间其他接口保持响应" if ok else "❌ 失败：事件循环被阻塞或生成失败")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="并发响应性检查")
+    parser.add_argument("--generations", type=int, default=20, help="并发生成请求数")
+    parser.add_argument("--clients", type=int, default=5, help="发起请求的客户端数（X-Client-ID）")
+    parser.add_argument("--delay", type=float, default=3.0, help="桩服务每次补全的模拟耗时（秒）")
+    parser.add_argument("--max-probe-latency", type=float, default=1.0, help="探测接口允许的最大延迟（秒）")
+    args = parser.parse_args()
+
+    passed = asyncio.run(run_check(args.generations, args.clients, args.delay, args.max_probe_latency))
+    sys.exit(0 if passed else 1)
@@ -0,0 +1,236 @@
+"""
+后端压测 - 并发执行 上传素材 → 生成 → 列表 → 下载 → 获取素材 → 编辑 的完整流程，统计各接口吞吐与延迟分位数
+
+默认在进程内启动本地LLM桩服务（tools/stub_llm_server.py）和后端服务，不产生真实的 MiniMax 调用费用；
+也可以用 --base-url 压测已经在运行的后端（此时后端自身需要通过 MINIMAX_BASE_URL 指向桩服务）。
+
+每个虚拟用户使用独立的 X-Client-ID 和会话ID，循环执行流程直到 --duration 秒结束，
+结束后删除压测产生的项目和素材。
+
+用法：
+    python tools/load_test.py --users 20 --duration 60 --delay 1 --latency lognormal --error-rate 0.02
+    python tools/load_test.py --base-url http://127.0.0.1:10030 --users 10 --duration 120
+"""
+
+import argparse
+import asyncio
+import base64
+import os
+import sys
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tools.concurrency_check import _free_port, _serve_in_thread
+
+
+# 1x1 PNG，用作上传的背景素材
+_PNG_BYTES = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=="
+)
+
+EDIT_INSTRUCTIONS = ["把背景改成深蓝色", "秒针改成红色", "表盘背景换个颜色"]
+
+
+class EndpointStats:
+    """单个接口的请求耗时与结果统计"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.statuses: Dict[str, int] = defaultdict(int)
+        self.bytes = 0
+
+    def record(self, latency: float, status: str, size: int = 0):
+        self.latencies.append(latency)
+        self.statuses[status] += 1
+        self.bytes += size
+
+    @property
+    def errors(self) -> int:
+        return sum(count for status, count in self.statuses.items() if not status.startswith("2"))
+
+
+def _percentile(ordered: list, p: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+class LoadTest:
+    """虚拟用户循环执行完整流程，按接口统计结果"""
+
+    def __init__(self, client, duration: float, edits: int):
+        self.client = client
+        self.duration = duration
+        self.edits = edits
+        self.stats: Dict[str, EndpointStats] = defaultdict(EndpointStats)
+        self.created: List[tuple] = []  # (client_id, project_id)
+        self.sessions: List[str] = []
+
+    async def _request(self, endpoint: str, method: str, url: str, **kwargs):
+        """发送请求并记录到endpoint的统计中，失败（含非2xx）时返回None"""
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except Exception as e:
+            self.stats[endpoint].record(time.perf_counter() - start, type(e).__name__)
+            return None
+        self.stats[endpoint].record(time.perf_counter() - start, str(response.status_code), len(response.content))
+        return response if response.is_success else None
+
+    async def _user(self, index: int, deadline: float):
+        client_id = f"loadtest-{uuid.uuid4().hex[:12]}"
+        session_id = f"loadtest-{index}-{uuid.uuid4().hex[:8]}"
+        headers = {"X-Client-ID": client_id}
+        self.sessions.append(session_id)
+
+        while time.monotonic() < deadline:
+            response = await self._request(
+                "upload-asset", "POST", "/api/upload-asset",
+                files={"file": ("background.png", _PNG_BYTES, "image/png")},
+                data={"asset_type": "background_round", "session_id": session_id},
+            )
+            if response is None:
+                continue
+            asset = response.json()["asset"]
+
+            response = await self._request(
+                "generate", "POST", "/api/generate-project", headers=headers,
+                json={
+                    "instruction": f"创建一个圆形指针表盘 #{uuid.uuid4().hex[:6]}",
+                    "assets": {"background_round": asset},
+                    "session_id": session_id,
+                    "use_cache": False,
+                },
+            )
+            if response is None:
+                continue
+            project_id = response.json()["project_id"]
+            self.created.append((client_id, project_id))
+
+            await self._request("list", "GET", "/api/projects", headers=headers)
+            await self._request("download", "GET", f"/api/download-project/{project_id}", headers=headers)
+            await self._request("asset", "GET", f"/api/project/{project_id}/assets/{asset['stored_filename']}")
+
+            for edit_index in range(self.edits):
+                if time.monotonic() >= deadline:
+                    break
+                await self._request(
+                    "edit", "POST", "/api/edit-project", headers=headers,
+                    json={
+                        "instruction": EDIT_INSTRUCTIONS[edit_index % len(EDIT_INSTRUCTIONS)],
+                        "session_id": session_id,
+                        "project_id": project_id,
+                        "use_cache": False,
+                    },
+                )
+                await self._request("list", "GET", "/api/projects", headers=headers)
+
+    async def run(self, users: int) -> float:
+        """运行压测，返回实际耗时（秒）"""
+        start = time.monotonic()
+        await asyncio.gather(*[self._user(i, start + self.duration) for i in range(users)])
+        return time.monotonic() - start
+
+    async def cleanup(self):
+        """删除压测产生的项目与素材"""
+        for client_id, project_id in self.created:
+            await self.client.delete(f"/api/project/{project_id}", headers={"X-Client-ID": client_id})
+        for session_id in self.sessions:
+            await self.client.delete(f"/api/assets/{session_id}")
+
+    def report(self, elapsed: float):
+        print("=" * 96)
+        print(f"📊 压测结果（耗时 {elapsed:.1f}s）")
+        print("=" * 96)
+        print(
+            f"{'接口':<14}{'请求数':>8}{'错误':>8}{'吞吐(req/s)':>14}"
+            f"{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}{'平均大小':>12}"
+        )
+        for endpoint in ("upload-asset", "generate", "list", "download", "asset", "edit"):
+            stats = self.stats.get(endpoint)
+            if stats is None or not stats.latencies:
+                continue
+            ordered = sorted(stats.latencies)
+            print(
+                f"{endpoint:<14}{len(ordered):>8}{stats.errors:>8}{len(ordered) / elapsed:>14.2f}"
+                f"{_percentile(ordered, 0.5):>10.3f}{_percentile(ordered, 0.95):>10.3f}"
+                f"{_percentile(ordered, 0.99):>10.3f}{ordered[-1]:>10.3f}"
+                f"{stats.bytes // len(ordered):>12}"
+            )
+        failures = {
+            endpoint: {status: count for status, count in stats.statuses.items() if not status.startswith("2")}
+            for endpoint, stats in self.stats.items()
+            if stats.errors
+        }
+        if failures:
+            print(f"❌ 错误明细: {failures}")
+
+
+async def run_load_test(args) -> None:
+    import httpx
+
+    stub_base_url: Optional[str] = None
+    base_url = args.base_url
+    if base_url is None:
+        stub_port = _free_port()
+        backend_port = _free_port()
+        stub_base_url = f"http://127.0.0.1:{stub_port}"
+
+        # 必须在导入main/config之前设置，让后端指向本地桩服务
+        os.environ["MINIMAX_BASE_URL"] = f"{stub_base_url}/v1"
+        os.environ.setdefault("MINIMAX_API_KEY", "stub-key")
+
+        import logging
+        from tools.stub_llm_server import create_app
+        from main import app as backend_app
+
+        logging.getLogger("watchface_backend").setLevel(logging.WARNING)
+        _serve_in_thread(
+            create_app(
+                args.delay, args.tail_ratio, args.tail_delay, seed=args.seed,
+                latency=args.latency, spread=args.spread,
+                error_rate=args.error_rate, error_kinds=[k for k in args.error_kinds.split(",") if k],
+                hang_time=args.hang_time,
+            ),
+            stub_port,
+        )
+        _serve_in_thread(backend_app, backend_port)
+        base_url = f"http://127.0.0.1:{backend_port}"
+
+    limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        test = LoadTest(client, args.duration, args.edits)
+        try:
+            elapsed = await test.run(args.users)
+        finally:
+            await test.cleanup()
+        test.report(elapsed)
+
+        scheduler = (await client.get("/api/scheduler/stats")).json()
+        print(f"⏳ 调度器: 已调度 {scheduler['dispatched']}，拒绝 {scheduler['rejected']}，排队等待 {scheduler['wait_time']}")
+        if stub_base_url is not None:
+            stub_stats = (await client.get(f"{stub_base_url}/stats")).json()
+            print(f"🤖 桩服务: {stub_stats}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="后端压测（生成/编辑/列表/下载/素材接口）")
+    parser.add_argument("--base-url", default=None, help="压测已运行的后端；不指定时在进程内启动桩服务和后端")
+    parser.add_argument("--users", type=int, default=10, help="并发虚拟用户数")
+    parser.add_argument("--duration", type=float, default=30.0, help="压测时长（秒）")
+    parser.add_argument("--edits", type=int, default=2, help="每个项目的编辑次数")
+    parser.add_argument("--timeout", type=float, default=300.0, help="单个请求超时（秒）")
+    parser.add_argument("--delay", type=float, default=1.0, help="桩服务补全耗时（秒）")
+    parser.add_argument("--latency", default="lognormal", help="桩服务延迟分布（fixed/uniform/lognormal/exponential）")
+    parser.add_argument("--spread", type=float, default=0.5, help="桩服务延迟分布宽度")
+    parser.add_argument("--tail-ratio", type=float, default=0.0, help="桩服务长尾补全占比")
+    parser.add_argument("--tail-delay", type=float, default=0.0, help="桩服务长尾补全耗时（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="桩服务注入错误的请求占比")
+    parser.add_argument("--error-kinds", default="500,503,429,malformed", help="桩服务注入的错误类型，逗号分隔")
+    parser.add_argument("--hang-time", type=float, default=30.0, help="桩服务timeout类错误挂起时长（秒）")
+    parser.add_argument("--seed", type=int, default=None, help="桩服务随机种子")
+    args = parser.parse_args()
+
+    asyncio.run(run_load_test(args))
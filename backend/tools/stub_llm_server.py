@@ -0,0 +1,463 @@
+"""
+本地 OpenAI 兼容的 LLM 桩服务 - 用于并发、压测与延迟测试（不产生真实的 MiniMax 调用费用）
+
+支持：
+- 延迟分布：fixed（固定）、uniform（均匀）、lognormal（对数正态，中位数为 --delay）、exponential（指数，均值为 --delay），
+  以及叠加在其上的长尾（--tail-ratio 比例的补全耗时 --tail-delay）
+- 流式输出（含 reasoning_details 思考过程分块）与非流式输出（含 usage）
+- 预置的几种表盘HTML和一个BlueOS .ux表盘（系统提示词为.ux时）；编辑请求按系统提示词返回 SEARCH/REPLACE 修改块或完整代码
+- 对话摘要请求：已有摘要 + 每条新增用户指令一行要点
+- 请求未开启 reasoning_split 时与 MiniMax-M2 一致：思考过程以 <think>…</think> 写在正文开头（补丁回复的思考中带一个草稿修改块）
+- 错误注入：按 --error-rate 比例随机返回 500/503/429（带Retry-After）、超时（挂起）、流中途断开、无代码的畸形输出
+
+用法：
+    python tools/stub_llm_server.py --port 18080 --delay 5 --latency lognormal --spread 0.5 \\
+        --error-rate 0.05 --error-kinds 503,429,disconnect
+
+然后将后端的 MINIMAX_BASE_URL 指向 http://127.0.0.1:18080/v1 即可（settings.minimax_base_url 读取该环境变量）。
+桩服务的请求与错误注入统计见 GET /stats。
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+from collections import Counter
+from typing import Optional, Sequence
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+_CLOCK_SCRIPT = """<script>
+  function updateClock() {
+    const now = new Date();
+    const s = now.getSeconds(), m = now.getMinutes(), h = now.getHours() % 12;
+    document.getElementById('second').style.transform = `rotate(${s * 6}deg)`;
+    document.getElementById('minute').style.transform = `rotate(${m * 6 + s * 0.1}deg)`;
+    document.getElementById('hour').style.transform = `rotate(${h * 30 + m * 0.5}deg)`;
+  }
+  setInterval(updateClock, 1000);
+  updateClock();
+</script>"""
+
+CANNED_HTML = """<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="UTF-8">
+<title>Stub Watchface</title>
+<style>
+  body { margin: 0; background: #000; display: flex; align-items: center; justify-content: center; height: 100vh; }
+  .watch-face { width: 360px; height: 360px; border-radius: 50%; background: #1a1a2e; position: relative; }
+  .hand { position: absolute; left: 50%; bottom: 50%; transform-origin: 50% 100%; background: #fff; }
+  .hour-hand { width: 6px; height: 90px; margin-left: -3px; }
+  .minute-hand { width: 4px; height: 130px; margin-left: -2px; }
+  .second-hand { width: 2px; height: 150px; margin-left: -1px; background: #e94560; }
+</style>
+</head>
+<body>
+<div class="watch-face">
+  <div class="hand hour-hand" id="hour"></div>
+  <div class="hand minute-hand" id="minute"></div>
+  <div class="hand second-hand" id="second"></div>
+</div>
+""" + _CLOCK_SCRIPT + """
+</body>
+</html>"""
+
+CANNED_DIGITAL_HTML = """<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="UTF-8">
+<title>Stub Digital Watchface</title>
+<style>
+  body { margin: 0; background: #000; display: flex; align-items: center; justify-content: center; height: 100vh; }
+  .watch-face { width: 360px; height: 360px; border-radius: 50%; background: #0f3460; color: #fff; font-family: monospace; }
+  .time { font-size: 72px; text-align: center; padding-top: 120px; }
+  .date { font-size: 20px; text-align: center; opacity: 0.7; }
+</style>
+</head>
+<body>
+<div class="watch-face">
+  <div class="time" id="time">00:00</div>
+  <div class="date" id="date"></div>
+</div>
+<script>
+  function updateClock() {
+    const now = new Date();
+    const pad = (n) => String(n).padStart(2, '0');
+    document.getElementById('time').textContent = `${pad(now.getHours())}:${pad(now.getMinutes())}`;
+    document.getElementById('date').textContent = now.toLocaleDateString('zh-CN', { weekday: 'short', month: 'numeric', day: 'numeric' });
+  }
+  setInterval(updateClock, 1000);
+  updateClock();
+</script>
+</body>
+</html>"""
+
+CANNED_IMAGE_HTML = """<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="UTF-8">
+<title>Stub Image Watchface</title>
+<style>
+  body { margin: 0; background: #000; display: flex; align-items: center; justify-content: center; height: 100vh; }
+  .watch-face { width: 360px; height: 360px; border-radius: 50%; background: #222 url('assets/background.png') center / cover; position: relative; }
+  .hand { position: absolute; left: 50%; bottom: 50%; transform-origin: 50% 100%; background: #ffd369; }
+  .hour-hand { width: 8px; height: 80px; margin-left: -4px; border-radius: 4px; }
+  .minute-hand { width: 5px; height: 120px; margin-left: -2.5px; border-radius: 3px; }
+  .second-hand { width: 2px; height: 145px; margin-left: -1px; background: #ff6b6b; }
+</style>
+</head>
+<body>
+<div class="watch-face">
+  <div class="hand hour-hand" id="hour"></div>
+  <div class="hand minute-hand" id="minute"></div>
+  <div class="hand second-hand" id="second"></div>
+</div>
+""" + _CLOCK_SCRIPT + """
+</body>
+</html>"""
+
+CANNED_OUTPUTS = [CANNED_HTML, CANNED_DIGITAL_HTML, CANNED_IMAGE_HTML]
+
+CANNED_UX = """<template>
+  <div class="watch-face">
+    <text class="time">{{ time }}</text>
+  </div>
+</template>
+
+<script>
+export default {
+  data: {
+    time: '00:00',
+    timer: null
+  },
+  onInit() {
+    this.updateTime()
+    this.timer = setInterval(() => this.updateTime(), 1000)
+  },
+  onDestroy() {
+    clearInterval(this.timer)
+  },
+  updateTime() {
+    const now = new Date()
+    const pad = n => (n < 10 ? '0' + n : '' + n)
+    this.time = pad(now.getHours()) + ':' + pad(now.getMinutes())
+  }
+}
+</script>
+
+<style>
+  .watch-face { width: 466px; height: 466px; border-radius: 233px; background: #000000; }
+  .time { font-size: 96px; color: #ffffff; text-align: center; }
+</style>"""
+
+# 编辑时替换的背景色
+EDIT_COLORS = ["#1a1a2e", "#16213e", "#2d4059", "#3a0ca3", "#1b4332", "#5a189a", "#7f1d1d"]
+
+REASONING_TEXT = "桩服务：分析需求，选择预置表盘模板并输出完整代码。"
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "lognormal", "exponential")
+ERROR_KINDS = ("500", "503", "429", "timeout", "disconnect", "malformed")
+
+# 编辑请求中可被修改的表盘背景声明
+_FACE_BACKGROUND_PATTERN = re.compile(r"^(\s*\.watch-face \{.*?background: )(#[0-9a-fA-F]{3,6})(.*)$", re.MULTILINE)
+_SUMMARY_PREVIOUS_PATTERN = re.compile(r"已有摘要：\n(.*?)\n\n新增对话：", re.DOTALL)
+_SUMMARY_INSTRUCTION_PATTERN = re.compile(r"^👤 用户: (.*)$", re.MULTILINE)
+
+
+def _message_text(message: dict) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+
+def build_reply(messages: Sequence[dict], rng: random.Random) -> str:
+    """
+    根据请求消息构造回复正文
+
+    - 生成请求：按用户消息哈希选择一个预置表盘，返回```html代码块（.ux系统提示词返回```ux代码块）
+    - 编辑请求（用户消息中带有当前代码）：修改表盘背景色；系统提示词要求SEARCH/REPLACE时只返回修改块
+    - 对话摘要请求：保留已有摘要，每条新增的用户指令追加一行要点
+    """
+    system = "".join(_message_text(m) for m in messages if m.get("role") == "system")
+    user = _message_text(next((m for m in reversed(messages) if m.get("role") == "user"), {}))
+
+    if "设计决策摘要" in system:
+        previous = _SUMMARY_PREVIOUS_PATTERN.search(user)
+        lines = [line for line in (previous.group(1) if previous else "").splitlines() if line.startswith("- ")]
+        lines += [f"- {instruction.strip()}" for instruction in _SUMMARY_INSTRUCTION_PATTERN.findall(user)]
+        return "\n".join(lines)
+
+    ux = "BlueOS" in system
+    match = _FACE_BACKGROUND_PATTERN.search(user)
+    if match is None and ux:
+        return f"这是为你生成的表盘：\n\n```ux\n{CANNED_UX}\n```"
+    if match is None:
+        digest = int(hashlib.md5(user.encode("utf-8")).hexdigest(), 16)
+        html = CANNED_OUTPUTS[digest % len(CANNED_OUTPUTS)]
+        return f"这是为你生成的表盘：\n\n```html\n{html}\n```"
+
+    old_line = match.group(0)
+    new_color = rng.choice([c for c in EDIT_COLORS if c.lower() != match.group(2).lower()])
+    new_line = f"{match.group(1)}{new_color}{match.group(3)}"
+
+    if "SEARCH/REPLACE" in system:
+        return (
+            f"已将表盘背景色修改为 {new_color}。\n\n"
+            f"<<<<<<< SEARCH\n{old_line}\n=======\n{new_line}\n>>>>>>> REPLACE"
+        )
+
+    # 完整模式：从用户消息中取出当前代码并整体返回
+    if ux:
+        code_match = re.search(r"<template>.*</style>", user, re.DOTALL)
+        code = code_match.group(0) if code_match else CANNED_UX
+        return f"已将表盘背景色修改为 {new_color}：\n\n```ux\n{code.replace(old_line, new_line)}\n```"
+    code_match = re.search(r"<!DOCTYPE html>.*?</html>", user, re.DOTALL | re.IGNORECASE)
+    html = code_match.group(0) if code_match else CANNED_HTML
+    return f"已将表盘背景色修改为 {new_color}：\n\n```html\n{html.replace(old_line, new_line)}\n```"
+
+
+def inline_think(content: str) -> str:
+    """未开启reasoning_split时把思考过程写在正文开头的<think>中（约1000字符；补丁回复附带一个不同颜色的草稿修改块）"""
+    draft = ""
+    if "<<<<<<< SEARCH" in content:
+        search, _, replace = content[content.index("<<<<<<< SEARCH"):].partition("=======")
+        draft = f"先试试品红色：\n{search}======={re.sub(r'#[0-9a-fA-F]{3,6}', '#ff00ff', replace)}\n"
+    thinking = "\n".join([REASONING_TEXT] * 40)
+    return f"<think>\n{thinking}\n{draft}</think>\n\n{content}"
+
+
+def _chunk(completion_id: str, model: str, delta: dict, finish_reason=None) -> str:
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+async def _stream_chunks(
+    completion_id: str,
+    model: str,
+    content: str,
+    delay: float,
+    chunk_size: int = 64,
+    ttft_ratio: float = 0.0,
+    disconnect: bool = False,
+    reasoning: str = REASONING_TEXT,
+):
+    """
+    按OpenAI流式协议逐块输出：先输出思考过程，再把剩余耗时均摊到正文分块上
+
+    Args:
+        ttft_ratio: 首个正文分块之前（思考阶段）占总耗时的比例
+        disconnect: 输出一半正文后直接断开（模拟上游连接中断）
+        reasoning: reasoning_details中的思考过程（未开启reasoning_split时为空，思考过程已写在正文中）
+    """
+    reasoning_delay = delay * ttft_ratio
+    reasoning_pieces = [reasoning[i:i + 8] for i in range(0, len(reasoning), 8)]
+    for index, piece in enumerate(reasoning_pieces):
+        if index:
+            await asyncio.sleep(reasoning_delay / len(reasoning_pieces))
+        delta = {"reasoning_details": [{"type": "reasoning.text", "text": piece}]}
+        if index == 0:
+            delta["role"] = "assistant"
+        yield _chunk(completion_id, model, delta)
+    if not reasoning_pieces:
+        await asyncio.sleep(reasoning_delay)
+
+    pieces = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+    if disconnect:
+        pieces = pieces[:max(1, len(pieces) // 2)]
+    content_delay = delay - reasoning_delay
+    for piece in pieces:
+        await asyncio.sleep(content_delay / len(pieces))
+        yield _chunk(completion_id, model, {"content": piece})
+
+    if disconnect:
+        raise ConnectionResetError("stub: injected stream disconnect")
+
+    yield _chunk(completion_id, model, {}, finish_reason="stop")
+    yield "data: [DONE]\n\n"
+
+
+def create_app(
+    delay: float = 2.0,
+    tail_ratio: float = 0.0,
+    tail_delay: float = 0.0,
+    seed: int = None,
+    latency: str = "fixed",
+    spread: float = 0.5,
+    ttft_ratio: float = 0.0,
+    error_rate: float = 0.0,
+    error_kinds: Optional[Sequence[str]] = None,
+    hang_time: float = 600.0,
+) -> FastAPI:
+    """
+    创建桩服务应用
+
+    Args:
+        delay: 每次补全的模拟耗时（秒）；lognormal为中位数，exponential为均值
+        tail_ratio: 落入长尾的补全占比（0~1）
+        tail_delay: 长尾补全的模拟耗时（秒）
+        seed: 随机种子（便于复现基准测试）
+        latency: 延迟分布（fixed / uniform / lognormal / exponential）
+        spread: 分布宽度：uniform为 delay×(1±spread)，lognormal为sigma
+        ttft_ratio: 流式输出中首个正文分块前的耗时占比
+        error_rate: 注入错误的请求占比（0~1）
+        error_kinds: 注入的错误类型（500 / 503 / 429 / timeout / disconnect / malformed），默认全部
+        hang_time: timeout类错误挂起的时长（秒）
+    """
+    if latency not in LATENCY_DISTRIBUTIONS:
+        raise ValueError(f"unknown latency distribution: {latency}")
+    error_kinds = list(error_kinds or ERROR_KINDS)
+    unknown = set(error_kinds) - set(ERROR_KINDS)
+    if unknown:
+        raise ValueError(f"unknown error kinds: {sorted(unknown)}")
+
+    app = FastAPI(title="Stub LLM Server")
+    rng = random.Random(seed)
+    stats = Counter()
+
+    def sample_delay() -> float:
+        if rng.random() < tail_ratio:
+            return tail_delay
+        if latency == "uniform":
+            return rng.uniform(delay * max(0.0, 1 - spread), delay * (1 + spread))
+        if latency == "lognormal":
+            return rng.lognormvariate(0.0, spread) * delay if delay > 0 else 0.0
+        if latency == "exponential":
+            return rng.expovariate(1.0 / delay) if delay > 0 else 0.0
+        return delay
+
+    def sample_error() -> Optional[str]:
+        if error_rate > 0 and rng.random() < error_rate:
+            return rng.choice(error_kinds)
+        return None
+
+    def error_response(kind: str) -> JSONResponse:
+        status = int(kind)
+        headers = {"Retry-After": "1"} if status == 429 else None
+        return JSONResponse(
+            status_code=status,
+            content={"error": {"message": f"stub injected {kind}", "type": "stub_error", "code": kind}},
+            headers=headers,
+        )
+
+    @app.get("/v1/models")
+    async def list_models():
+        return {"object": "list", "data": [{"id": "MiniMax-M2", "object": "model", "owned_by": "stub"}]}
+
+    @app.get("/stats")
+    async def get_stats():
+        return {
+            "requests": stats["requests"],
+            "streams": stats["streams"],
+            "errors": {kind: stats[f"error:{kind}"] for kind in error_kinds},
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "stub-model")
+        stream = bool(body.get("stream"))
+        completion_id = f"stub-{uuid.uuid4().hex[:12]}"
+        stats["requests"] += 1
+        stats["streams"] += stream
+
+        error = sample_error()
+        if error:
+            stats[f"error:{error}"] += 1
+        if error in ("500", "503", "429"):
+            return error_response(error)
+        if error == "timeout":
+            await asyncio.sleep(hang_time)
+
+        content = build_reply(body.get("messages", []), rng)
+        if error == "malformed":
+            # 只有说明文字、没有代码：后端应判定为生成失败
+            content = "抱歉，我暂时无法生成这个表盘。"
+        reasoning_split = bool(body.get("reasoning_split"))
+        if not reasoning_split:
+            content = inline_think(content)
+
+        if stream:
+            return StreamingResponse(
+                _stream_chunks(
+                    completion_id, model, content, sample_delay(),
+                    ttft_ratio=ttft_ratio, disconnect=error == "disconnect",
+                    reasoning=REASONING_TEXT if reasoning_split else "",
+                ),
+                media_type="text/event-stream",
+            )
+
+        await asyncio.sleep(sample_delay())
+        if error == "disconnect":
+            raise ConnectionResetError("stub: injected disconnect")
+
+        prompt_tokens = sum(len(_message_text(m)) for m in body.get("messages", [])) // 3
+        completion_tokens = len(content) // 3
+        message = {"role": "assistant", "content": content}
+        if reasoning_split:
+            message["reasoning_details"] = [{"type": "reasoning.text", "text": REASONING_TEXT}]
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": message,
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容 LLM 桩服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--delay", type=float, default=2.0, help="每次补全的模拟耗时（秒）")
+    parser.add_argument("--latency", choices=LATENCY_DISTRIBUTIONS, default="fixed", help="延迟分布")
+    parser.add_argument("--spread", type=float, default=0.5, help="分布宽度（uniform为±比例，lognormal为sigma）")
+    parser.add_argument("--ttft-ratio", type=float, default=0.0, help="流式输出中首个正文分块前的耗时占比")
+    parser.add_argument("--tail-ratio", type=float, default=0.0, help="落入长尾的补全占比")
+    parser.add_argument("--tail-delay", type=float, default=0.0, help="长尾补全的模拟耗时（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入错误的请求占比")
+    parser.add_argument(
+        "--error-kinds", default=",".join(ERROR_KINDS),
+        help=f"注入的错误类型，逗号分隔（{','.join(ERROR_KINDS)}）",
+    )
+    parser.add_argument("--hang-time", type=float, default=600.0, help="timeout类错误挂起的时长（秒）")
+    parser.add_argument("--seed", type=int, default=None, help="随机种子")
+    args = parser.parse_args()
+
+    uvicorn.run(
+        create_app(
+            args.delay, args.tail_ratio, args.tail_delay, seed=args.seed,
+            latency=args.latency, spread=args.spread, ttft_ratio=args.ttft_ratio,
+            error_rate=args.error_rate, error_kinds=[k for k in args.error_kinds.split(",") if k],
+            hang_time=args.hang_time,
+        ),
+        host=args.host, port=args.port, log_level="warning"
+    )
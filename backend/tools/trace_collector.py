@@ -0,0 +1,107 @@
+"""
+OTLP收集器替身 - 接收 OTLP/HTTP JSON 格式的追踪数据，按trace转换为本地JSON行格式写入文件
+
+用于在没有OpenTelemetry Collector的环境中验证 tracing_exporter=otlp，
+写出的文件可直接用 tools/trace_report.py 查看。
+
+用法：
+    python tools/trace_collector.py --port 4318 --output ../storage/traces/collector.jsonl
+    TRACING_EXPORTER=otlp TRACING_OTLP_ENDPOINT=http://127.0.0.1:4318/v1/traces python main.py
+"""
+
+import argparse
+import json
+import os
+from collections import defaultdict
+from typing import Dict, List
+
+from fastapi import FastAPI, Request
+
+
+def _attribute_value(value: Dict):
+    if "intValue" in value:
+        return int(value["intValue"])
+    for key in ("stringValue", "doubleValue", "boolValue"):
+        if key in value:
+            return value[key]
+    return None
+
+
+def traces_from_otlp(payload: Dict) -> List[Dict]:
+    """把OTLP请求体转换为按trace分组的本地格式（与file导出格式相同）"""
+    spans_by_trace = defaultdict(list)
+    for resource_spans in payload.get("resourceSpans", []):
+        for scope_spans in resource_spans.get("scopeSpans", []):
+            for span in scope_spans.get("spans", []):
+                spans_by_trace[span["traceId"]].append(span)
+
+    traces = []
+    for trace_id, spans in spans_by_trace.items():
+        ids = {span["spanId"] for span in spans}
+        root = next((span for span in spans if span.get("parentSpanId", "") not in ids), spans[0])
+        root_start = int(root["startTimeUnixNano"])
+        converted = []
+        for span in sorted(spans, key=lambda s: int(s["startTimeUnixNano"])):
+            start, end = int(span["startTimeUnixNano"]), int(span["endTimeUnixNano"])
+            status = span.get("status", {})
+            converted.append({
+                "span_id": span["spanId"],
+                "parent_id": span.get("parentSpanId") or None,
+                "name": span["name"],
+                "offset_ms": round((start - root_start) / 1e6, 3),
+                "duration_ms": round((end - start) / 1e6, 3),
+                "status": "error" if status.get("code") == 2 else "ok",
+                "error": status.get("message"),
+                "attributes": {item["key"]: _attribute_value(item["value"]) for item in span.get("attributes", [])},
+            })
+        root_converted = next(span for span in converted if span["span_id"] == root["spanId"])
+        traces.append({
+            "trace_id": trace_id,
+            "name": root["name"],
+            "start": root_start / 1e9,
+            "duration_ms": root_converted["duration_ms"],
+            "status": root_converted["status"],
+            "attributes": root_converted["attributes"],
+            "spans": converted,
+        })
+    return traces
+
+
+def create_app(output: str) -> FastAPI:
+    app = FastAPI(title="OTLP Collector Stand-in")
+    stats = {"requests": 0, "traces": 0, "spans": 0}
+
+    @app.post("/v1/traces")
+    async def receive(request: Request):
+        traces = traces_from_otlp(await request.json())
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "a", encoding="utf-8") as f:
+            for trace in traces:
+                f.write(json.dumps(trace, ensure_ascii=False) + "\n")
+        stats["requests"] += 1
+        stats["traces"] += len(traces)
+        stats["spans"] += sum(len(trace["spans"]) for trace in traces)
+        return {"partialSuccess": {}}
+
+    @app.get("/stats")
+    async def get_stats():
+        return {"output": output, **stats}
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="OTLP收集器替身")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=4318)
+    parser.add_argument(
+        "--output",
+        default=os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                             "storage", "traces", "collector.jsonl"),
+        help="写入的追踪文件",
+    )
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(args.output), host=args.host, port=args.port, log_level="warning")
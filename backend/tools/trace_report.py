@@ -0,0 +1,154 @@
+"""
+链路追踪报告 - 读取追踪文件，按span树展示单个请求的耗时，并按类别汇总时间花在了哪里
+
+类别按span自身耗时（扣除子span）统计：
+- model：llm.*（模型调用，含流式输出）
+- queue：scheduler.*（调度排队）
+- disk：storage.*（项目读写）
+- generator：generator.*（项目文件/文件树生成）
+- agent：agent.* / stage.*（提示词构建、代码提取、差异计算等）
+- handler：接口处理函数自身的其他逻辑
+- framework：根span扣除处理函数后的时间（请求解析、响应序列化、中间件）
+
+用法：
+    python tools/trace_report.py                          # 最慢的5个请求
+    python tools/trace_report.py --name edit-project -n 3  # 只看编辑请求
+    python tools/trace_report.py --trace-id <trace_id>
+    python tools/trace_report.py --file storage/traces/collector.jsonl
+"""
+
+import argparse
+import json
+import os
+import sys
+from collections import defaultdict
+from typing import Dict, List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CATEGORY_PREFIXES = [
+    ("llm.", "model"),
+    ("scheduler.", "queue"),
+    ("storage.", "disk"),
+    ("generator.", "generator"),
+    ("agent.", "agent"),
+    ("stage.", "agent"),
+    ("handler ", "handler"),
+]
+
+
+def load_traces(path: str) -> List[Dict]:
+    traces = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                traces.append(json.loads(line))
+    return traces
+
+
+def _category(span: Dict, root_id: str) -> str:
+    if span["span_id"] == root_id:
+        return "framework"
+    for prefix, category in CATEGORY_PREFIXES:
+        if span["name"].startswith(prefix):
+            return category
+    return "other"
+
+
+def self_times(trace: Dict) -> Dict[str, float]:
+    """每个span的自身耗时（扣除子span，子span并行时不会扣成负数）"""
+    children = defaultdict(float)
+    for span in trace["spans"]:
+        if span["parent_id"]:
+            children[span["parent_id"]] += span["duration_ms"]
+    return {span["span_id"]: max(0.0, span["duration_ms"] - children[span["span_id"]]) for span in trace["spans"]}
+
+
+def breakdown(trace: Dict) -> Dict[str, float]:
+    """按类别汇总自身耗时（毫秒）"""
+    root_id = _root(trace)["span_id"]
+    own = self_times(trace)
+    totals = defaultdict(float)
+    for span in trace["spans"]:
+        totals[_category(span, root_id)] += own[span["span_id"]]
+    return dict(totals)
+
+
+def _root(trace: Dict) -> Dict:
+    ids = {span["span_id"] for span in trace["spans"]}
+    for span in trace["spans"]:
+        if not span["parent_id"] or span["parent_id"] not in ids:
+            return span
+    return trace["spans"][0]
+
+
+def print_trace(trace: Dict):
+    root = _root(trace)
+    own = self_times(trace)
+    by_parent = defaultdict(list)
+    for span in trace["spans"]:
+        if span is not root:
+            by_parent[span["parent_id"]].append(span)
+
+    print("=" * 90)
+    print(f"🧵 {trace['name']}  trace_id={trace['trace_id']}  总耗时 {trace['duration_ms']:.1f}ms")
+    attributes = trace.get("attributes") or {}
+    if attributes:
+        print("   " + ", ".join(f"{key}={value}" for key, value in attributes.items()))
+    print("-" * 90)
+    print(f"{'span':<52}{'开始(ms)':>10}{'耗时(ms)':>12}{'自身(ms)':>12}")
+
+    def walk(span: Dict, depth: int):
+        name = ("  " * depth + span["name"])[:50]
+        mark = " ❌" if span.get("status") == "error" else ""
+        print(
+            f"{name:<52}{span['offset_ms']:>10.1f}{span['duration_ms']:>12.1f}"
+            f"{own[span['span_id']]:>12.1f}{mark}"
+        )
+        for child in sorted(by_parent[span["span_id"]], key=lambda s: s["offset_ms"]):
+            walk(child, depth + 1)
+
+    walk(root, 0)
+
+    print("-" * 90)
+    totals = breakdown(trace)
+    total = sum(totals.values()) or 1.0
+    print("耗时分布: " + ", ".join(
+        f"{category} {ms:.1f}ms ({ms / total:.0%})"
+        for category, ms in sorted(totals.items(), key=lambda item: -item[1])
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="链路追踪报告")
+    parser.add_argument("--file", default=None, help="追踪文件（默认为配置中的追踪文件）")
+    parser.add_argument("--trace-id", default=None, help="只显示指定trace")
+    parser.add_argument("--name", default=None, help="只显示根span名称包含该字符串的trace")
+    parser.add_argument("-n", "--limit", type=int, default=5, help="显示最慢的N个trace")
+    args = parser.parse_args()
+
+    path = args.file
+    if path is None:
+        from utils.tracing import tracer
+        path = str(tracer.file_path)
+    if not os.path.exists(path):
+        print(f"❌ 追踪文件不存在: {path}")
+        sys.exit(1)
+
+    traces = load_traces(path)
+    if args.trace_id:
+        traces = [trace for trace in traces if trace["trace_id"] == args.trace_id]
+    if args.name:
+        traces = [trace for trace in traces if args.name in trace["name"]]
+    traces.sort(key=lambda trace: -trace["duration_ms"])
+
+    if not traces:
+        print("没有匹配的trace")
+        return
+    for trace in traces[:args.limit]:
+        print_trace(trace)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,14 +4,15 @@ API Key管理器 - 管理客户端ID和API Key的映射关系
 """
 
 import json
-from pathlib import Path
 from typing import Optional, Dict
 import hashlib
 from datetime import datetime
 
+from .storage import STORAGE_ROOT
+
 
 # API Key存储文件路径
-API_KEYS_FILE = Path(__file__).parent.parent.parent / "storage" / "api_keys.json"
+API_KEYS_FILE = STORAGE_ROOT / "api_keys.json"
 
 
 class ApiKeyManager:
@@ -0,0 +1,140 @@
+"""
+SEARCH/REPLACE补丁 - 解析模型输出的修改块，并应用到当前代码
+
+补丁格式：
+    <<<<<<< SEARCH
+    （原代码中需要被替换的连续片段）
+    =======
+    （替换后的片段）
+    >>>>>>> REPLACE
+
+定位顺序：精确匹配 → 忽略行首尾空白的逐行匹配 → 相似度模糊匹配。任一修改块无法定位时抛出PatchApplyError，
+由调用方回退到完整代码重新生成。
+"""
+
+import difflib
+import re
+from typing import List, Optional, Tuple
+
+
+SEARCH_MARKER = "<<<<<<< SEARCH"
+DIVIDER_MARKER = "======="
+REPLACE_MARKER = ">>>>>>> REPLACE"
+
+_BLOCK_PATTERN = re.compile(
+    r"^<{5,9} ?SEARCH[^\n]*\n(.*?)^={5,9}[ \t]*\n(.*?)^>{5,9} ?REPLACE[^\n]*$",
+    re.DOTALL | re.MULTILINE,
+)
+
+
+class PatchApplyError(ValueError):
+    """修改块无法在当前代码中定位"""
+
+    def __init__(self, block_index: int, search: str):
+        self.block_index = block_index
+        self.search = search
+        preview = search.strip().split("\n")[0][:60]
+        super().__init__(f"第{block_index + 1}个修改块无法定位: {preview}")
+
+
+def parse_search_replace_blocks(text: str) -> List[Tuple[str, str]]:
+    """
+    从模型输出中解析所有SEARCH/REPLACE修改块
+
+    Returns:
+        [(search, replace), ...]，未找到时返回空列表
+    """
+    blocks = []
+    for match in _BLOCK_PATTERN.finditer(text):
+        search = match.group(1)
+        replace = match.group(2)
+        blocks.append((search.rstrip("\n"), replace.rstrip("\n")))
+    return blocks
+
+
+def apply_search_replace_blocks(
+    code: str,
+    blocks: List[Tuple[str, str]],
+    fuzzy_threshold: float = 0.85,
+) -> str:
+    """
+    依次将修改块应用到代码上
+
+    Args:
+        code: 当前完整代码
+        blocks: parse_search_replace_blocks的结果
+        fuzzy_threshold: 模糊匹配所需的最低相似度（0~1）
+
+    Returns:
+        应用全部修改后的代码
+
+    Raises:
+        PatchApplyError: 某个修改块无法定位
+    """
+    for index, (search, replace) in enumerate(blocks):
+        if not search.strip():
+            # 空SEARCH视为在文档末尾追加
+            code = code.rstrip("\n") + "\n" + replace + "\n"
+            continue
+
+        patched = _apply_exact(code, search, replace)
+        if patched is None:
+            patched = _apply_line_normalized(code, search, replace)
+        if patched is None:
+            patched = _apply_fuzzy(code, search, replace, fuzzy_threshold)
+        if patched is None:
+            raise PatchApplyError(index, search)
+        code = patched
+
+    return code
+
+
+def _apply_exact(code: str, search: str, replace: str) -> Optional[str]:
+    """精确匹配（只替换第一次出现）"""
+    position = code.find(search)
+    if position == -1:
+        return None
+    return code[:position] + replace + code[position + len(search):]
+
+
+def _apply_line_normalized(code: str, search: str, replace: str) -> Optional[str]:
+    """逐行比较去除首尾空白后的内容，容忍模型改动了缩进"""
+    code_lines = code.split("\n")
+    search_lines = [line.strip() for line in search.split("\n")]
+    stripped_code = [line.strip() for line in code_lines]
+    size = len(search_lines)
+
+    for start in range(len(code_lines) - size + 1):
+        if stripped_code[start:start + size] == search_lines:
+            return "\n".join(code_lines[:start] + replace.split("\n") + code_lines[start + size:])
+    return None
+
+
+def _apply_fuzzy(code: str, search: str, replace: str, threshold: float) -> Optional[str]:
+    """在同样行数的窗口中寻找相似度最高的片段"""
+    code_lines = code.split("\n")
+    search_lines = search.split("\n")
+    size = len(search_lines)
+    if size > len(code_lines):
+        return None
+
+    target = "\n".join(line.strip() for line in search_lines)
+    matcher = difflib.SequenceMatcher(autojunk=False)
+    matcher.set_seq2(target)
+
+    best_ratio = 0.0
+    best_start = -1
+    for start in range(len(code_lines) - size + 1):
+        window = "\n".join(line.strip() for line in code_lines[start:start + size])
+        matcher.set_seq1(window)
+        # 先用廉价的上界筛掉明显不相似的窗口
+        if matcher.real_quick_ratio() < threshold or matcher.quick_ratio() < threshold:
+            continue
+        ratio = matcher.ratio()
+        if ratio > best_ratio:
+            best_ratio = ratio
+            best_start = start
+
+    if best_start == -1 or best_ratio < threshold:
+        return None
+    return "\n".join(code_lines[:best_start] + replace.split("\n") + code_lines[best_start + size:])
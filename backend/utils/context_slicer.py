@@ -0,0 +1,275 @@
+"""
+编辑上下文切片 - 只把与修改指令相关的代码片段发给模型
+
+将表盘代码按行切分为若干区域（CSS规则、body / BlueOS .ux的<template>中的顶层DOM元素、脚本中的顶层语句/函数），
+根据用户指令和表盘领域关键词（秒针、背景、日期…）给区域打分，再沿id/class引用关系扩展一跳，
+最终只发送相关区域的原文和整体结构大纲。
+
+区域原文逐字保留，模型输出的SEARCH/REPLACE修改块可以直接应用回完整文档（见code_patch.py）。
+"""
+
+import re
+from typing import Dict, List, Optional, Set
+
+
+# 中文指令关键词 → 代码中常见的英文标识
+KEYWORD_HINTS = {
+    "秒针": ["second", "sec"],
+    "分针": ["minute", "min"],
+    "时针": ["hour"],
+    "指针": ["hand", "pointer", "hour", "minute", "second"],
+    "表盘": ["watch-face", "watchface", "dial", "face"],
+    "背景": ["background", "body", "bg"],
+    "日期": ["date", "day", "month", "getdate"],
+    "星期": ["week", "weekday", "getday"],
+    "时间": ["time", "clock", "hour", "minute"],
+    "数字": ["digit", "number", "num"],
+    "刻度": ["tick", "mark", "scale"],
+    "电量": ["battery"],
+    "步数": ["step"],
+    "心率": ["heart"],
+    "天气": ["weather"],
+    "动画": ["animation", "keyframes", "transition"],
+    "字体": ["font"],
+    "颜色": ["color"],
+    "边框": ["border"],
+    "阴影": ["shadow"],
+    "圆角": ["radius"],
+    "大小": ["width", "height", "size"],
+    "位置": ["top", "left", "position"],
+    "图片": ["img", "image", "src"],
+}
+
+# 没有子元素的HTML标签
+_VOID_TAGS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr",
+}
+
+# 各类块的结束标记（template为BlueOS .ux的界面部分，与body一样切分为顶层DOM元素）
+_SECTION_CLOSING = {"style": "</style>", "script": "</script>", "body": "</body>", "template": "</template>"}
+
+_OPEN_TAG = re.compile(r"<([a-zA-Z][\w-]*)[^>]*?(/?)>")
+_CLOSE_TAG = re.compile(r"</([a-zA-Z][\w-]*)\s*>")
+_ASCII_WORD = re.compile(r"[a-zA-Z][\w-]+")
+
+# 区域之间的引用：CSS选择器、DOM的id/class属性、脚本中的DOM查询
+_CSS_IDENTIFIER = re.compile(r"[.#]([a-zA-Z][\w-]*)")
+_DOM_IDENTIFIER = re.compile(r"\b(?:id|class)\s*=\s*[\"']([^\"']+)[\"']")
+_JS_IDENTIFIER = re.compile(
+    r"(?:getElementById|getElementsByClassName|querySelector(?:All)?)\(\s*[\"'][.#]?([a-zA-Z][\w-]*)"
+)
+
+
+class Region:
+    """代码中的一个连续片段（按行，含首尾行）"""
+
+    def __init__(self, kind: str, start: int, end: int, lines: List[str]):
+        self.kind = kind          # css / dom / script
+        self.start = start
+        self.end = end
+        self.text = "\n".join(lines[start:end + 1])
+        self.name = lines[start].strip()[:60]
+        self.score = 0.0
+
+    def identifiers(self) -> Set[str]:
+        """本区域定义或引用的id/class"""
+        if self.kind == "css":
+            # 只看选择器部分
+            return set(_CSS_IDENTIFIER.findall(self.text.split("{", 1)[0]))
+        if self.kind == "dom":
+            names = set()
+            for value in _DOM_IDENTIFIER.findall(self.text):
+                names.update(value.split())
+            return names
+        return set(_JS_IDENTIFIER.findall(self.text))
+
+
+def split_regions(html: str) -> List[Region]:
+    """将HTML / .ux切分为CSS规则、顶层DOM元素和脚本顶层语句"""
+    lines = html.split("\n")
+    regions: List[Region] = []
+    section = None  # 当前所在的块：style / script / body / template
+    index = 0
+
+    while index < len(lines):
+        lower = lines[index].lower()
+
+        if section is None:
+            if "<style" in lower and "</style>" not in lower:
+                section = "style"
+            elif "<script" in lower and "src=" not in lower and "</script>" not in lower:
+                section = "script"
+            elif "<body" in lower and "</body>" not in lower:
+                section = "body"
+            elif "<template" in lower and "</template>" not in lower:
+                section = "template"
+            index += 1
+            continue
+
+        closing = _SECTION_CLOSING[section]
+        if closing in lower:
+            section = None
+            index += 1
+            continue
+
+        if not lines[index].strip():
+            index += 1
+            continue
+
+        if section in ("body", "template"):
+            if section == "body" and "<script" in lower and "src=" not in lower and "</script>" not in lower:
+                # body中内联的脚本
+                section = "script"
+                index += 1
+                continue
+            end = _element_end(lines, index, closing)
+            regions.append(Region("dom", index, end, lines))
+        else:
+            end = _brace_block_end(lines, index, closing)
+            regions.append(Region("css" if section == "style" else "script", index, end, lines))
+        index = end + 1
+
+    return regions
+
+
+def _brace_block_end(lines: List[str], start: int, closing: str) -> int:
+    """从start开始，找到花括号重新配平的那一行（CSS规则 / JS顶层语句）"""
+    depth = 0
+    for index in range(start, len(lines)):
+        if index > start and closing in lines[index].lower() and depth <= 0:
+            return index - 1
+        depth += lines[index].count("{") - lines[index].count("}")
+        if depth <= 0:
+            return index
+    return len(lines) - 1
+
+
+def _element_end(lines: List[str], start: int, closing: str = "</body>") -> int:
+    """从start开始，找到标签重新配平的那一行（顶层DOM元素）"""
+    depth = 0
+    for index in range(start, len(lines)):
+        line = lines[index]
+        if index > start and closing in line.lower() and depth <= 0:
+            return index - 1
+        for match in _OPEN_TAG.finditer(line):
+            if match.group(1).lower() not in _VOID_TAGS and not match.group(2):
+                depth += 1
+        depth -= len(_CLOSE_TAG.findall(line))
+        if depth <= 0:
+            return index
+    return len(lines) - 1
+
+
+def _instruction_terms(instruction: str) -> Set[str]:
+    """从指令中提取用于匹配代码的关键词"""
+    terms = {word.lower() for word in _ASCII_WORD.findall(instruction)}
+    for keyword, hints in KEYWORD_HINTS.items():
+        if keyword in instruction:
+            terms.update(hints)
+    return terms
+
+
+def build_sliced_context(
+    current_code: str,
+    instruction: str,
+    max_ratio: float = 0.6,
+    fence_lang: str = "html",
+) -> Optional[Dict]:
+    """
+    选出与指令相关的代码区域
+
+    Args:
+        current_code: 当前完整代码（HTML / .ux）
+        instruction: 用户修改指令
+        max_ratio: 相关区域超过全文该比例时不再切片（节省有限，且容易丢失上下文）
+        fence_lang: 片段代码块的语言标识（与输出目标一致）
+
+    Returns:
+        {"context": 发送给模型的大纲+相关片段, "regions": 区域总数, "selected": 选中区域数,
+         "chars": 片段字符数}；无法可靠切片时返回None，由调用方发送完整代码
+    """
+    regions = split_regions(current_code)
+    terms = _instruction_terms(instruction)
+    if not regions or not terms:
+        return None
+
+    for region in regions:
+        text = region.text.lower()
+        region.score = sum(min(text.count(term), 3) for term in terms)
+
+    selected = [region for region in regions if region.score > 0]
+    if not selected:
+        return None
+
+    # 沿id/class引用扩展一跳：选中了DOM元素，就带上它的样式规则和操作它的脚本，反之亦然
+    linked = set()
+    for region in selected:
+        linked.update(region.identifiers())
+    if linked:
+        pattern = re.compile(r"(?<![\w-])(" + "|".join(re.escape(name) for name in linked) + r")(?![\w-])")
+        for region in regions:
+            if region.score == 0 and pattern.search(region.text):
+                region.score = 0.5
+                selected.append(region)
+
+    selected.sort(key=lambda region: region.start)
+    chars = sum(len(region.text) for region in selected)
+    if chars > len(current_code) * max_ratio:
+        return None
+
+    return {
+        "context": _format_context(regions, selected, fence_lang),
+        "regions": len(regions),
+        "selected": len(selected),
+        "chars": chars,
+    }
+
+
+def _format_context(regions: List[Region], selected: List[Region], fence_lang: str = "html") -> str:
+    """结构大纲 + 相关片段原文"""
+    kind_labels = {"css": "样式", "dom": "元素", "script": "脚本"}
+    selected_ids = {id(region) for region in selected}
+
+    # 连续的未选中同类区域折叠为一行，避免大纲本身过长
+    outline = []
+    run: List[Region] = []
+
+    def flush():
+        if len(run) >= 3:
+            outline.append(
+                f"  L{run[0].start + 1}-{run[-1].end + 1} [{kind_labels[run[0].kind]}] "
+                f"{len(run)} 项：{run[0].name[:30]} … {run[-1].name[:30]}"
+            )
+        else:
+            outline.extend(
+                f"  L{region.start + 1}-{region.end + 1} [{kind_labels[region.kind]}] {region.name}"
+                for region in run
+            )
+        run.clear()
+
+    for region in regions:
+        if id(region) in selected_ids:
+            flush()
+            outline.append(f"★ L{region.start + 1}-{region.end + 1} [{kind_labels[region.kind]}] {region.name}")
+        else:
+            if run and run[-1].kind != region.kind:
+                flush()
+            run.append(region)
+    flush()
+
+    snippets = [
+        f"<!-- L{region.start + 1}-{region.end + 1} -->\n{region.text}"
+        for region in selected
+    ]
+
+    return f"""⚠️ 代码较长，下面只给出与修改要求相关的片段（原文逐字摘录），以及整份代码的结构大纲。
+SEARCH 部分必须从这些片段中逐字复制（不要包含 <!-- L行号 --> 标注），不要改动片段以外的代码。
+
+结构大纲（★ 为下方给出的片段）：
+{chr(10).join(outline)}
+
+相关代码片段：
+```{fence_lang}
+{chr(10).join(snippets)}
+```"""
@@ -0,0 +1,298 @@
+"""
+对话摘要 - 为每个项目在后台维护一份紧凑的设计决策摘要，编辑提示词大小有界且保留长程上下文
+
+编辑提示词只附带最近几条对话（每条截断），更早的设计决策（配色、布局、被用户否定的方案）会丢失；
+metadata.json中的完整对话历史（含raw_content、reasoning、code_snapshot）只增不减，也不适合直接放进提示词。
+每次生成/编辑保存后，在后台把上次摘要之后新增的对话记录与已有摘要一起交给模型合并，
+写入 storage/projects/<id>/summary.json（与metadata.json分开存放，删除项目时一并删除）：
+    summary      设计决策摘要（不超过 summary_max_chars 字符）
+    turns        已合并进摘要的对话记录条数（下次只处理之后新增的记录）
+    mode         llm：模型合并；fallback：模型调用失败时把新指令追加为要点（超长时丢弃最早的要点）
+    updated_at   更新时间
+
+摘要调用经调度器排队（使用独立的调度客户端，不占用户自己的并发名额），token用量记入发起编辑的客户端。
+同一项目同时只有一个摘要任务，任务进行中又有新的对话时，完成后立即再合并一次。
+"""
+
+import asyncio
+import json
+import re
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+from config import settings
+from logging_config import get_logger
+from .code_patch import parse_search_replace_blocks
+from .scheduler import llm_scheduler, SchedulerRejected
+from .storage import PROJECTS_DIR
+from .usage_tracker import usage_tracker
+
+logger = get_logger()
+
+
+SUMMARY_FILENAME = "summary.json"
+
+# 摘要调用在调度器中使用的客户端ID（可在scheduler_client_weights中调低权重）
+SCHEDULER_CLIENT_ID = "conversation-summary"
+
+# 模型调用失败时，每条用户指令追加为要点的最大长度
+_FALLBACK_LINE_CHARS = 100
+
+_THINK_PATTERN = re.compile(r"<think>.*?</think>", re.DOTALL)
+_CODE_FENCE_PATTERN = re.compile(r"```[\w-]*\n.*?(?:```|$)", re.DOTALL)
+
+
+def _fit_head(lines: List[str], max_chars: int) -> str:
+    """保留开头的若干行，总长度不超过max_chars（模型输出超长时）"""
+    kept, total = [], 0
+    for line in lines:
+        if total + len(line) + 1 > max_chars:
+            break
+        kept.append(line)
+        total += len(line) + 1
+    if not kept and lines:
+        return lines[0][:max_chars]
+    return "\n".join(kept)
+
+
+def _fit_tail(lines: List[str], max_chars: int) -> str:
+    """丢弃最早的若干行，总长度不超过max_chars（追加要点时）"""
+    kept, total = [], 0
+    for line in reversed(lines):
+        if total + len(line) + 1 > max_chars:
+            break
+        kept.insert(0, line)
+        total += len(line) + 1
+    if not kept and lines:
+        return lines[-1][:max_chars]
+    return "\n".join(kept)
+
+
+class ConversationSummarizer:
+    """按项目增量维护设计决策摘要（后台任务 + summary.json）"""
+
+    def __init__(self, projects_dir: Path = PROJECTS_DIR):
+        self.projects_dir = projects_dir
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._rerun: Set[str] = set()
+
+        # 统计信息
+        self._scheduled = 0
+        self._updates = 0
+        self._fallbacks = 0
+        self._rejected = 0
+        self._failures = 0
+
+    async def load(self, project_id: str) -> Optional[Dict]:
+        """读取项目的摘要（未开启、尚无摘要或读取失败时返回None）"""
+        if not settings.summary_enabled:
+            return None
+        try:
+            return await asyncio.to_thread(self._read, project_id)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ 读取对话摘要失败: {project_id} - {e}")
+            return None
+
+    def schedule(self, project_id: str, agent, client_id: Optional[str], api_key_hash: str):
+        """
+        在后台把项目新增的对话合并进摘要（不阻塞调用方；该项目已有任务进行中时，完成后再合并一次）
+
+        Args:
+            project_id: 项目ID
+            agent: 用于调用模型的WatchFaceCodeAgent（使用客户端自己的API Key）
+            client_id: 客户端ID（用于记录token用量）
+            api_key_hash: 客户端实际使用的API Key标识（用于调度器按Key限制并发）
+        """
+        if not settings.summary_enabled:
+            return
+        task = self._tasks.get(project_id)
+        if task is not None and not task.done():
+            self._rerun.add(project_id)
+            return
+        self._scheduled += 1
+        self._tasks[project_id] = asyncio.get_running_loop().create_task(
+            self._run(project_id, agent, client_id or "default", api_key_hash)
+        )
+
+    async def _run(self, project_id: str, agent, client_id: str, api_key_hash: str):
+        try:
+            while True:
+                self._rerun.discard(project_id)
+                await self.update(project_id, agent, client_id, api_key_hash)
+                if project_id not in self._rerun:
+                    break
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._failures += 1
+            logger.error(f"❌ 对话摘要更新失败: {project_id} - {type(e).__name__}: {e}", exc_info=True)
+        finally:
+            self._rerun.discard(project_id)
+            if self._tasks.get(project_id) is asyncio.current_task():
+                del self._tasks[project_id]
+
+    async def update(self, project_id: str, agent, client_id: str, api_key_hash: str) -> Optional[Dict]:
+        """
+        把上次摘要之后新增的对话记录合并进摘要并写盘
+
+        Returns:
+            新的摘要记录（项目已删除、没有新增对话或排队已满时返回None）
+        """
+        history = await asyncio.to_thread(self._read_history, project_id)
+        if history is None:
+            return None
+
+        current = await self.load(project_id) or {}
+        covered = current.get("turns", 0)
+        previous = current.get("summary", "")
+        if covered > len(history):
+            # 对话历史被重写（如重新生成）：从头合并
+            covered, previous = 0, ""
+        new_items = history[covered:]
+        if not new_items or len(history) <= settings.summary_recent_messages:
+            # 对话还没有超出编辑提示词中原样附带的条数，暂不需要摘要
+            return None
+
+        turns = [self._condense(item) for item in new_items]
+        mode = "llm"
+        try:
+            async with llm_scheduler.slot(SCHEDULER_CLIENT_ID, api_key_hash) as ticket:
+                result = await agent.summarize_conversation(previous, turns)
+            summary = self._clean(result["summary"])
+            if result.get("usage"):
+                usage_tracker.record(
+                    kind="summary",
+                    client_id=client_id,
+                    api_key_hash=api_key_hash,
+                    project_id=project_id,
+                    model=result["model"],
+                    usage=result["usage"],
+                    queue_wait=ticket.wait_time,
+                    success=bool(summary)
+                )
+        except SchedulerRejected as e:
+            # 排队已满：这次不合并，进度不变，下次保存时一并处理
+            self._rejected += 1
+            logger.info(f"⏳ 对话摘要排队已满，稍后合并: {project_id} ({e.reason})")
+            return None
+        except Exception as e:
+            logger.warning(f"⚠️ 对话摘要模型调用失败，改为追加指令要点: {type(e).__name__}: {e}")
+            summary = ""
+
+        if not summary:
+            mode = "fallback"
+            summary = self._fallback(previous, new_items)
+            self._fallbacks += 1
+
+        record = {
+            "project_id": project_id,
+            "summary": summary,
+            "turns": len(history),
+            "mode": mode,
+            "updated_at": datetime.now().isoformat(),
+        }
+        if not await asyncio.to_thread(self._write, project_id, record):
+            return None
+        self._updates += 1
+        logger.info(
+            f"📝 对话摘要已更新: {project_id}，合并 {len(new_items)} 条新对话，"
+            f"摘要 {len(summary)} 字符（{mode}）",
+            extra={"fields": {"project_id": project_id, "turns": len(history), "mode": mode}}
+        )
+        return record
+
+    @staticmethod
+    def _condense(item: Dict) -> Dict:
+        """把一条对话记录压缩为摘要输入：用户指令原文；助手回复的说明和修改后的片段（不含完整代码）"""
+        limit = settings.summary_turn_chars
+        if item.get("role") == "user":
+            return {"role": "user", "content": (item.get("content") or "")[:limit]}
+
+        parts = [item.get("full_message") or item.get("content") or ""]
+        raw_content = item.get("raw_content") or ""
+        blocks = parse_search_replace_blocks(raw_content)
+        if blocks:
+            # 补丁模式：REPLACE部分带有具体的色值、尺寸、文案
+            changes = "\n".join(replace.strip() for _, replace in blocks if replace.strip())
+            if changes:
+                parts.append(f"修改后的片段：\n{changes}")
+        elif "```" in raw_content:
+            # 完整代码模式：只保留代码块之外的说明文字
+            notes = _CODE_FENCE_PATTERN.sub("", raw_content).strip()
+            if notes:
+                parts.append(notes)
+        return {"role": "assistant", "content": "\n".join(part for part in parts if part)[:limit]}
+
+    @staticmethod
+    def _clean(text: str) -> str:
+        """去掉模型输出中的思考过程和代码块标记，并限制长度"""
+        text = _THINK_PATTERN.sub("", text or "").replace("```", "").strip()
+        lines = [line.rstrip() for line in text.splitlines() if line.strip()]
+        return _fit_head(lines, settings.summary_max_chars)
+
+    @staticmethod
+    def _fallback(previous: str, new_items: List[Dict]) -> str:
+        """模型调用失败时的摘要：已有摘要 + 新的用户指令要点（超长时丢弃最早的要点）"""
+        lines = [line for line in (previous or "").splitlines() if line.strip()]
+        for item in new_items:
+            instruction = " ".join((item.get("content") or "").split()) if item.get("role") == "user" else ""
+            if instruction:
+                lines.append(f"- 用户要求：{instruction[:_FALLBACK_LINE_CHARS]}")
+        return _fit_tail(lines, settings.summary_max_chars)
+
+    def _read(self, project_id: str) -> Optional[Dict]:
+        path = self.projects_dir / project_id / SUMMARY_FILENAME
+        if not path.exists():
+            return None
+        with path.open("r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _read_history(self, project_id: str) -> Optional[List[Dict]]:
+        path = self.projects_dir / project_id / "metadata.json"
+        if not path.exists():
+            return None
+        with path.open("r", encoding="utf-8") as f:
+            return json.load(f).get("conversation_history") or []
+
+    def _write(self, project_id: str, record: Dict) -> bool:
+        """原子写入summary.json（项目已被删除时跳过）"""
+        project_dir = self.projects_dir / project_id
+        if not project_dir.exists():
+            return False
+        path = project_dir / SUMMARY_FILENAME
+        tmp_path = path.with_name(f"{SUMMARY_FILENAME}.{threading.get_ident()}.tmp")
+        try:
+            with tmp_path.open("w", encoding="utf-8") as f:
+                json.dump(record, f, ensure_ascii=False, indent=2)
+            tmp_path.replace(path)
+        except FileNotFoundError:
+            # 写入过程中项目被删除
+            return False
+        return True
+
+    async def stop(self):
+        """取消进行中的摘要任务（已写盘的进度保留，下次保存时继续合并）"""
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_stats(self) -> Dict:
+        """获取摘要任务统计"""
+        return {
+            "enabled": settings.summary_enabled,
+            "running": sum(1 for task in self._tasks.values() if not task.done()),
+            "scheduled": self._scheduled,
+            "updates": self._updates,
+            "fallbacks": self._fallbacks,
+            "rejected": self._rejected,
+            "failures": self._failures,
+            "max_chars": settings.summary_max_chars,
+            "recent_messages": settings.summary_recent_messages,
+        }
+
+
+# 创建全局实例
+conversation_summarizer = ConversationSummarizer()
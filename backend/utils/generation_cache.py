@@ -0,0 +1,207 @@
+"""
+生成缓存 - 以内容hash为键的磁盘缓存，相同的提示词直接复用历史LLM补全结果
+
+缓存键由模型、temperature、系统提示词、用户消息和素材清单共同计算；
+按条目数、总字节数（LRU）和存活时间淘汰。磁盘读写放到线程池中执行，不阻塞事件循环。
+
+内存中维护条目索引（字节数、创建时间，按最近访问排序），淘汰和统计只查索引，不扫描缓存目录；
+索引在启动时扫描一次目录建立（条目文件的mtime即创建时间）。存活时间统一按创建时间计算。
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config import settings
+from .storage import STORAGE_ROOT
+
+
+# 缓存目录
+CACHE_DIR = STORAGE_ROOT / "cache" / "generations"
+
+
+class GenerationCache:
+    """LLM补全结果的磁盘缓存"""
+
+    def __init__(
+        self,
+        cache_dir: Path = CACHE_DIR,
+        max_entries: int = settings.generation_cache_max_entries,
+        max_bytes: int = settings.generation_cache_max_bytes,
+        ttl: float = settings.generation_cache_ttl,
+    ):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # key → (字节数, 创建时间)，最近访问的在后
+        self._index: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self._bytes = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+        # 统计信息
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+        self._evictions = 0
+
+    @staticmethod
+    def make_key(
+        model: str,
+        temperature: float,
+        system_prompt: str,
+        user_message: str,
+        asset_manifest: List[str],
+    ) -> str:
+        """
+        计算缓存键
+
+        Args:
+            model: 模型名称
+            temperature: 采样温度
+            system_prompt: 系统提示词
+            user_message: 用户消息（编辑场景已包含当前代码）
+            asset_manifest: 素材清单（文件名+大小等）
+
+        Returns:
+            sha256十六进制字符串
+        """
+        payload = json.dumps(
+            {
+                "model": model,
+                "temperature": temperature,
+                "system_prompt": system_prompt,
+                "user_message": user_message,
+                "asset_manifest": sorted(asset_manifest),
+            },
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    async def load(self):
+        """扫描缓存目录建立索引（启动时调用；未调用时在首次读写时建立）"""
+        await asyncio.to_thread(self._load_index)
+
+    def _load_index(self):
+        with self._lock:
+            if self._loaded:
+                return
+            entries = []
+            for path in self.cache_dir.glob("*.json"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, path.stem, stat.st_size))
+            entries.sort()  # 没有访问记录，按创建时间作为初始的访问顺序
+            for created_at, key, size in entries:
+                self._index[key] = (size, created_at)
+                self._bytes += size
+            self._loaded = True
+
+    def _remove(self, key: str):
+        """从索引和磁盘删除条目（调用方持有锁）"""
+        size, _ = self._index.pop(key, (0, 0.0))
+        self._bytes -= size
+        self._path(key).unlink(missing_ok=True)
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return now - created_at > self.ttl
+
+    async def get(self, key: str) -> Optional[Dict]:
+        """读取缓存条目，未命中或已过期返回None"""
+        value = await asyncio.to_thread(self._read, key)
+        if value is None:
+            self._misses += 1
+        else:
+            self._hits += 1
+        return value
+
+    def _read(self, key: str) -> Optional[Dict]:
+        self._load_index()
+        with self._lock:
+            indexed = self._index.get(key)
+            if indexed is None:
+                return None
+            if self._expired(indexed[1], time.time()):
+                self._remove(key)
+                self._evictions += 1
+                return None
+            self._index.move_to_end(key)
+
+        try:
+            with self._path(key).open("r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self._remove(key)
+            return None
+        return entry.get("value")
+
+    async def put(self, key: str, value: Dict):
+        """写入缓存条目，并按容量淘汰旧条目"""
+        await asyncio.to_thread(self._write, key, value)
+        self._writes += 1
+
+    def _write(self, key: str, value: Dict):
+        self._load_index()
+        path = self._path(key)
+        tmp_path = path.with_name(f"{key}.{threading.get_ident()}.tmp")
+        created_at = time.time()
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump({"created_at": created_at, "value": value}, f, ensure_ascii=False)
+        size = tmp_path.stat().st_size
+        # mtime记为创建时间，重启后重建索引时使用
+        os.utime(tmp_path, (created_at, created_at))
+        tmp_path.replace(path)
+
+        with self._lock:
+            previous_size, _ = self._index.pop(key, (0, 0.0))
+            self._index[key] = (size, created_at)
+            self._bytes += size - previous_size
+            self._evict()
+
+    def _evict(self):
+        """从最久未访问的条目开始，淘汰过期条目和超出条目数/字节数上限的条目（调用方持有锁）"""
+        now = time.time()
+        while self._index:
+            key, (_, created_at) = next(iter(self._index.items()))
+            over_limit = len(self._index) > self.max_entries or self._bytes > self.max_bytes
+            if not over_limit and not self._expired(created_at, now):
+                break
+            self._remove(key)
+            self._evictions += 1
+
+    def get_stats(self) -> Dict:
+        """获取缓存统计信息"""
+        lookups = self._hits + self._misses
+        return {
+            "enabled": settings.generation_cache_enabled,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_ratio": round(self._hits / lookups, 4) if lookups else None,
+            "writes": self._writes,
+            "evictions": self._evictions,
+            "entries": len(self._index),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+        }
+
+
+# 创建全局实例
+generation_cache = GenerationCache()
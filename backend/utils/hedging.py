@@ -0,0 +1,185 @@
+"""
+对冲请求 - 首个LLM调用迟迟未返回时再发一个相同的请求，先通过校验的结果胜出
+
+对冲延迟取最近补全耗时的某个分位数（如p90）：只有落在长尾里的请求才会触发第二次调用。
+对冲预算限制触发对冲的请求占比，避免在服务整体变慢时把上游流量翻倍。
+落败的调用会被取消（底层HTTP请求随之中断）。
+
+耗时样本只取首个调用自身的耗时（无论结果是否通过校验）。首个调用落败被取消时只知道它不短于取消时刻，
+记为截尾样本，分位数按Kaplan-Meier估计计算，慢调用不会因为被对冲取消而把对冲延迟越拉越低。
+对冲调用以同一客户端/API Key另行经调度器排队，占用自己的执行权，不绕过并发上限。
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from config import settings
+from logging_config import get_logger
+from .scheduler import llm_scheduler, current_ticket
+
+logger = get_logger()
+
+
+class Hedger:
+    """带对冲的LLM调用执行器"""
+
+    def __init__(self, window: int = 200):
+        self._latencies: deque = deque(maxlen=window)   # (首个调用耗时, 是否为截尾样本)
+
+        # 统计信息
+        self._requests = 0
+        self._hedges = 0
+        self._hedge_wins = 0
+        self._primary_wins = 0
+        self._budget_denied = 0
+        self._invalid_results = 0
+
+    def hedge_delay(self) -> float:
+        """当前的对冲延迟：样本不足时使用初始值，否则取配置分位数的历史耗时"""
+        if len(self._latencies) < settings.hedge_min_samples:
+            return settings.hedge_initial_delay
+        return max(settings.hedge_min_delay, self._quantile(settings.hedge_delay_percentile))
+
+    def _quantile(self, ratio: float) -> Optional[float]:
+        """
+        含截尾样本的耗时分位数（Kaplan-Meier估计）
+
+        截尾样本不计为一次完成，只从之后的风险集中移除；分位数落在所有完成样本之后时返回最大的样本耗时（下界）。
+        """
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)  # 同一耗时的完成样本排在截尾样本之前
+        at_risk = len(ordered)
+        survival = 1.0
+        for latency, censored in ordered:
+            if not censored:
+                survival *= 1 - 1 / at_risk
+                if 1 - survival >= ratio:
+                    return latency
+            at_risk -= 1
+        return ordered[-1][0]
+
+    def _record_primary(self, start: float, task: asyncio.Future):
+        """首个调用结束时记录其自身耗时（被取消时为截尾样本，调用失败时不记录）"""
+        elapsed = time.perf_counter() - start
+        if task.cancelled():
+            self._latencies.append((elapsed, True))
+        elif task.exception() is None:
+            self._latencies.append((elapsed, False))
+
+    async def _hedge_call(self, call: Callable[[], Awaitable[Any]]) -> Any:
+        """对冲调用：以当前请求的客户端/API Key另行获取执行权（不在调度器中时直接调用）"""
+        ticket = current_ticket()
+        if ticket is None:
+            return await call()
+        async with llm_scheduler.slot(ticket.client_id, ticket.key_hash):
+            return await call()
+
+    def _budget_allows(self) -> bool:
+        """对冲次数不超过请求数的hedge_budget_ratio"""
+        return self._hedges < self._requests * settings.hedge_budget_ratio
+
+    async def run(
+        self,
+        call: Callable[[], Awaitable[Any]],
+        is_valid: Callable[[Any], bool],
+    ) -> Any:
+        """
+        执行call，必要时发起对冲调用
+
+        Args:
+            call: 无参数的协程工厂（每次调用发起一次独立的LLM请求）
+            is_valid: 校验结果是否可用（如能提取出HTML代码）
+
+        Returns:
+            最先通过校验的结果；都未通过校验时返回最后完成的结果
+
+        Raises:
+            所有调用都失败时抛出最后一个异常
+        """
+        self._requests += 1
+        start = time.perf_counter()
+        delay = self.hedge_delay()
+
+        primary = asyncio.ensure_future(call())
+        primary.add_done_callback(lambda task: self._record_primary(start, task))
+        pending = {primary}
+        hedge: Optional[asyncio.Task] = None
+        hedge_decided = False
+        last_result = None
+        last_error: Optional[BaseException] = None
+        has_result = False
+
+        try:
+            while pending:
+                timeout = None
+                if not hedge_decided:
+                    timeout = max(0.0, delay - (time.perf_counter() - start))
+
+                done, pending = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                for task in done:
+                    label = "对冲" if task is hedge else "首个"
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        logger.warning(f"⚠️ {label}调用失败: {last_error}")
+                        continue
+
+                    result = task.result()
+                    if is_valid(result):
+                        if task is hedge:
+                            self._hedge_wins += 1
+                        else:
+                            self._primary_wins += 1
+                        return result
+
+                    self._invalid_results += 1
+                    last_result, has_result = result, True
+                    logger.warning(f"⚠️ {label}调用结果未通过校验")
+
+                # 首个调用超过对冲延迟仍未完成，或已完成但结果不可用：发起对冲调用
+                # （调用抛出异常时不对冲，重试由传输层负责）
+                if not hedge_decided and (not done or has_result):
+                    hedge_decided = True
+                    if self._budget_allows():
+                        self._hedges += 1
+                        logger.info(f"🪃 首个调用已耗时 {time.perf_counter() - start:.1f}s，发起对冲调用")
+                        hedge = asyncio.ensure_future(self._hedge_call(call))
+                        pending.add(hedge)
+                    else:
+                        self._budget_denied += 1
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+        if has_result:
+            return last_result
+        raise last_error
+
+    def get_stats(self) -> Dict:
+        """获取对冲统计信息"""
+        def percentile(p: float) -> Optional[float]:
+            value = self._quantile(p)
+            return round(value, 3) if value is not None else None
+
+        return {
+            "enabled": settings.hedging_enabled,
+            "requests": self._requests,
+            "hedges": self._hedges,
+            "hedge_wins": self._hedge_wins,
+            "primary_wins": self._primary_wins,
+            "budget_denied": self._budget_denied,
+            "invalid_results": self._invalid_results,
+            "hedge_delay": round(self.hedge_delay(), 3),
+            "censored_samples": sum(1 for _, censored in self._latencies if censored),
+            "latency": {"p50": percentile(0.5), "p95": percentile(0.95), "p99": percentile(0.99)},
+        }
+
+
+# 创建全局实例
+hedger = Hedger()
@@ -0,0 +1,287 @@
+"""
+异步任务 - 生成/编辑以后台任务运行，任务状态持久化到磁盘
+
+提交后立即返回任务ID，客户端可以断开后再通过 GET /api/jobs/{id}（支持长轮询）取回结果，
+不会因为nginx超时或重试而丢失或重复执行。
+
+任务状态：queued → running → done / failed。每个任务一个JSON文件（storage/jobs/<job_id>.json），
+服务重启时未完成的任务（queued/running）重新排队执行。
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from config import settings
+from logging_config import get_logger, bind_request_id, request_id_var
+from .storage import STORAGE_ROOT
+
+logger = get_logger()
+
+
+# 任务目录
+JOBS_DIR = STORAGE_ROOT / "jobs"
+
+TERMINAL_STATUSES = {"done", "failed"}
+
+
+class JobRetryLater(Exception):
+    """任务暂时无法执行（如LLM调度排队已满），稍后重新排队"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        super().__init__(f"retry job after {delay:.0f}s")
+
+
+class JobStore:
+    """任务持久化与后台执行"""
+
+    def __init__(self, jobs_dir=JOBS_DIR):
+        self.jobs_dir = jobs_dir
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+
+        self._jobs: Dict[str, Dict] = {}
+        self._changed: Dict[str, asyncio.Event] = {}
+        self._runners: Dict[str, Callable[[Dict], Awaitable[Dict]]] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+        # 统计信息
+        self._finished: Dict[str, int] = {"done": 0, "failed": 0}
+
+    # ---------- 持久化 ----------
+
+    def _path(self, job_id: str):
+        return self.jobs_dir / f"{job_id}.json"
+
+    def _write(self, job: Dict):
+        path = self._path(job["job_id"])
+        tmp_path = path.with_name(f"{job['job_id']}.{threading.get_ident()}.tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False, indent=2)
+        tmp_path.replace(path)
+
+    def _read(self, job_id: str) -> Optional[Dict]:
+        try:
+            with self._path(job_id).open("r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    async def _save(self, job: Dict):
+        job["updated_at"] = datetime.now().isoformat()
+        self._jobs[job["job_id"]] = job
+        await asyncio.to_thread(self._write, dict(job))
+
+        if job["status"] in TERMINAL_STATUSES:
+            # 已结束的任务只保留在磁盘上
+            self._jobs.pop(job["job_id"], None)
+            self._finished[job["status"]] += 1
+
+        # 唤醒长轮询
+        event = self._changed.pop(job["job_id"], None)
+        if event is not None:
+            event.set()
+
+    # ---------- 对外接口 ----------
+
+    @staticmethod
+    def make_job_id(client_id: Optional[str], idempotency_key: Optional[str]) -> str:
+        """有幂等键时由客户端+幂等键确定任务ID（重复提交返回同一个任务），否则随机生成"""
+        if idempotency_key:
+            digest = hashlib.sha256(f"{client_id or 'default'}|{idempotency_key}".encode("utf-8"))
+            return digest.hexdigest()[:32]
+        return uuid.uuid4().hex
+
+    async def submit(
+        self,
+        kind: str,
+        payload: Dict,
+        client_id: Optional[str] = None,
+        idempotency_key: Optional[str] = None,
+    ) -> Dict:
+        """
+        提交任务
+
+        Args:
+            kind: 任务类型（generate / edit，需已注册runner）
+            payload: 请求体（request.dict()）
+            client_id: 提交任务的客户端ID
+            idempotency_key: 可选的幂等键
+
+        Returns:
+            任务字典（幂等键重复时返回已有任务）
+        """
+        job_id = self.make_job_id(client_id, idempotency_key)
+        existing = await self.get(job_id)
+        if existing is not None:
+            logger.info(f"🔗 幂等键重复，返回已有任务: {job_id}")
+            return existing
+
+        now = datetime.now().isoformat()
+        job = {
+            "job_id": job_id,
+            "kind": kind,
+            "status": "queued",
+            "client_id": client_id,
+            "payload": payload,
+            "result": None,
+            "error": None,
+            "error_status": None,
+            "attempts": 0,
+            "created_at": now,
+            "updated_at": now,
+            "started_at": None,
+            "finished_at": None,
+        }
+        await self._save(job)
+        self._queue.put_nowait(job_id)
+        logger.info(f"📋 任务已提交: {job_id} ({kind})")
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict]:
+        """读取任务（先查内存，再查磁盘）"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            job = await asyncio.to_thread(self._read, job_id)
+        return job
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict]:
+        """
+        长轮询：任务未结束时最多等待timeout秒，期间状态变化立即返回
+
+        Returns:
+            最新的任务字典，任务不存在时返回None
+        """
+        # 先注册事件再读取状态，避免读取期间的状态变化被错过
+        event = self._changed.setdefault(job_id, asyncio.Event())
+        job = await self.get(job_id)
+        if job is None or job["status"] in TERMINAL_STATUSES:
+            # 不会再有状态变化
+            self._changed.pop(job_id, None)
+            return job
+        if timeout <= 0:
+            return job
+
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return await self.get(job_id)
+
+    # ---------- 后台执行 ----------
+
+    def register_runner(self, kind: str, runner: Callable[[Dict], Awaitable[Dict]]):
+        """注册任务执行函数：接收任务字典，返回结果字典（失败时抛出异常）"""
+        self._runners[kind] = runner
+
+    async def start(self, workers: int = settings.job_workers):
+        """启动后台worker，并恢复上次未完成的任务"""
+        self._queue = asyncio.Queue()
+        recovered = await asyncio.to_thread(self._recover)
+        for job_id in recovered:
+            self._queue.put_nowait(job_id)
+        if recovered:
+            logger.info(f"♻️ 恢复 {len(recovered)} 个未完成的任务")
+
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(workers)]
+
+    async def stop(self):
+        """停止后台worker（进行中的任务保持running状态，下次启动时恢复）"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def _recover(self) -> List[str]:
+        """扫描任务目录：清理过期任务，返回需要重新执行的任务ID（按提交时间排序）"""
+        now = time.time()
+        pending = []
+        for path in self.jobs_dir.glob("*.json"):
+            job = self._read(path.stem)
+            if job is None:
+                continue
+            if job["status"] in TERMINAL_STATUSES:
+                if now - path.stat().st_mtime > settings.job_ttl:
+                    path.unlink(missing_ok=True)
+                continue
+            # 上次运行中被中断的任务重新排队
+            job["status"] = "queued"
+            self._jobs[job["job_id"]] = job
+            pending.append((job["created_at"], job["job_id"]))
+        return [job_id for _, job_id in sorted(pending)]
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            # 任务执行期间的日志以任务ID作为请求ID
+            token = bind_request_id(job_id)
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                logger.error(f"❌ 任务执行异常: {job_id} - {e}", exc_info=True)
+            finally:
+                request_id_var.reset(token)
+
+    async def _run(self, job_id: str):
+        job = await self.get(job_id)
+        if job is None or job["status"] in TERMINAL_STATUSES:
+            return
+
+        runner = self._runners.get(job["kind"])
+        if runner is None:
+            job.update(status="failed", error=f"unknown job kind: {job['kind']}", finished_at=datetime.now().isoformat())
+            await self._save(job)
+            return
+
+        if job["attempts"] >= settings.job_max_attempts:
+            job.update(status="failed", error="任务多次中断，已放弃", finished_at=datetime.now().isoformat())
+            await self._save(job)
+            return
+
+        job.update(status="running", attempts=job["attempts"] + 1, started_at=datetime.now().isoformat())
+        await self._save(job)
+        logger.info(f"🏃 任务开始执行: {job_id} ({job['kind']}, 第{job['attempts']}次)")
+
+        try:
+            result = await runner(job)
+        except JobRetryLater as e:
+            # 不计入尝试次数，延迟后重新排队
+            job.update(status="queued", attempts=job["attempts"] - 1)
+            await self._save(job)
+            asyncio.get_running_loop().call_later(e.delay, self._queue.put_nowait, job_id)
+            return
+        except Exception as e:
+            job.update(
+                status="failed",
+                error=getattr(e, "detail", None) or str(e),
+                error_status=getattr(e, "status_code", 500),
+                finished_at=datetime.now().isoformat(),
+            )
+            await self._save(job)
+            logger.error(f"❌ 任务失败: {job_id} - {job['error']}")
+            return
+
+        job.update(status="done", result=result, finished_at=datetime.now().isoformat())
+        await self._save(job)
+        logger.info(f"✅ 任务完成: {job_id}")
+
+    def get_stats(self) -> Dict:
+        """获取任务统计信息"""
+        counts: Dict[str, int] = {"queued": 0, "running": 0, **self._finished}
+        for job in self._jobs.values():
+            counts[job["status"]] += 1
+        return {
+            "workers": len(self._workers),
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "jobs": counts,
+        }
+
+
+# 创建全局实例
+job_store = JobStore()
@@ -0,0 +1,251 @@
+"""
+行级差异计算 - patience锚定 + Myers差分，输出带新旧行号的变更行和统一diff格式的hunk
+
+difflib.Differ在大量重复行（如生成的CSS）上接近平方复杂度，且会把整个比较结果展开成列表。这里：
+1. 先去掉公共前缀/后缀（编辑通常只改动很小一部分）
+2. 以两边都只出现一次的行作为锚点（patience diff），取锚点的最长递增子序列，把问题切成小段
+3. 没有唯一行的小段用Myers O(ND)算法；编辑距离超过上限时整段按删除+新增处理，保证最坏情况耗时
+
+行号从1开始：新增行为新代码中的行号，删除行为旧代码中的行号。
+"""
+
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+from config import settings
+
+
+# 差分操作：(类型, 旧行下标, 新行下标)，类型为 "=" / "-" / "+"，不涉及的一边下标为-1
+Op = Tuple[str, int, int]
+
+
+def _myers(a: List[int], b: List[int], a_lo: int, a_hi: int, b_lo: int, b_hi: int, max_d: int) -> Optional[List[Op]]:
+    """Myers贪心差分，编辑距离超过max_d时返回None"""
+    n, m = a_hi - a_lo, b_hi - b_lo
+    max_d = min(max_d, n + m)
+    offset = max_d + 1
+    v = [0] * (2 * max_d + 3)
+    trace: List[List[int]] = []
+
+    for d in range(max_d + 1):
+        # 记录本轮开始前 k ∈ [-d-1, d+1] 的值，回溯时使用
+        trace.append(v[offset - d - 1:offset + d + 2])
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[offset + k - 1] < v[offset + k + 1]):
+                x = v[offset + k + 1]
+            else:
+                x = v[offset + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[a_lo + x] == b[b_lo + y]:
+                x += 1
+                y += 1
+            v[offset + k] = x
+            if x >= n and y >= m:
+                return _backtrack(trace, n, m, a_lo, b_lo)
+    return None
+
+
+def _backtrack(trace: List[List[int]], x: int, y: int, a_lo: int, b_lo: int) -> List[Op]:
+    ops: List[Op] = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k - 1 + d + 1] < v[k + 1 + d + 1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k + d + 1]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            ops.append(("=", a_lo + x, b_lo + y))
+        if d > 0:
+            if x == prev_x:
+                ops.append(("+", -1, b_lo + prev_y))
+            else:
+                ops.append(("-", a_lo + prev_x, -1))
+        x, y = prev_x, prev_y
+    ops.reverse()
+    return ops
+
+
+def _unique_anchors(a: List[int], b: List[int], a_lo: int, a_hi: int, b_lo: int, b_hi: int) -> List[Tuple[int, int]]:
+    """两边都只出现一次的行，按旧行号排序后取新行号的最长递增子序列"""
+    counts: Dict[int, List[int]] = {}
+    for i in range(a_lo, a_hi):
+        entry = counts.get(a[i])
+        if entry is None:
+            counts[a[i]] = [1, 0, i, -1]
+        else:
+            entry[0] += 1
+    for j in range(b_lo, b_hi):
+        entry = counts.get(b[j])
+        if entry is not None:
+            entry[1] += 1
+            entry[3] = j
+
+    pairs = sorted((e[2], e[3]) for e in counts.values() if e[0] == 1 and e[1] == 1)
+    if not pairs:
+        return []
+
+    # patience sorting求LIS
+    tails: List[int] = []
+    tail_index: List[int] = []
+    previous: List[int] = [-1] * len(pairs)
+    for index, (_, j) in enumerate(pairs):
+        pos = bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tail_index.append(index)
+        else:
+            tails[pos] = j
+            tail_index[pos] = index
+        previous[index] = tail_index[pos - 1] if pos > 0 else -1
+
+    anchors = []
+    index = tail_index[-1]
+    while index != -1:
+        anchors.append(pairs[index])
+        index = previous[index]
+    anchors.reverse()
+    return anchors
+
+
+def diff_ops(a: List[int], b: List[int], max_d: int) -> List[Op]:
+    """计算整数序列a → b的差分操作"""
+    ops: List[Op] = []
+    # 栈中元素：("range", a_lo, a_hi, b_lo, b_hi) 或 ("op", op)，逆序压栈保证输出顺序
+    stack: List[tuple] = [("range", 0, len(a), 0, len(b))]
+
+    while stack:
+        item = stack.pop()
+        if item[0] == "op":
+            ops.append(item[1])
+            continue
+
+        _, a_lo, a_hi, b_lo, b_hi = item
+        # 公共前缀
+        while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+            ops.append(("=", a_lo, b_lo))
+            a_lo += 1
+            b_lo += 1
+        # 公共后缀（稍后输出）
+        suffix = []
+        while a_lo < a_hi and b_lo < b_hi and a[a_hi - 1] == b[b_hi - 1]:
+            a_hi -= 1
+            b_hi -= 1
+            suffix.append(("op", ("=", a_hi, b_hi)))
+        stack.extend(suffix)
+
+        if a_lo == a_hi or b_lo == b_hi:
+            ops.extend(("-", i, -1) for i in range(a_lo, a_hi))
+            ops.extend(("+", -1, j) for j in range(b_lo, b_hi))
+            continue
+
+        anchors = _unique_anchors(a, b, a_lo, a_hi, b_lo, b_hi)
+        if anchors:
+            tasks = []
+            prev_a, prev_b = a_lo, b_lo
+            for i, j in anchors:
+                tasks.append(("range", prev_a, i, prev_b, j))
+                tasks.append(("op", ("=", i, j)))
+                prev_a, prev_b = i + 1, j + 1
+            tasks.append(("range", prev_a, a_hi, prev_b, b_hi))
+            stack.extend(reversed(tasks))
+            continue
+
+        segment = _myers(a, b, a_lo, a_hi, b_lo, b_hi, max_d)
+        if segment is None:
+            # 差异过大：整段替换
+            segment = [("-", i, -1) for i in range(a_lo, a_hi)] + [("+", -1, j) for j in range(b_lo, b_hi)]
+        ops.extend(segment)
+
+    return ops
+
+
+def _build_hunks(ops: List[Op], old_lines: List[str], new_lines: List[str], context: int) -> List[Dict]:
+    """把差分操作分组为统一diff格式的hunk（相邻变更间隔不超过2×context行时合并）"""
+    changed = [index for index, op in enumerate(ops) if op[0] != "="]
+    hunks = []
+    start = 0
+    while start < len(changed):
+        end = start
+        while end + 1 < len(changed) and changed[end + 1] - changed[end] <= 2 * context + 1:
+            end += 1
+        lo = max(0, changed[start] - context)
+        hi = min(len(ops), changed[end] + context + 1)
+
+        lines = []
+        old_start = new_start = None
+        old_count = new_count = 0
+        for kind, i, j in ops[lo:hi]:
+            if kind == "=":
+                lines.append(" " + old_lines[i])
+                old_count += 1
+                new_count += 1
+            elif kind == "-":
+                lines.append("-" + old_lines[i])
+                old_count += 1
+            else:
+                lines.append("+" + new_lines[j])
+                new_count += 1
+            if old_start is None and i >= 0:
+                old_start = i + 1
+            if new_start is None and j >= 0:
+                new_start = j + 1
+
+        hunks.append({
+            "old_start": old_start if old_start is not None else _line_before(ops, lo, 1),
+            "old_lines": old_count,
+            "new_start": new_start if new_start is not None else _line_before(ops, lo, 2),
+            "new_lines": new_count,
+            "lines": lines,
+        })
+        start = end + 1
+    return hunks
+
+
+def _line_before(ops: List[Op], index: int, side: int) -> int:
+    """hunk中某一边没有行时（纯新增/纯删除），取其前一行的行号（统一diff约定）"""
+    for position in range(index - 1, -1, -1):
+        if ops[position][side] >= 0:
+            return ops[position][side] + 1
+    return 0
+
+
+def compute_line_diff(old_code: str, new_code: str, context: Optional[int] = None) -> Dict:
+    """
+    计算两段代码的行级差异
+
+    Returns:
+        {
+            "added_lines": [{"line_number": 新代码行号, "content": str}],
+            "removed_lines": [{"line_number": 旧代码行号, "content": str}],
+            "modified_sections": [{"old_start", "old_lines", "new_start", "new_lines"}],
+            "hunks": [{"old_start", "old_lines", "new_start", "new_lines", "lines": [" 上下文", "-删除", "+新增"]}],
+            "total_changes": int
+        }
+    """
+    context = settings.diff_context_lines if context is None else context
+    old_lines = old_code.split("\n")
+    new_lines = new_code.split("\n")
+
+    # 行内容映射为整数，比较更快
+    ids: Dict[str, int] = {}
+    a = [ids.setdefault(line, len(ids)) for line in old_lines]
+    b = [ids.setdefault(line, len(ids)) for line in new_lines]
+
+    ops = diff_ops(a, b, settings.diff_max_edit_distance)
+
+    added = [{"line_number": j + 1, "content": new_lines[j]} for kind, _, j in ops if kind == "+"]
+    removed = [{"line_number": i + 1, "content": old_lines[i]} for kind, i, _ in ops if kind == "-"]
+    hunks = _build_hunks(ops, old_lines, new_lines, context)
+
+    return {
+        "added_lines": added,
+        "removed_lines": removed,
+        "modified_sections": [{key: hunk[key] for key in ("old_start", "old_lines", "new_start", "new_lines")} for hunk in hunks],
+        "hunks": hunks,
+        "total_changes": len(added) + len(removed),
+    }
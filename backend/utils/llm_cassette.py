@@ -0,0 +1,262 @@
+"""
+LLM调用录制/回放 - 把经过WatchFaceCodeAgent的请求/响应录制为JSONL语料，并可不访问网络地确定性回放
+
+- record：真实调用LLM，同时把请求消息、参数、原始输出、思考过程、结束原因、usage和耗时追加到语料文件
+- replay：按请求（消息+参数）的hash从语料中取出响应；同一请求录制过多次时按顺序轮流返回，未录制的请求直接报错
+
+语料文件每行一条记录。系统提示词很长且几乎不变，只以 {"type": "prompt"} 记录保存一次，
+调用记录（{"type": "call"}）中以hash引用，语料体积主要由模型输出决定。
+
+max_tokens由token预算动态计算，不参与hash，否则预算学习的微小变化就会导致回放失配。
+"""
+
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from types import SimpleNamespace
+from typing import AsyncIterator, Dict, List, Optional
+
+from config import settings
+from logging_config import get_logger
+from .storage import STORAGE_ROOT
+
+logger = get_logger()
+
+
+# 默认语料文件
+DEFAULT_CASSETTE_PATH = STORAGE_ROOT / "cassettes" / "llm.jsonl"
+
+# 回放流式响应时每个分块的字符数
+REPLAY_CHUNK_SIZE = 64
+
+
+class CassetteMissError(Exception):
+    """回放模式下语料中没有该请求"""
+
+    def __init__(self, key: str):
+        self.key = key
+        super().__init__(f"LLM cassette has no recording for request {key[:16]}")
+
+
+def _hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class LLMCassette:
+    """LLM调用的录制与回放"""
+
+    def __init__(self, path: Optional[Path] = None):
+        self._path = path
+        self._lock = threading.Lock()
+
+        # 回放索引：请求hash → 按录制顺序排列的响应
+        self._recordings: Optional[Dict[str, List[Dict]]] = None
+        self._cursor: Dict[str, int] = defaultdict(int)
+        # 已写入语料的系统提示词hash
+        self._prompts: Optional[set] = None
+
+        # 统计信息
+        self._recorded = 0
+        self._replayed = 0
+        self._misses = 0
+
+    @property
+    def path(self) -> Path:
+        if self._path is not None:
+            return self._path
+        return Path(settings.llm_cassette_path) if settings.llm_cassette_path else DEFAULT_CASSETTE_PATH
+
+    @property
+    def recording(self) -> bool:
+        return settings.llm_cassette_mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return settings.llm_cassette_mode == "replay"
+
+    @staticmethod
+    def make_key(params: Dict) -> str:
+        """请求hash：模型、temperature、附加参数和完整消息（不含max_tokens）"""
+        payload = json.dumps(
+            {
+                "model": params["model"],
+                "temperature": params["temperature"],
+                "extra_body": params.get("extra_body") or {},
+                "messages": params["messages"],
+            },
+            ensure_ascii=False,
+            sort_keys=True,
+        )
+        return _hash(payload)
+
+    # ---------- 录制 ----------
+
+    async def record(self, params: Dict, completion: Dict, latency: float, ttft: Optional[float] = None):
+        """
+        追加一条调用记录
+
+        Args:
+            params: chat.completions.create的调用参数
+            completion: 结果字典（raw_content、reasoning、finish_reason、usage、model、id）
+            latency: 调用总耗时（秒）
+            ttft: 流式调用的首个正文分块耗时（秒）
+        """
+        usage = completion.get("usage")
+        if usage is not None and not isinstance(usage, dict):
+            usage = {
+                "prompt_tokens": getattr(usage, "prompt_tokens", None),
+                "completion_tokens": getattr(usage, "completion_tokens", None),
+                "total_tokens": getattr(usage, "total_tokens", None),
+            }
+        entry = {
+            "type": "call",
+            "key": self.make_key(params),
+            "model": params["model"],
+            "temperature": params["temperature"],
+            "max_tokens": params.get("max_tokens"),
+            "extra_body": params.get("extra_body") or {},
+            "messages": params["messages"],
+            "raw_content": completion.get("raw_content", ""),
+            "reasoning": completion.get("reasoning", ""),
+            "finish_reason": completion.get("finish_reason"),
+            "usage": usage,
+            "response_model": completion.get("model"),
+            "response_id": completion.get("id"),
+            "latency": round(latency, 3),
+            "ttft": round(ttft, 3) if ttft is not None else None,
+            "recorded_at": time.time(),
+        }
+        await asyncio.to_thread(self._append, entry)
+        self._recorded += 1
+
+    def _append(self, entry: Dict):
+        with self._lock:
+            if self._prompts is None:
+                self._prompts = {
+                    record["hash"] for record in self._read_lines() if record.get("type") == "prompt"
+                }
+
+            lines = []
+            messages = []
+            for message in entry["messages"]:
+                if message.get("role") != "system":
+                    messages.append(message)
+                    continue
+                prompt_hash = _hash(message["content"])
+                if prompt_hash not in self._prompts:
+                    lines.append({"type": "prompt", "hash": prompt_hash, "content": message["content"]})
+                    self._prompts.add(prompt_hash)
+                messages.append({"role": "system", "content_ref": prompt_hash})
+            lines.append({**entry, "messages": messages})
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as f:
+                for line in lines:
+                    f.write(json.dumps(line, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def _read_lines(self) -> List[Dict]:
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    # ---------- 回放 ----------
+
+    def _load(self) -> Dict[str, List[Dict]]:
+        """读取语料并建立回放索引"""
+        recordings: Dict[str, List[Dict]] = defaultdict(list)
+        for record in self._read_lines():
+            if record.get("type") == "call":
+                recordings[record["key"]].append(record)
+        logger.info(f"📼 已加载LLM录制语料: {sum(len(v) for v in recordings.values())} 条 ({self.path})")
+        return recordings
+
+    async def _lookup(self, params: Dict) -> Dict:
+        if self._recordings is None:
+            self._recordings = await asyncio.to_thread(self._load)
+
+        key = self.make_key(params)
+        entries = self._recordings.get(key)
+        if not entries:
+            self._misses += 1
+            raise CassetteMissError(key)
+
+        # 同一请求录制过多次时按顺序轮流返回，保证回放结果确定
+        entry = entries[self._cursor[key] % len(entries)]
+        self._cursor[key] += 1
+        self._replayed += 1
+        return entry
+
+    async def replay(self, params: Dict) -> Dict:
+        """
+        回放一次非流式调用
+
+        Returns:
+            与WatchFaceCodeAgent._request_completion相同格式的结果字典
+
+        Raises:
+            CassetteMissError: 语料中没有该请求
+        """
+        entry = await self._lookup(params)
+        if settings.llm_cassette_replay_latency:
+            await asyncio.sleep(entry["latency"])
+        return {
+            "raw_content": entry["raw_content"],
+            "reasoning": entry["reasoning"],
+            "id": entry["response_id"],
+            "model": entry["response_model"],
+            "finish_reason": entry["finish_reason"],
+            "usage": SimpleNamespace(**entry["usage"]) if entry["usage"] else None,
+            "cached": False,
+        }
+
+    async def replay_stream(self, params: Dict) -> AsyncIterator[Dict]:
+        """
+        回放一次流式调用：产出与WatchFaceCodeAgent._stream_llm相同的reasoning/content/finish事件
+
+        Raises:
+            CassetteMissError: 语料中没有该请求
+        """
+        entry = await self._lookup(params)
+        content = entry["raw_content"]
+        pieces = [content[i:i + REPLAY_CHUNK_SIZE] for i in range(0, len(content), REPLAY_CHUNK_SIZE)]
+
+        ttft = entry["ttft"] if entry["ttft"] is not None else 0.0
+        piece_delay = max(0.0, entry["latency"] - ttft) / max(1, len(pieces))
+        timed = settings.llm_cassette_replay_latency
+
+        if entry["reasoning"]:
+            yield {"event": "reasoning", "data": {"delta": entry["reasoning"]}}
+        if timed:
+            await asyncio.sleep(ttft)
+        for piece in pieces:
+            if timed:
+                await asyncio.sleep(piece_delay)
+            yield {"event": "content", "data": {"delta": piece}}
+        yield {"event": "finish", "data": {"finish_reason": entry["finish_reason"]}}
+
+    def reset(self):
+        """丢弃回放索引与轮转位置（语料文件变化后或重新开始一轮回放时调用）"""
+        self._recordings = None
+        self._cursor.clear()
+        self._prompts = None
+
+    def get_stats(self) -> Dict:
+        """获取录制/回放统计信息"""
+        return {
+            "mode": settings.llm_cassette_mode,
+            "path": str(self.path),
+            "loaded": sum(len(v) for v in self._recordings.values()) if self._recordings is not None else None,
+            "recorded": self._recorded,
+            "replayed": self._replayed,
+            "misses": self._misses,
+        }
+
+
+# 创建全局实例
+llm_cassette = LLMCassette()
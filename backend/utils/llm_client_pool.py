@@ -0,0 +1,201 @@
+"""
+LLM客户端池 - 按API Key复用Code Agent，所有Agent共享同一个HTTP连接池
+
+每个API Key（按hash区分）+ 输出目标（html / ux）对应一个常驻的WatchFaceCodeAgent，按LRU淘汰并清理长时间空闲的条目；
+所有Agent底层共用一个httpx.AsyncClient（可用时启用HTTP/2），避免每个请求重新建立TLS连接。
+"""
+
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+
+from config import settings
+
+
+def _http2_available() -> bool:
+    """HTTP/2依赖h2包（httpx[http2]），未安装时回退到HTTP/1.1"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def hash_api_key(api_key: str) -> str:
+    """API Key的sha256 hash（与ApiKeyManager的存储方式一致）"""
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+class _PooledAgent:
+    """池中的单个Agent条目"""
+
+    def __init__(self, agent: Any):
+        self.agent = agent
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.use_count = 0
+
+
+class LLMClientPool:
+    """按API Key hash管理Code Agent的有界LRU池"""
+
+    def __init__(
+        self,
+        max_agents: int = settings.llm_pool_max_agents,
+        idle_ttl: float = settings.llm_pool_idle_ttl,
+    ):
+        self.max_agents = max_agents
+        self.idle_ttl = idle_ttl
+        self._agents: "OrderedDict[Tuple[str, str], _PooledAgent]" = OrderedDict()  # (key_hash, 输出目标) → Agent
+        self._http_client: Optional[httpx.AsyncClient] = None
+
+        # 统计信息
+        self._hits = 0
+        self._misses = 0
+        self._lru_evictions = 0
+        self._idle_evictions = 0
+        self._requests_sent = 0
+        self._connections_opened = 0
+
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """共享的HTTP客户端（首次使用时创建）"""
+        if self._http_client is None or self._http_client.is_closed:
+            self._http_client = httpx.AsyncClient(
+                http2=_http2_available(),
+                limits=httpx.Limits(
+                    max_connections=settings.llm_max_connections,
+                    max_keepalive_connections=settings.llm_max_keepalive_connections,
+                    keepalive_expiry=settings.llm_keepalive_expiry,
+                ),
+                event_hooks={"request": [self._on_request]},
+            )
+        return self._http_client
+
+    async def _on_request(self, request: httpx.Request):
+        """为每个请求挂载httpcore trace回调，统计新建连接数以验证连接复用"""
+        self._requests_sent += 1
+        request.extensions["trace"] = self._trace
+
+    async def _trace(self, event_name: str, info: Dict):
+        if event_name == "connection.connect_tcp.complete":
+            self._connections_opened += 1
+
+    def get_agent(self, api_key: Optional[str] = None, client_id: Optional[str] = None, target: str = "html"):
+        """
+        获取API Key + 输出目标对应的Code Agent（不存在则创建）
+
+        Args:
+            api_key: 客户端API Key，为空时使用默认配置的Key
+            client_id: 客户端ID（仅用于新建Agent时的日志记录）
+            target: 输出目标（html / ux），未知目标抛出ValueError
+
+        Returns:
+            WatchFaceCodeAgent实例
+        """
+        actual_api_key = api_key or settings.minimax_api_key
+        if not actual_api_key:
+            raise ValueError("No API Key provided and MINIMAX_API_KEY not configured")
+
+        from targets import get_target
+        pool_key = (hash_api_key(actual_api_key), get_target(target).name)
+
+        self._evict_idle()
+
+        entry = self._agents.get(pool_key)
+
+        if entry is not None:
+            self._hits += 1
+            self._agents.move_to_end(pool_key)
+        else:
+            self._misses += 1
+            from code_agent import WatchFaceCodeAgent
+
+            entry = _PooledAgent(WatchFaceCodeAgent(
+                api_key=api_key,
+                client_id=client_id,
+                http_client=self.http_client,
+                target=pool_key[1],
+            ))
+            self._agents[pool_key] = entry
+
+            while len(self._agents) > self.max_agents:
+                self._agents.popitem(last=False)
+                self._lru_evictions += 1
+
+        entry.last_used = time.time()
+        entry.use_count += 1
+        return entry.agent
+
+    def _evict_idle(self):
+        """清理超过idle_ttl未使用的Agent"""
+        now = time.time()
+        idle_keys = [
+            pool_key for pool_key, entry in self._agents.items()
+            if now - entry.last_used > self.idle_ttl
+        ]
+        for pool_key in idle_keys:
+            del self._agents[pool_key]
+            self._idle_evictions += 1
+
+    def _connection_stats(self) -> Dict:
+        """读取httpcore连接池中的连接状态"""
+        if self._http_client is None:
+            return {"open": 0, "idle": 0, "active": 0}
+
+        pool = getattr(getattr(self._http_client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+        idle = sum(1 for conn in connections if conn.is_idle())
+        return {
+            "open": len(connections),
+            "idle": idle,
+            "active": len(connections) - idle,
+        }
+
+    def get_stats(self) -> Dict:
+        """获取池统计信息"""
+        now = time.time()
+        requests_sent = self._requests_sent
+        return {
+            "agents": {
+                "size": len(self._agents),
+                "max_size": self.max_agents,
+                "idle_ttl": self.idle_ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "lru_evictions": self._lru_evictions,
+                "idle_evictions": self._idle_evictions,
+                "entries": [
+                    {
+                        "key_hash": key_hash[:12],
+                        "target": target,
+                        "use_count": entry.use_count,
+                        "idle_seconds": round(now - entry.last_used, 1),
+                    }
+                    for (key_hash, target), entry in self._agents.items()
+                ],
+            },
+            "http": {
+                "http2": _http2_available(),
+                "requests_sent": requests_sent,
+                "connections_opened": self._connections_opened,
+                "connection_reuse_ratio": (
+                    round(1 - self._connections_opened / requests_sent, 4) if requests_sent else None
+                ),
+                "connections": self._connection_stats(),
+            },
+        }
+
+    async def aclose(self):
+        """关闭共享HTTP客户端并清空池（应用关闭时调用）"""
+        self._agents.clear()
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+
+
+# 创建全局实例
+llm_client_pool = LLMClientPool()
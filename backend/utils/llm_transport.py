@@ -0,0 +1,219 @@
+"""
+LLM传输层 - 分类重试、带抖动的指数退避、熔断器
+
+所有WatchFaceCodeAgent共用同一个上游（MiniMax），因此熔断器全局共享：
+连续若干次上游故障（超时、连接错误、5xx）后进入熔断状态，期间的请求立即失败而不是各自等待完整超时；
+冷却时间过后放行一个探测请求，成功则恢复，失败则继续熔断。
+
+认证错误、参数错误等客户端问题不重试，也不计入熔断。
+流式请求只在建立连接、收到响应头之前重试，已经开始输出的流不会重放。
+"""
+
+import asyncio
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+import openai
+
+from config import settings
+from logging_config import get_logger
+
+logger = get_logger()
+
+
+# 可重试的HTTP状态码
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """熔断中，请求被直接拒绝"""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(f"LLM upstream circuit open, retry after {retry_after:.0f}s")
+
+
+def build_timeout() -> httpx.Timeout:
+    """分别设置连接与读取超时：连接失败应快速暴露，生成本身可能需要较长时间"""
+    return httpx.Timeout(
+        connect=settings.llm_connect_timeout,
+        read=settings.llm_read_timeout,
+        write=settings.llm_write_timeout,
+        pool=settings.llm_pool_timeout,
+    )
+
+
+def classify_error(error: BaseException) -> str:
+    """
+    错误分类
+
+    Returns:
+        "upstream": 上游故障（超时、连接错误、5xx），重试并计入熔断
+        "throttled": 限流/冲突（429/409/408），重试但不计入熔断
+        "fatal": 客户端错误（认证、参数等），不重试
+    """
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return "upstream"
+    if isinstance(error, openai.APIStatusError):
+        if error.status_code >= 500:
+            return "upstream"
+        if error.status_code in RETRYABLE_STATUS_CODES:
+            return "throttled"
+    return "fatal"
+
+
+class CircuitBreaker:
+    """连续失败计数的熔断器（closed → open → half_open → closed）"""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+        # 统计信息
+        self._opened_count = 0
+        self._rejected = 0
+
+    def before_call(self):
+        """调用前检查，熔断中抛出CircuitOpenError"""
+        if self.state == "closed":
+            return
+
+        elapsed = time.monotonic() - self._opened_at
+        if self.state == "open" and elapsed >= self.reset_timeout:
+            self.state = "half_open"
+            logger.info("🟡 LLM熔断器进入半开状态，放行探测请求")
+
+        if self.state == "half_open" and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return
+
+        self._rejected += 1
+        raise CircuitOpenError(max(0.0, self.reset_timeout - elapsed))
+
+    def record_success(self):
+        if self.state != "closed":
+            logger.info("🟢 LLM熔断器恢复关闭状态")
+        self.state = "closed"
+        self._consecutive_failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self._consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == "half_open" or self._consecutive_failures >= self.failure_threshold:
+            if self.state != "open":
+                self._opened_count += 1
+                logger.warning(
+                    f"🔴 LLM熔断器打开: 连续失败 {self._consecutive_failures} 次，"
+                    f"{self.reset_timeout:.0f}s 内请求将直接失败"
+                )
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+    def release_probe(self):
+        """探测请求因非上游原因结束（如被取消、客户端错误）时释放探测名额"""
+        self._probe_in_flight = False
+
+    def get_state(self) -> Dict:
+        retry_after = None
+        if self.state == "open":
+            retry_after = round(max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at)), 1)
+        return {
+            "state": self.state,
+            "consecutive_failures": self._consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "retry_after": retry_after,
+            "opened_count": self._opened_count,
+            "rejected": self._rejected,
+        }
+
+
+class LLMTransport:
+    """在LLM调用外包裹熔断与重试"""
+
+    def __init__(self):
+        self.breaker = CircuitBreaker(
+            failure_threshold=settings.llm_breaker_failure_threshold,
+            reset_timeout=settings.llm_breaker_reset_timeout,
+        )
+
+        # 统计信息
+        self._calls = 0
+        self._retries = 0
+        self._failures: Dict[str, int] = {"upstream": 0, "throttled": 0, "fatal": 0}
+
+    def _backoff(self, attempt: int) -> float:
+        """full jitter指数退避：[0, min(cap, base * 2^attempt)]"""
+        ceiling = min(settings.llm_retry_max_delay, settings.llm_retry_base_delay * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    async def call(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        执行一次LLM调用（fn为无参数的协程工厂，每次重试重新调用）
+
+        Raises:
+            CircuitOpenError: 熔断中
+            原始异常: 不可重试或重试次数用尽
+        """
+        self._calls += 1
+        attempt = 0
+
+        while True:
+            self.breaker.before_call()
+            try:
+                result = await fn()
+            except asyncio.CancelledError:
+                self.breaker.release_probe()
+                raise
+            except Exception as e:
+                kind = classify_error(e)
+                self._failures[kind] += 1
+                if kind == "upstream":
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.release_probe()
+
+                if kind == "fatal" or attempt >= settings.llm_max_retries:
+                    raise
+
+                delay = self._retry_after(e) or self._backoff(attempt)
+                attempt += 1
+                self._retries += 1
+                logger.warning(
+                    f"🔁 LLM调用失败（{type(e).__name__}），{delay:.1f}s 后第 {attempt} 次重试"
+                )
+                await asyncio.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            return result
+
+    @staticmethod
+    def _retry_after(error: BaseException) -> Optional[float]:
+        """429等响应中的Retry-After（秒），不超过最大退避时间"""
+        response = getattr(error, "response", None)
+        value = response.headers.get("retry-after") if response is not None else None
+        try:
+            return min(float(value), settings.llm_retry_max_delay) if value else None
+        except ValueError:
+            return None
+
+    def get_stats(self) -> Dict:
+        """获取传输层统计（含熔断器状态）"""
+        return {
+            "breaker": self.breaker.get_state(),
+            "calls": self._calls,
+            "retries": self._retries,
+            "failures": dict(self._failures),
+            "max_retries": settings.llm_max_retries,
+        }
+
+
+# 创建全局实例
+llm_transport = LLMTransport()
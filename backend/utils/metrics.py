@@ -0,0 +1,214 @@
+"""
+Prometheus指标 - 计数器和直方图，/metrics 以Prometheus文本格式导出
+
+只使用有限取值的标签：endpoint为路由模板（如 /api/project/{project_id}），model为配置中的模型名，
+不按客户端/项目/会话打标签，避免时间序列数量膨胀。
+当前请求的endpoint由main.py的中间件写入endpoint_var，各处记录指标时无需层层传递。
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .tracing import tracer
+
+
+# 当前请求的路由模板（后台任务中为任务类型，如 job:generate）
+endpoint_var: ContextVar[str] = ContextVar("metrics_endpoint", default="other")
+
+# 默认的耗时分桶（秒）：覆盖毫秒级的本地处理到数分钟的LLM调用
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120, 300)
+# 字节数分桶
+BYTES_BUCKETS = (1024, 10 * 1024, 100 * 1024, 512 * 1024, 1024 ** 2, 5 * 1024 ** 2, 20 * 1024 ** 2)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # 部分指标在线程池中记录（如大文件diff），需要加锁
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """累积分桶直方图（附带 _sum / _count）"""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # 每组标签：[各分桶计数（非累积）..., +Inf桶计数, 总和]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = len(self.buckets)
+        for position, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = position
+                break
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 2)
+            entry[index] += 1
+            entry[-1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """计时上下文（可包含await）"""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        with self._lock:
+            items = sorted((key, list(entry)) for key, entry in self._values.items())
+        for key, entry in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), entry[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_number(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {_format_number(cumulative)}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_number(entry[-1])}")
+            lines.append(f"{self.name}_count{labels} {_format_number(cumulative)}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表：定义服务的全部指标，并导出为Prometheus文本格式"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+        self.http_requests = self._register(Counter(
+            "watchface_http_requests_total", "HTTP requests by route and status class",
+            ("endpoint", "method", "status")
+        ))
+        self.http_request_seconds = self._register(Histogram(
+            "watchface_http_request_duration_seconds", "HTTP request latency until response headers",
+            ("endpoint", "method")
+        ))
+        self.stage_seconds = self._register(Histogram(
+            "watchface_stage_duration_seconds",
+            "Latency of pipeline stages (prompt_build, queue_wait, ttft, llm_total, extraction, diff, "
+            "save_project, response_build, zip_build, list_projects)",
+            ("endpoint", "model", "stage")
+        ))
+        self.llm_tokens = self._register(Counter(
+            "watchface_llm_tokens_total", "LLM tokens (output estimated when usage is missing)",
+            ("endpoint", "model", "direction")
+        ))
+        self.generation_cache = self._register(Counter(
+            "watchface_generation_cache_requests_total", "Generation cache lookups",
+            ("endpoint", "model", "result")
+        ))
+        self.upload_bytes = self._register(Histogram(
+            "watchface_upload_bytes", "Uploaded asset size in bytes", ("endpoint",), BYTES_BUCKETS
+        ))
+
+    def _register(self, metric: _Metric):
+        self._metrics.append(metric)
+        return metric
+
+    def observe_stage(self, stage: str, seconds: float, model: Optional[str] = None):
+        """记录一个流水线阶段的耗时（endpoint取自当前请求）"""
+        self.stage_seconds.observe(
+            seconds, endpoint=endpoint_var.get(), model=model or "none", stage=stage
+        )
+
+    @contextmanager
+    def stage(self, stage: str, model: Optional[str] = None) -> Iterator[None]:
+        """流水线阶段计时上下文（可包含await），同时记录为当前trace下的span"""
+        started_at = time.perf_counter()
+        try:
+            with tracer.span(f"stage.{stage}"):
+                yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - started_at, model)
+
+    def record_tokens(self, model: str, input_tokens: Optional[int], output_tokens: Optional[int]):
+        endpoint = endpoint_var.get()
+        if input_tokens:
+            self.llm_tokens.inc(input_tokens, endpoint=endpoint, model=model, direction="input")
+        if output_tokens:
+            self.llm_tokens.inc(output_tokens, endpoint=endpoint, model=model, direction="output")
+
+    def record_cache(self, model: str, hit: bool):
+        self.generation_cache.inc(endpoint=endpoint_var.get(), model=model, result="hit" if hit else "miss")
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# 创建全局实例
+metrics = MetricsRegistry()
@@ -0,0 +1,216 @@
+"""
+模型路由 - 按指令类型为每次请求选择模型档位（模型、temperature、是否拆分思考过程）
+
+指令分类只使用本地的廉价特征（不调用模型）：
+- generation：没有当前代码（从零生成）
+- cosmetic：指令简短、只命中颜色/尺寸/字体等样式词且没有结构性词（如"指针太粗了"、"背景改成蓝色"）
+- structural：其他编辑（添加/删除元素、替换素材、改布局或交互、多个子句的复合修改），拿不准时也归为此类
+后台任务不经分类，直接使用固定档位（如summary：对话摘要）。
+
+各档位参数见 settings.routing_profiles，未配置的字段沿用Code Agent的默认配置。
+当前请求的档位保存在route_var中（与endpoint_var一样，各处读取模型参数时无需层层传递）。
+每次决策及其结果（总耗时、模型耗时、token、成功与否）都写入日志并按档位汇总，供调整阈值参考。
+"""
+
+import re
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from config import settings
+from logging_config import get_logger
+
+logger = get_logger()
+
+# 子句分隔：标点和常见连接词
+_CLAUSE_SPLIT = re.compile(r"[，,。；;！!？?\n]+|并且|然后|同时|以及|还有")
+
+
+class Route:
+    """一次路由决策：档位名称、档位参数和分类依据"""
+
+    def __init__(self, name: str, reason: str, features: Dict):
+        profile = settings.routing_profiles.get(name) or {}
+        self.name = name
+        self.reason = reason
+        self.features = features
+        self.model: Optional[str] = profile.get("model") or None
+        self.temperature: Optional[float] = profile.get("temperature")
+        self.reasoning: Optional[bool] = profile.get("reasoning")
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "reason": self.reason,
+            "model": self.model,
+            "temperature": self.temperature,
+            "reasoning": self.reasoning,
+        }
+
+
+route_var: ContextVar[Optional[Route]] = ContextVar("model_route", default=None)
+
+
+def current_route() -> Optional[Route]:
+    """当前请求的路由决策（未开启路由或不在请求处理中时为None）"""
+    return route_var.get()
+
+
+def _percentile(samples, ratio: float) -> Optional[float]:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * ratio))], 3)
+
+
+class ModelRouter:
+    """指令分类 + 档位选择 + 按档位统计结果"""
+
+    def __init__(self):
+        self._stats: Dict[str, Dict] = {}
+
+    def classify(self, instruction: str, current_code: Optional[str] = None) -> Tuple[str, str, Dict]:
+        """
+        按本地特征对指令分类
+
+        Returns:
+            (档位名称, 分类依据, 特征)
+        """
+        text = (instruction or "").strip()
+        clauses = [part for part in _CLAUSE_SPLIT.split(text) if part.strip()]
+        features = {
+            "chars": len(text),
+            "clauses": len(clauses),
+            "code_chars": len(current_code) if current_code else 0,
+            "cosmetic_hits": [word for word in settings.routing_cosmetic_keywords if word in text][:5],
+            "structural_hits": [word for word in settings.routing_structural_keywords if word in text][:5],
+        }
+
+        if current_code is None:
+            return "generation", "no_current_code", features
+        if features["structural_hits"]:
+            return "structural", "structural_keyword", features
+        if features["chars"] > settings.routing_cosmetic_max_chars:
+            return "structural", "long_instruction", features
+        if features["clauses"] > settings.routing_cosmetic_max_clauses:
+            return "structural", "multiple_clauses", features
+        if features["cosmetic_hits"]:
+            return "cosmetic", "cosmetic_keyword", features
+        return "structural", "no_cosmetic_keyword", features
+
+    def route(self, instruction: str, current_code: Optional[str] = None) -> Optional[Route]:
+        """为一次请求选择档位（未开启路由时返回None，使用默认配置）"""
+        if not settings.routing_enabled:
+            return None
+
+        name, reason, features = self.classify(instruction, current_code)
+        route = Route(name, reason, features)
+        self._bucket(name)["decisions"] += 1
+        logger.info(
+            f"🧭 路由决策: {name}（{reason}） model={route.model or '默认'}, "
+            f"temperature={route.temperature if route.temperature is not None else '默认'}, "
+            f"reasoning={'默认' if route.reasoning is None else ('开' if route.reasoning else '关')}",
+            extra={"fields": {"route": name, "reason": reason, **features}}
+        )
+        return route
+
+    def fixed(self, name: str, reason: str) -> Optional[Route]:
+        """不经分类直接使用指定档位（如后台对话摘要），未开启路由时返回None"""
+        if not settings.routing_enabled:
+            return None
+        self._bucket(name)["decisions"] += 1
+        return Route(name, reason, {})
+
+    @contextmanager
+    def use(self, route: Optional[Route]):
+        """在当前上下文中启用路由决策（route为None时不做任何事）"""
+        if route is None:
+            yield
+            return
+        token = route_var.set(route)
+        try:
+            yield
+        finally:
+            try:
+                route_var.reset(token)
+            except ValueError:
+                # 流式生成器在其他上下文中被关闭（如客户端断开后由GC回收），此时无需恢复
+                pass
+
+    def record_outcome(self, route: Optional[Route], latency: float, result: Dict):
+        """记录一次路由决策的结果（总耗时、模型耗时、token、成功与否）"""
+        if route is None:
+            return
+        usage = result.get("usage") or {}
+        success = bool(result.get("success"))
+        bucket = self._bucket(route.name)
+        bucket["completed"] += 1
+        bucket["succeeded"] += int(success)
+        bucket["cached"] += int(bool(result.get("cached")))
+        bucket["latencies"].append(latency)
+        bucket["llm_latency"] += usage.get("llm_latency") or 0.0
+        bucket["completion_tokens"] += usage.get("completion_tokens") or 0
+        bucket["reasoning_tokens"] += usage.get("reasoning_tokens") or 0
+
+        logger.info(
+            f"🧭 路由结果: {route.name} {'成功' if success else '失败'}, 耗时 {latency:.2f}s",
+            extra={"fields": {
+                "route": route.name,
+                "reason": route.reason,
+                "model": route.model,
+                "success": success,
+                "cached": bool(result.get("cached")),
+                "latency": round(latency, 3),
+                "llm_latency": usage.get("llm_latency"),
+                "completion_tokens": usage.get("completion_tokens"),
+                "reasoning_tokens": usage.get("reasoning_tokens"),
+                "edit_mode": result.get("edit_mode"),
+                **route.features,
+            }}
+        )
+
+    def _bucket(self, name: str) -> Dict:
+        if name not in self._stats:
+            self._stats[name] = {
+                "decisions": 0,
+                "completed": 0,
+                "succeeded": 0,
+                "cached": 0,
+                "latencies": deque(maxlen=settings.routing_stats_window),
+                "llm_latency": 0.0,
+                "completion_tokens": 0,
+                "reasoning_tokens": 0,
+            }
+        return self._stats[name]
+
+    def get_stats(self) -> Dict:
+        """按档位汇总决策次数和结果"""
+        routes = {}
+        for name, bucket in self._stats.items():
+            completed = bucket["completed"]
+            latencies: List[float] = list(bucket["latencies"])
+            routes[name] = {
+                "decisions": bucket["decisions"],
+                "completed": completed,
+                "success_rate": round(bucket["succeeded"] / completed, 4) if completed else None,
+                "cache_hits": bucket["cached"],
+                "latency_p50": _percentile(latencies, 0.5),
+                "latency_p90": _percentile(latencies, 0.9),
+                "avg_llm_latency": round(bucket["llm_latency"] / completed, 3) if completed else None,
+                "avg_completion_tokens": round(bucket["completion_tokens"] / completed, 1) if completed else None,
+                "avg_reasoning_tokens": round(bucket["reasoning_tokens"] / completed, 1) if completed else None,
+                "profile": settings.routing_profiles.get(name) or {},
+            }
+        return {
+            "enabled": settings.routing_enabled,
+            "thresholds": {
+                "cosmetic_max_chars": settings.routing_cosmetic_max_chars,
+                "cosmetic_max_clauses": settings.routing_cosmetic_max_clauses,
+            },
+            "routes": routes,
+        }
+
+
+# 创建全局实例
+model_router = ModelRouter()
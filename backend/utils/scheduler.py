@@ -0,0 +1,266 @@
+"""
+LLM调度器 - 准入控制与按客户端的加权公平排队
+
+限制同时进行的LLM调用：全局上限、每个客户端上限、每个API Key上限。
+超出上限的请求按客户端分别排队，调度时选择虚拟时间最小的客户端（每次调度虚拟时间增加 1/权重），
+一个客户端连续提交大量请求也不会饿死其他客户端。排队已满时拒绝请求并给出建议的重试时间。
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Deque, Dict, Optional
+
+from config import settings
+from logging_config import get_logger
+
+logger = get_logger()
+
+
+class SchedulerRejected(Exception):
+    """排队已满，请求被拒绝"""
+
+    def __init__(self, reason: str, retry_after: int):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(f"{reason}, retry after {retry_after}s")
+
+
+class Ticket:
+    """一次LLM调用的调度凭证"""
+
+    def __init__(self, client_id: str, key_hash: str, position: int):
+        self.client_id = client_id
+        self.key_hash = key_hash
+        self.position = position            # 入队时在全局队列中的位置（从1开始，0表示无需排队）
+        self.enqueued_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.waited: Optional[float] = None   # 获得执行权时的排队时长（归还执行权后仍保留）
+        self.granted = asyncio.get_running_loop().create_future()
+
+    @property
+    def wait_time(self) -> float:
+        if self.waited is not None:
+            return self.waited
+        end = self.started_at if self.started_at is not None else time.monotonic()
+        return end - self.enqueued_at
+
+
+ticket_var: ContextVar[Optional[Ticket]] = ContextVar("scheduler_ticket", default=None)
+
+
+def current_ticket() -> Optional[Ticket]:
+    """当前请求持有的执行权（对冲等附加调用据此以同一客户端/API Key另行排队；未经调度器时为None）"""
+    return ticket_var.get()
+
+
+class _ClientState:
+    """单个客户端的排队状态"""
+
+    def __init__(self, weight: float, virtual_time: float):
+        self.queue: Deque[Ticket] = deque()
+        self.running = 0
+        self.weight = weight
+        self.virtual_time = virtual_time
+
+
+class LLMScheduler:
+    """全局/客户端/API Key三级并发上限 + 加权公平排队"""
+
+    def __init__(
+        self,
+        max_concurrent: int = settings.scheduler_max_concurrent,
+        max_per_client: int = settings.scheduler_max_per_client,
+        max_per_key: int = settings.scheduler_max_per_key,
+        max_queue: int = settings.scheduler_max_queue,
+        max_queue_per_client: int = settings.scheduler_max_queue_per_client,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_per_client = max_per_client
+        self.max_per_key = max_per_key
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+
+        self._clients: Dict[str, _ClientState] = {}
+        self._key_running: Dict[str, int] = {}
+        self._running = 0
+        self._queued = 0
+        self._virtual_clock = 0.0
+        self._avg_service_time = 30.0  # 单次LLM调用耗时的移动平均（用于估算Retry-After）
+
+        # 统计信息
+        self._dispatched = 0
+        self._rejected = 0
+        self._wait_times: deque = deque(maxlen=500)
+
+    def _retry_after(self) -> int:
+        """按当前排队长度和平均耗时估算重试等待时间（秒）"""
+        rounds = math.ceil((self._queued + 1) / max(1, self.max_concurrent))
+        return max(1, int(rounds * self._avg_service_time))
+
+    def admit(self, client_id: str):
+        """
+        检查是否可以接收新请求（不改变状态）
+
+        Raises:
+            SchedulerRejected: 全局或该客户端的排队已满
+        """
+        client = self._clients.get(client_id)
+        if self._queued >= self.max_queue:
+            self._rejected += 1
+            raise SchedulerRejected("global queue full", self._retry_after())
+        if client is not None and len(client.queue) >= self.max_queue_per_client:
+            self._rejected += 1
+            raise SchedulerRejected("client queue full", self._retry_after())
+
+    def enqueue(self, client_id: str, key_hash: str) -> Ticket:
+        """
+        提交请求，能立即执行时直接获得执行权
+
+        Raises:
+            SchedulerRejected: 排队已满
+        """
+        self.admit(client_id)
+
+        client = self._clients.get(client_id)
+        if client is None:
+            weight = settings.scheduler_client_weights.get(client_id, 1.0)
+            # 新出现（或空闲后重新出现）的客户端从当前虚拟时钟开始，不能“攒”优先级
+            client = _ClientState(weight, self._virtual_clock)
+            self._clients[client_id] = client
+
+        ticket = Ticket(client_id, key_hash, 0)
+        client.queue.append(ticket)
+        self._queued += 1
+        self._dispatch()
+
+        if not ticket.granted.done():
+            ticket.position = self._queued
+            logger.info(
+                f"⏳ LLM请求排队: 客户端 {client_id[:16]} 排在第 {ticket.position} 位，"
+                f"运行中 {self._running}/{self.max_concurrent}"
+            )
+        return ticket
+
+    async def wait(self, ticket: Ticket):
+        """等待获得执行权（取消时自动退出队列）"""
+        try:
+            await asyncio.shield(ticket.granted)
+        except asyncio.CancelledError:
+            if ticket.granted.done():
+                # 刚获得执行权就被取消：归还名额
+                self.release(ticket)
+            else:
+                client = self._clients.get(ticket.client_id)
+                if client is not None and ticket in client.queue:
+                    client.queue.remove(ticket)
+                    self._queued -= 1
+                    self._cleanup(ticket.client_id)
+                ticket.granted.cancel()
+            raise
+
+    def release(self, ticket: Ticket):
+        """归还执行权，并调度下一个请求"""
+        if ticket.started_at is None:
+            return
+        client = self._clients[ticket.client_id]
+        client.running -= 1
+        self._running -= 1
+        self._key_running[ticket.key_hash] -= 1
+        if not self._key_running[ticket.key_hash]:
+            del self._key_running[ticket.key_hash]
+
+        service_time = time.monotonic() - ticket.started_at
+        self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * service_time
+        ticket.started_at = None
+
+        self._cleanup(ticket.client_id)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, client_id: str, key_hash: str) -> AsyncIterator[Ticket]:
+        """获取执行权的上下文管理器：async with scheduler.slot(...) as ticket"""
+        ticket = self.enqueue(client_id, key_hash)
+        await self.wait(ticket)
+        token = ticket_var.set(ticket)
+        try:
+            yield ticket
+        finally:
+            ticket_var.reset(token)
+            self.release(ticket)
+
+    def _dispatch(self):
+        """在全局上限内，按虚拟时间从小到大为可执行的客户端分配执行权"""
+        while self._running < self.max_concurrent:
+            candidates = [
+                (client.virtual_time, client.queue[0].enqueued_at, client_id)
+                for client_id, client in self._clients.items()
+                if client.queue
+                and client.running < self.max_per_client
+                and self._key_running.get(client.queue[0].key_hash, 0) < self.max_per_key
+            ]
+            if not candidates:
+                return
+
+            _, _, client_id = min(candidates)
+            client = self._clients[client_id]
+            ticket = client.queue.popleft()
+            self._queued -= 1
+
+            self._virtual_clock = client.virtual_time
+            client.virtual_time += 1.0 / client.weight
+            client.running += 1
+            self._running += 1
+            self._key_running[ticket.key_hash] = self._key_running.get(ticket.key_hash, 0) + 1
+
+            ticket.started_at = time.monotonic()
+            ticket.waited = ticket.started_at - ticket.enqueued_at
+            self._dispatched += 1
+            self._wait_times.append(ticket.wait_time)
+            ticket.granted.set_result(None)
+
+    def _cleanup(self, client_id: str):
+        """移除既无排队也无运行中请求的客户端"""
+        client = self._clients.get(client_id)
+        if client is not None and not client.queue and not client.running:
+            del self._clients[client_id]
+
+    def get_stats(self) -> Dict:
+        """获取调度统计信息（队列深度、等待时间分位数、各客户端状态）"""
+        ordered = sorted(self._wait_times)
+
+        def percentile(p: float) -> Optional[float]:
+            if not ordered:
+                return None
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))], 3)
+
+        return {
+            "running": self._running,
+            "queued": self._queued,
+            "limits": {
+                "max_concurrent": self.max_concurrent,
+                "max_per_client": self.max_per_client,
+                "max_per_key": self.max_per_key,
+                "max_queue": self.max_queue,
+                "max_queue_per_client": self.max_queue_per_client,
+            },
+            "dispatched": self._dispatched,
+            "rejected": self._rejected,
+            "avg_service_time": round(self._avg_service_time, 3),
+            "wait_time": {"p50": percentile(0.5), "p95": percentile(0.95), "max": ordered[-1] if ordered else None},
+            "clients": {
+                client_id[:16]: {
+                    "running": client.running,
+                    "queued": len(client.queue),
+                    "weight": client.weight,
+                }
+                for client_id, client in self._clients.items()
+            },
+        }
+
+
+# 创建全局实例
+llm_scheduler = LLMScheduler()
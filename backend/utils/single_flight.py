@@ -0,0 +1,68 @@
+"""
+Single-flight请求合并 - 相同的生成/编辑请求在进行中时，重复请求直接等待同一个结果
+
+典型场景：生成较慢时用户双击、前端超时重试，同一条指令针对同一项目被提交多次。
+合并后只发起一次LLM调用、只写一次metadata.json。
+"""
+
+import asyncio
+import hashlib
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+
+class SingleFlight:
+    """进程内的请求合并器"""
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+        # 统计信息
+        self._leaders = 0
+        self._coalesced = 0
+
+    @staticmethod
+    def make_key(*parts: Any) -> str:
+        """由若干部分（客户端、项目、指令、当前代码等）计算合并键，每部分单独hash"""
+        digests = [
+            hashlib.sha256(str(part if part is not None else "").encode("utf-8")).hexdigest()
+            for part in parts
+        ]
+        return hashlib.sha256("|".join(digests).encode("utf-8")).hexdigest()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        执行fn，若相同key的调用正在进行则等待其结果
+
+        fn在独立的Task中运行，即使首个调用方断开/被取消，其他等待者仍能拿到结果。
+
+        Args:
+            key: 合并键（make_key生成）
+            fn: 无参数的协程工厂
+
+        Returns:
+            (结果, 是否复用了进行中的调用)
+        """
+        task = self._inflight.get(key)
+        shared = task is not None
+
+        if shared:
+            self._coalesced += 1
+        else:
+            self._leaders += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        return await asyncio.shield(task), shared
+
+    def get_stats(self) -> Dict:
+        """获取合并统计信息"""
+        return {
+            "inflight": len(self._inflight),
+            "leaders": self._leaders,
+            "coalesced": self._coalesced,
+        }
+
+
+# 创建全局实例
+single_flight = SingleFlight()
@@ -8,9 +8,15 @@ from pathlib import Path
 from typing import Dict, Optional, Any
 from datetime import datetime
 
+from config import settings
+from logging_config import get_logger
+from .tracing import traced
+
+logger = get_logger()
+
 
 # 存储目录
-STORAGE_ROOT = Path(__file__).parent.parent.parent / "storage"
+STORAGE_ROOT = Path(settings.STORAGE_ROOT) if settings.STORAGE_ROOT else Path(__file__).parent.parent.parent / "storage"
 PROJECTS_DIR = STORAGE_ROOT / "projects"
 UPLOADS_DIR = STORAGE_ROOT / "uploads"
 
@@ -41,6 +47,7 @@ def generate_unique_filename(original_filename: str, asset_type: str) -> str:
     return f"{unique_prefix}{ext}"
 
 
+@traced("storage.save_project")
 async def save_project(
     project_id: str,
     files: Dict[str, str],
@@ -106,7 +113,7 @@ async def save_project(
                         dest_file = assets_dir / asset_filename
                         import shutil
                         shutil.copy2(src_file, dest_file)
-                        print(f"  ✓ 复制素材: {asset_filename}")
+                        logger.debug(f"✓ 复制素材: {asset_filename}")
         
         # 3. 将每个文件写入实际文件系统
         for file_path, content in files.items():
@@ -122,16 +129,15 @@ async def save_project(
             with full_path.open('w', encoding='utf-8') as f:
                 f.write(content)
         
-        print(f"✅ 项目已保存到文件系统: {project_dir}")
+        logger.info(f"✅ 项目已保存到文件系统: {project_dir}")
         return True
         
     except Exception as e:
-        print(f"❌ 保存项目失败: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error(f"❌ 保存项目失败: {e}", exc_info=True)
         return False
 
 
+@traced("storage.load_project")
 async def load_project(project_id: str) -> Optional[Dict[str, Any]]:
     """
     加载项目 - 从文件系统读取代码文件
@@ -180,7 +186,7 @@ async def load_project(project_id: str) -> Optional[Dict[str, Any]]:
             if files_path.exists():
                 with files_path.open('r', encoding='utf-8') as f:
                     files = json.load(f)
-                print(f"⚠️  从旧格式 files.json 加载项目: {project_id}")
+                logger.warning(f"⚠️  从旧格式 files.json 加载项目: {project_id}")
         
         return {
             "metadata": metadata,
@@ -188,9 +194,7 @@ async def load_project(project_id: str) -> Optional[Dict[str, Any]]:
         }
         
     except Exception as e:
-        print(f"❌ 加载项目失败: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error(f"❌ 加载项目失败: {e}", exc_info=True)
         return None
 
 
@@ -245,6 +249,7 @@ async def list_projects(session_id: Optional[str] = None) -> list:
                 projects.append({
                     "project_id": project_dir.name,
                     "session_id": metadata.get("session_id", ""),
+                    "client_id": metadata.get("client_id", "default"),
                     "watchface_name": metadata.get("config", {}).get("watchface_name", "未命名"),
                     "created_at": metadata.get("created_at", ""),
                     "updated_at": metadata.get("updated_at", ""),
@@ -258,7 +263,7 @@ async def list_projects(session_id: Optional[str] = None) -> list:
         projects.sort(key=lambda x: x.get("updated_at", ""), reverse=True)
         
     except Exception as e:
-        print(f"获取项目列表失败: {e}")
+        logger.error(f"获取项目列表失败: {e}", exc_info=True)
     
     return projects
 
@@ -316,19 +321,17 @@ async def delete_project(project_id: str) -> bool:
     try:
         project_dir = PROJECTS_DIR / project_id
         if not project_dir.exists():
-            print(f"⚠️ 项目不存在: {project_id}")
+            logger.warning(f"⚠️ 项目不存在: {project_id}")
             return False
         
         # 删除整个项目目录
         import shutil
         shutil.rmtree(project_dir)
-        print(f"✅ 项目已删除: {project_id}")
+        logger.info(f"✅ 项目已删除: {project_id}")
         return True
         
     except Exception as e:
-        print(f"❌ 删除项目失败: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error(f"❌ 删除项目失败: {e}", exc_info=True)
         return False
 
 
@@ -376,16 +379,16 @@ async def delete_all_projects(session_id: Optional[str] = None) -> Dict[str, Any
                 import shutil
                 shutil.rmtree(project_dir)
                 deleted_count += 1
-                print(f"  ✓ 已删除: {project_dir.name}")
+                logger.debug(f"✓ 已删除: {project_dir.name}")
             except Exception as e:
                 failed_count += 1
-                print(f"  ✗ 删除失败: {project_dir.name} - {e}")
+                logger.error(f"✗ 删除失败: {project_dir.name} - {e}", exc_info=True)
         
         message = f"成功删除 {deleted_count} 个项目"
         if failed_count > 0:
             message += f"，{failed_count} 个项目删除失败"
         
-        print(f"✅ {message}")
+        logger.info(f"✅ {message}")
         
         return {
             "success": True,
@@ -395,9 +398,7 @@ async def delete_all_projects(session_id: Optional[str] = None) -> Dict[str, Any
         }
         
     except Exception as e:
-        print(f"❌ 批量删除项目失败: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.error(f"❌ 批量删除项目失败: {e}", exc_info=True)
         return {
             "success": False,
             "deleted_count": 0,
@@ -0,0 +1,245 @@
+"""
+流式代码提取 - 边接收模型输出边定位代码，产出代码增量，并在输出明显异常时提前中止
+
+按到达的分块增量扫描（每个字符只扫描常数次），识别：
+- ```html / ```xml / ``` 代码块（不带语言标识时要求内容以 < 开头，其他语言的代码块跳过）
+- 没有代码块时裸露的 <!DOCTYPE html> / <html ... </html>（结束位置取最后一个</html>）
+- 补丁模式下的 <<<<<<< SEARCH 修改块（只标记代码已开始，不产出代码增量）
+
+代码块语言标识和裸露代码的首尾标记由CodeFormat决定（默认HTML_FORMAT；BlueOS .ux见UX_FORMAT）。
+
+异常判定（开启提前中止时）：
+- no_code：正文超过 stream_abort_prose_tokens 仍未出现代码
+- repetition：代码中连续出现超过 stream_abort_repeat_lines 行相同内容（模型陷入循环）
+"""
+
+import re
+from typing import Optional
+
+from config import settings
+from .token_budget import estimate_tokens
+
+
+# 最长的开始标记长度，未匹配时保留缓冲区末尾这么多字符，避免标记被分块截断
+_START_HOLDBACK = len("<<<<<<<<< SEARCH")
+
+FENCE = "```"
+
+
+class CodeFormat:
+    """
+    代码格式：识别代码块和裸露代码所需的标记
+
+    Args:
+        fence_langs: 视为目标代码的代码块语言标识（不区分大小写），空字符串表示未标注语言
+        raw_start: 没有代码块时裸露代码的开始标记（正则，不区分大小写）
+        raw_end: 裸露代码的结束标记（取最后一次出现的位置）
+    """
+
+    def __init__(self, fence_langs, raw_start: str, raw_end: str):
+        self.fence_langs = set(fence_langs)
+        self.raw_end = raw_end
+        # 代码开始标记：代码块、裸露代码开头、补丁修改块
+        self.start_pattern = re.compile(
+            rf"```|{raw_start}|^<{{5,9}} ?SEARCH", re.IGNORECASE | re.MULTILINE
+        )
+
+
+HTML_FORMAT = CodeFormat({"html", "htm", "xml", ""}, r"<!doctype html|<html[\s>]", "</html>")
+UX_FORMAT = CodeFormat({"ux", "vue", "xml", "html", ""}, r"<template[\s>]", "</style>")
+
+
+class MalformedOutputError(Exception):
+    """模型输出明显异常，提前中止"""
+
+    def __init__(self, reason: str):
+        self.reason = reason
+        super().__init__(f"malformed LLM output: {reason}")
+
+
+class StreamCodeExtractor:
+    """增量代码提取器：feed()接收正文增量并返回新确认的代码增量，finish()返回最终代码"""
+
+    def __init__(
+        self,
+        patch_mode: bool = False,
+        prose_token_limit: Optional[int] = None,
+        repeat_line_limit: Optional[int] = None,
+        code_format: CodeFormat = HTML_FORMAT,
+    ):
+        self.patch_mode = patch_mode
+        self.code_format = code_format
+        self.prose_token_limit = prose_token_limit
+        self.repeat_line_limit = repeat_line_limit
+
+        # searching → fence / raw / patch；fence → done
+        self.state = "searching"
+        self.malformed: Optional[str] = None
+
+        self._buffer = ""
+        self._scan = 0                  # 下一次查找标记的起始位置
+        self._code_start: Optional[int] = None
+        self._code_end: Optional[int] = None
+        self._raw_end: Optional[int] = None   # raw模式下最后一个结束标记之后的位置
+        self._emitted = 0               # 已产出的代码截止位置
+        self._prose_tokens = 0
+
+        # 重复行检测
+        self._line_pos = 0
+        self._last_line: Optional[str] = None
+        self._repeats = 0
+
+    @classmethod
+    def for_stream(cls, patch_mode: bool = False, code_format: CodeFormat = HTML_FORMAT) -> "StreamCodeExtractor":
+        """按配置创建（未开启提前中止时只提取不判定）"""
+        if not settings.stream_abort_enabled:
+            return cls(patch_mode, code_format=code_format)
+        return cls(
+            patch_mode, settings.stream_abort_prose_tokens, settings.stream_abort_repeat_lines, code_format
+        )
+
+    @property
+    def code_started(self) -> bool:
+        return self.state != "searching"
+
+    def feed(self, delta: str) -> str:
+        """
+        接收一段正文增量
+
+        Returns:
+            新确认的代码增量（可能为空字符串）
+        """
+        if not delta:
+            return ""
+        self._buffer += delta
+
+        if self.state == "searching":
+            self._prose_tokens += estimate_tokens(delta)
+            self._find_start()
+            if self.state == "searching" and self.prose_token_limit and self._prose_tokens > self.prose_token_limit:
+                self.malformed = "no_code"
+
+        if self.state == "fence":
+            end = self._buffer.find(FENCE, self._scan)
+            if end == -1:
+                self._scan = max(self._code_start, len(self._buffer) - len(FENCE) + 1)
+            else:
+                self._code_end = end
+                self.state = "done"
+        elif self.state == "raw":
+            raw_end = self.code_format.raw_end
+            end = self._buffer.rfind(raw_end, self._scan)
+            if end != -1:
+                self._raw_end = end + len(raw_end)
+            self._scan = max(self._code_start, len(self._buffer) - len(raw_end) + 1)
+
+        if self.state in ("fence", "raw"):
+            self._check_repetition()
+        return self._emit()
+
+    def finish(self) -> Optional[str]:
+        """输出结束后返回提取到的代码，没有找到代码（或只有补丁修改块）时返回None"""
+        if self.state == "done":
+            return self._buffer[self._code_start:self._code_end].strip()
+        if self.state == "fence":
+            # 代码块没有闭合（通常是输出被截断）
+            return self._buffer[self._code_start:].strip()
+        if self.state == "raw":
+            end = self._raw_end if self._raw_end is not None else len(self._buffer)
+            return self._buffer[self._code_start:end].strip()
+        return None
+
+    def _find_start(self):
+        while True:
+            match = self.code_format.start_pattern.search(self._buffer, self._scan)
+            if match is None:
+                self._scan = max(self._scan, len(self._buffer) - _START_HOLDBACK)
+                return
+
+            marker = match.group(0)
+            if marker.startswith("<<<"):
+                if self.patch_mode:
+                    self.state = "patch"
+                    self._code_start = match.start()
+                    return
+                self._scan = match.end()
+                continue
+
+            if marker != FENCE:
+                self.state = "raw"
+                self._code_start = match.start()
+                self._scan = self._code_start
+                return
+
+            # 代码块：需要完整的语言标识行才能判断
+            line_end = self._buffer.find("\n", match.end())
+            if line_end == -1:
+                self._scan = match.start()
+                return
+            lang = self._buffer[match.end():line_end].strip().lower()
+            content_start = line_end + 1
+
+            if lang in self.code_format.fence_langs:
+                first = self._buffer[content_start:].lstrip()
+                if not first and lang == "":
+                    # 未标注语言且内容还没到达：等待更多输出
+                    self._scan = match.start()
+                    return
+                if lang or first.startswith("<"):
+                    self.state = "fence"
+                    self._code_start = content_start
+                    self._scan = content_start
+                    self._emitted = content_start
+                    return
+
+            # 其他语言的代码块：跳过整个代码块后继续查找
+            close = self._buffer.find(FENCE, content_start)
+            if close == -1:
+                self._scan = match.start()
+                return
+            self._scan = close + len(FENCE)
+
+    def _emit(self) -> str:
+        if self.state == "raw":
+            end = len(self._buffer)
+        elif self.state == "fence":
+            # 保留末尾可能是半个```的字符
+            end = len(self._buffer) - len(FENCE) + 1
+        elif self.state == "done":
+            end = self._code_end
+        else:
+            return ""
+        start = max(self._emitted, self._code_start)
+        if end <= start:
+            return ""
+        self._emitted = end
+        return self._buffer[start:end]
+
+    def _check_repetition(self):
+        if not self.repeat_line_limit:
+            return
+        end = self._buffer.rfind("\n")
+        start = max(self._line_pos, self._code_start)
+        if end <= start:
+            return
+        for line in self._buffer[start:end].split("\n"):
+            line = line.strip()
+            if not line:
+                continue
+            if line == self._last_line:
+                self._repeats += 1
+                if self._repeats >= self.repeat_line_limit:
+                    self.malformed = "repetition"
+                    break
+            else:
+                self._last_line = line
+                self._repeats = 0
+        self._line_pos = end + 1
+
+
+def extract_code(response_text: str, code_format: CodeFormat = HTML_FORMAT) -> str:
+    """一次性提取完整响应中的代码，找不到代码时返回去除首尾空白的全部内容"""
+    extractor = StreamCodeExtractor(code_format=code_format)
+    extractor.feed(response_text)
+    code = extractor.finish()
+    return code if code is not None else response_text.strip()
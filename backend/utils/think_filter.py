@@ -0,0 +1,65 @@
+"""
+思考过程分离 - 把模型写在正文中的 <think>…</think> 移出正文
+
+关闭reasoning_split时（如路由档位 reasoning=False），MiniMax-M2把思考过程直接写在content里。
+思考中的草稿代码/修改块不能被当作输出提取或应用，也不应保存进raw_content，因此在代码提取之前分离：
+- split_think：非流式的完整正文
+- ThinkSplitter：流式分块，标签被分块截断时暂存末尾的不完整标签
+"""
+
+from typing import List, Tuple
+
+
+THINK_OPEN = "<think>"
+THINK_CLOSE = "</think>"
+
+
+def _partial_tag_length(text: str, tag: str) -> int:
+    """text末尾与tag开头重合的最大长度（可能是被分块截断的标签）"""
+    for length in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:length]):
+            return length
+    return 0
+
+
+class ThinkSplitter:
+    """按分块把正文拆成(正文增量, 思考增量)"""
+
+    def __init__(self):
+        self._buffer = ""
+        self._inside = False
+
+    def feed(self, text: str) -> Tuple[str, str]:
+        """输入一个正文分块，返回(正文增量, 思考增量)"""
+        self._buffer += text
+        content: List[str] = []
+        reasoning: List[str] = []
+        while self._buffer:
+            tag = THINK_CLOSE if self._inside else THINK_OPEN
+            target = reasoning if self._inside else content
+            index = self._buffer.find(tag)
+            if index >= 0:
+                target.append(self._buffer[:index])
+                self._buffer = self._buffer[index + len(tag):]
+                self._inside = not self._inside
+                continue
+            keep = _partial_tag_length(self._buffer, tag)
+            target.append(self._buffer[:len(self._buffer) - keep])
+            self._buffer = self._buffer[len(self._buffer) - keep:]
+            break
+        return "".join(content), "".join(reasoning)
+
+    def flush(self) -> Tuple[str, str]:
+        """输出结束：暂存的内容按当前所在部分输出（未闭合的<think>全部视为思考过程）"""
+        remaining, self._buffer = self._buffer, ""
+        return ("", remaining) if self._inside else (remaining, "")
+
+
+def split_think(text: str) -> Tuple[str, str]:
+    """拆分完整正文，返回(去掉思考过程的正文, 思考过程)"""
+    if THINK_OPEN not in (text or ""):
+        return text or "", ""
+    splitter = ThinkSplitter()
+    content, reasoning = splitter.feed(text)
+    rest_content, rest_reasoning = splitter.flush()
+    return (content + rest_content).lstrip(), (reasoning + rest_reasoning).strip()
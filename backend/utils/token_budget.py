@@ -0,0 +1,227 @@
+"""
+Token预算 - 估算提示词token数，按预期输出大小设置max_tokens，并记录估算与实际用量
+
+估算采用字符启发式：中日韩字符约1 token/字，其余字符约3.5字符/token，每条消息另计少量开销。
+各类请求分别学习预期输出（不含思考过程）：
+    generation   新建表盘，学习输出token的指数移动平均
+    edit_full    完整代码编辑，学习“输出token / 当前代码token”的比例
+    edit_patch   补丁编辑，学习输出token的指数移动平均
+    summary      后台对话摘要，学习输出token的指数移动平均
+
+MiniMax-M2的completion_tokens和max_tokens上限都包含思考token（关闭reasoning_split时思考过程写在正文的
+<think>中，同样计入），因此各类请求另外学习思考token，max_tokens = (预期输出 + 预期思考) × 余量系数。
+被max_tokens截断时实际需求未知，不更新学习值，而是放大该类请求之后的max_tokens（可累积，正常结束后逐步回落）。
+"""
+
+import re
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+from config import settings
+from logging_config import get_logger
+
+logger = get_logger()
+
+
+_CJK_PATTERN = re.compile(r"[　-〿㐀-䶿一-鿿豈-﫿＀-￯]")
+
+# 每条消息的格式开销（role、分隔符等）
+_MESSAGE_OVERHEAD = 4
+
+# 各类请求的初始学习值（首个请求之前使用）
+_INITIAL_LEARNED = {
+    "generation": 6000.0,   # 输出token数
+    "edit_full": 1.3,       # 输出token / 当前代码token
+    "edit_patch": 1500.0,   # 输出token数
+    "summary": 600.0,       # 输出token数
+}
+
+# 每次正常结束后，截断放大倍数向1回落的比例
+_BOOST_DECAY = 0.8
+
+
+def estimate_tokens(text: str) -> int:
+    """估算一段文本的token数"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return int(cjk + (len(text) - cjk) / 3.5) + 1
+
+
+def estimate_messages_tokens(messages: List[Dict]) -> int:
+    """估算一组chat消息的token数"""
+    return sum(estimate_tokens(msg.get("content") or "") + _MESSAGE_OVERHEAD for msg in messages)
+
+
+class TokenBudget:
+    """自适应max_tokens与用量记录"""
+
+    def __init__(self, history_size: int = 200):
+        self._learned: Dict[str, float] = dict(_INITIAL_LEARNED)
+        self._reasoning: Dict[str, float] = {kind: float(settings.reasoning_token_allowance) for kind in _INITIAL_LEARNED}
+        self._boost: Dict[str, float] = {kind: 1.0 for kind in _INITIAL_LEARNED}
+        self._records: deque = deque(maxlen=history_size)
+
+        # 统计信息
+        self._counts: Dict[str, int] = {kind: 0 for kind in _INITIAL_LEARNED}
+        self._truncations: Dict[str, int] = {kind: 0 for kind in _INITIAL_LEARNED}
+
+    def plan(self, kind: str, messages: List[Dict], current_code: Optional[str] = None) -> Dict:
+        """
+        为一次LLM调用制定token预算
+
+        Args:
+            kind: generation / edit_full / edit_patch / summary
+            messages: 请求消息
+            current_code: 编辑场景的当前代码（edit_full按其大小估算输出）
+
+        Returns:
+            {"kind", "estimated_input", "estimated_output", "estimated_reasoning", "boost", "max_tokens", "code_tokens"}
+        """
+        estimated_input = estimate_messages_tokens(messages)
+        code_tokens = estimate_tokens(current_code) if current_code else 0
+
+        if kind == "edit_full":
+            estimated_output = int(code_tokens * self._learned[kind])
+        else:
+            estimated_output = int(self._learned[kind])
+        estimated_reasoning = int(self._reasoning[kind])
+        boost = self._boost[kind]
+
+        if settings.adaptive_max_tokens:
+            max_tokens = int((estimated_output + estimated_reasoning) * settings.output_token_headroom * boost)
+            max_tokens = max(settings.min_output_tokens, min(settings.max_output_tokens, max_tokens))
+        else:
+            max_tokens = settings.max_tokens
+
+        if estimated_input > settings.input_token_budget:
+            logger.warning(f"⚠️ 提示词预估 {estimated_input} tokens，超出输入预算 {settings.input_token_budget}")
+
+        return {
+            "kind": kind,
+            "estimated_input": estimated_input,
+            "estimated_output": estimated_output,
+            "estimated_reasoning": estimated_reasoning,
+            "boost": round(boost, 3),
+            "max_tokens": max_tokens,
+            "code_tokens": code_tokens,
+        }
+
+    def record(
+        self,
+        plan: Dict,
+        usage=None,
+        output_text: str = "",
+        finish_reason: Optional[str] = None,
+        reasoning_tokens: int = 0,
+    ):
+        """
+        记录一次调用的实际用量，并更新学习值
+
+        Args:
+            plan: plan()的返回值
+            usage: 响应中的usage（流式响应没有usage时为None，按输出文本估算）
+            output_text: 模型输出（含思考过程），usage缺失时用于估算
+            finish_reason: 结束原因，"length"表示被max_tokens截断
+            reasoning_tokens: 其中的思考token数（从输出token中扣除后学习输出，另外学习思考token）
+
+        Returns:
+            本次调用的用量记录（actual_input缺失时为None，actual_output缺失时为估算值）
+        """
+        kind = plan["kind"]
+        actual_input = getattr(usage, "prompt_tokens", None)
+        actual_output = getattr(usage, "completion_tokens", None)
+        output_source = "usage"
+        if actual_output is None:
+            actual_output = estimate_tokens(output_text)
+            output_source = "estimated"
+
+        actual_content = max(actual_output - reasoning_tokens, 0)
+
+        truncated = finish_reason == "length"
+        self._counts[kind] += 1
+        if truncated:
+            # 截断时不知道输出和思考各自需要多少：不学习，放大该类请求之后的max_tokens
+            self._truncations[kind] += 1
+            self._boost[kind] = min(self._boost[kind] * settings.truncation_boost, settings.truncation_boost_max)
+            logger.warning(
+                f"⚠️ {kind} 输出被max_tokens截断（max_tokens={plan['max_tokens']}，其中思考 {reasoning_tokens} tokens），"
+                f"之后的max_tokens放大 {self._boost[kind]:.2f} 倍"
+            )
+        else:
+            self._boost[kind] = max(1.0, self._boost[kind] * _BOOST_DECAY)
+            observed = actual_content
+            if kind == "edit_full":
+                observed = observed / plan["code_tokens"] if plan["code_tokens"] else None
+            alpha = settings.token_ema_alpha
+            if observed:
+                self._learned[kind] = (1 - alpha) * self._learned[kind] + alpha * observed
+            self._reasoning[kind] = (1 - alpha) * self._reasoning[kind] + alpha * reasoning_tokens
+
+        record = {
+            "timestamp": time.time(),
+            "kind": kind,
+            "estimated_input": plan["estimated_input"],
+            "actual_input": actual_input,
+            "estimated_output": plan["estimated_output"],
+            "actual_output": actual_output,
+            "actual_content": actual_content,
+            "estimated_reasoning": plan.get("estimated_reasoning", 0),
+            "actual_reasoning": reasoning_tokens,
+            "output_source": output_source,
+            "max_tokens": plan["max_tokens"],
+            "finish_reason": finish_reason,
+        }
+        self._records.append(record)
+        logger.info(
+            f"🧮 Token用量[{kind}]: 输入 预估{plan['estimated_input']}/实际{actual_input}, "
+            f"输出 预估{plan['estimated_output']}/实际{actual_content}({output_source}), "
+            f"思考 预估{plan.get('estimated_reasoning', 0)}/实际{reasoning_tokens}, "
+            f"max_tokens={plan['max_tokens']}{' ⚠️已截断' if truncated else ''}"
+        )
+        return record
+
+    def trim_history(self, history: List[Dict], available_tokens: int) -> List[Dict]:
+        """从最早的消息开始丢弃对话历史，直到能放进剩余的输入预算"""
+        trimmed = list(history)
+        while trimmed and estimate_messages_tokens(trimmed) > available_tokens:
+            trimmed.pop(0)
+        if len(trimmed) < len(history):
+            logger.info(f"✂️ 输入预算不足，丢弃 {len(history) - len(trimmed)} 条对话历史")
+        return trimmed
+
+    def get_stats(self) -> Dict:
+        """获取估算准确度统计"""
+        kinds = {}
+        for kind in _INITIAL_LEARNED:
+            records = [r for r in self._records if r["kind"] == kind]
+            input_errors = [
+                abs(r["estimated_input"] - r["actual_input"]) / r["actual_input"]
+                for r in records if r["actual_input"]
+            ]
+            output_errors = [
+                abs(r["estimated_output"] - r["actual_content"]) / r["actual_content"]
+                for r in records if r["actual_content"] and r["finish_reason"] != "length"
+            ]
+            kinds[kind] = {
+                "requests": self._counts[kind],
+                "truncations": self._truncations[kind],
+                "truncation_rate": round(self._truncations[kind] / self._counts[kind], 4) if self._counts[kind] else None,
+                "boost": round(self._boost[kind], 3),
+                "learned": round(self._learned[kind], 3),
+                "learned_reasoning": round(self._reasoning[kind], 1),
+                "input_error": round(sum(input_errors) / len(input_errors), 4) if input_errors else None,
+                "output_error": round(sum(output_errors) / len(output_errors), 4) if output_errors else None,
+            }
+
+        return {
+            "adaptive": settings.adaptive_max_tokens,
+            "input_token_budget": settings.input_token_budget,
+            "kinds": kinds,
+            "recent": list(self._records)[-20:],
+        }
+
+
+# 创建全局实例
+token_budget = TokenBudget()
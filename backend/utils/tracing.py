@@ -0,0 +1,370 @@
+"""
+请求级链路追踪 - 轻量span，按请求汇总后异步导出到本地JSON文件或OTLP兼容的收集器
+
+- 每个HTTP请求（或后台任务）一个trace，trace_id优先取W3C traceparent请求头，否则随机生成
+- 当前span保存在contextvar中，嵌套的 tracer.span() / @traced 自动挂到当前span下；
+  没有进行中的trace时 span() 是空操作，追踪关闭时几乎没有开销
+- 根span结束时整条trace放入有界队列，由后台线程写文件或POST到收集器，导出不在请求路径上
+
+导出格式：
+- file：每行一条trace的JSON（trace_id、根span名称、总耗时、spans列表，时间为相对trace开始的毫秒数），
+  可用 tools/trace_report.py 查看耗时分布
+- otlp：OTLP/HTTP JSON（resourceSpans），可发往OpenTelemetry Collector或 tools/trace_collector.py
+"""
+
+import functools
+import inspect
+import json
+import os
+import queue
+import random
+import threading
+import time
+from contextvars import ContextVar, Token
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from config import settings
+from logging_config import get_logger
+
+logger = get_logger()
+
+SERVICE_NAME = "watchface-backend"
+
+# 当前span
+_current_span: ContextVar[Optional["Span"]] = ContextVar("trace_span", default=None)
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[tuple]:
+    """解析W3C traceparent（00-<trace_id>-<parent_id>-<flags>），格式不对时返回None"""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32:
+        return None
+    return parts[1], parts[2]
+
+
+class _Trace:
+    """一条trace中已结束的span"""
+
+    __slots__ = ("trace_id", "spans")
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: List["Span"] = []
+
+
+class Span:
+    """一个计时区间；用作上下文管理器时成为当前span，退出时结束"""
+
+    __slots__ = (
+        "name", "span_id", "parent_id", "attributes", "status", "error",
+        "start_ns", "end_ns", "_trace", "_token", "_perf_start", "_is_root"
+    )
+
+    def __init__(self, name: str, trace: _Trace, parent_id: Optional[str], attributes: Dict, is_root: bool = False):
+        self.name = name
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.status = "ok"
+        self.error: Optional[str] = None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self._trace = trace
+        self._token: Optional[Token] = None
+        self._perf_start = time.perf_counter_ns()
+        self._is_root = is_root
+
+    @property
+    def trace_id(self) -> str:
+        return self._trace.trace_id
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException):
+        self.status = "error"
+        self.error = f"{type(error).__name__}: {error}"
+
+    def activate(self):
+        self._token = _current_span.set(self)
+
+    def deactivate(self):
+        if self._token is None:
+            return
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # 异步生成器在其他上下文中被关闭（如客户端断开后回收），无法恢复，忽略
+            pass
+        self._token = None
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        # 用单调时钟计算时长，避免系统时间调整
+        self.end_ns = self.start_ns + (time.perf_counter_ns() - self._perf_start)
+        self._trace.spans.append(self)
+        if self._is_root:
+            tracer._export(self._trace, self)
+
+    def __enter__(self) -> "Span":
+        self.activate()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None and not isinstance(exc, GeneratorExit):
+            self.record_error(exc)
+        self.deactivate()
+        self.end()
+        return False
+
+
+class _NoopSpan:
+    """未追踪时的空span"""
+
+    trace_id = None
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def record_error(self, error: BaseException):
+        pass
+
+    def activate(self):
+        pass
+
+    def deactivate(self):
+        pass
+
+    def end(self):
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """追踪器：创建trace/span，后台线程批量导出"""
+
+    def __init__(self):
+        self._queue: queue.Queue = queue.Queue(maxsize=settings.tracing_queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._http: Optional[httpx.Client] = None
+        self._stats = {"traces": 0, "spans": 0, "exported": 0, "dropped": 0, "export_errors": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return settings.tracing_exporter in ("file", "otlp")
+
+    @property
+    def file_path(self) -> Path:
+        if settings.tracing_file:
+            return Path(settings.tracing_file)
+        # storage模块本身使用@traced，这里延迟导入避免循环依赖
+        from .storage import STORAGE_ROOT
+        return STORAGE_ROOT / "traces" / "traces.jsonl"
+
+    def start_trace(self, name: str, traceparent: Optional[str] = None, **attributes):
+        """
+        开始一条trace，返回根span（需调用方结束；用作上下文管理器时自动结束）
+
+        追踪关闭或未被采样时返回空span。
+        """
+        if not self.enabled or random.random() >= settings.tracing_sample_rate:
+            return _NOOP_SPAN
+        parent = parse_traceparent(traceparent)
+        trace = _Trace(parent[0] if parent else _new_id(16))
+        self._stats["traces"] += 1
+        return Span(name, trace, parent[1] if parent else None, attributes, is_root=True)
+
+    def span(self, name: str, **attributes):
+        """在当前span下创建子span（没有进行中的trace时为空操作）"""
+        parent = _current_span.get()
+        if parent is None:
+            return _NOOP_SPAN
+        return Span(name, parent._trace, parent.span_id, attributes)
+
+    def current_span(self):
+        return _current_span.get() or _NOOP_SPAN
+
+    def get_stats(self) -> Dict:
+        return {
+            "exporter": settings.tracing_exporter,
+            "destination": str(self.file_path) if settings.tracing_exporter == "file" else settings.tracing_otlp_endpoint,
+            "sample_rate": settings.tracing_sample_rate,
+            "queued": self._queue.qsize(),
+            **self._stats,
+        }
+
+    def flush(self, timeout: float = 5.0):
+        """等待队列中的trace导出完成（用于关闭前和测试）"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    # ----- 导出 -----
+
+    def _export(self, trace: _Trace, root: Span):
+        self._stats["spans"] += len(trace.spans)
+        try:
+            self._queue.put_nowait((trace, root))
+        except queue.Full:
+            self._stats["dropped"] += 1
+            return
+        self._ensure_worker()
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name="trace-exporter", daemon=True)
+                self._thread.start()
+
+    def _worker(self):
+        while True:
+            batch = [self._queue.get()]
+            # 攒一小批再写，减少文件/网络操作次数
+            while len(batch) < 100:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                if settings.tracing_exporter == "otlp":
+                    self._post_otlp(batch)
+                else:
+                    self._write_file(batch)
+                self._stats["exported"] += len(batch)
+            except Exception as e:
+                self._stats["export_errors"] += 1
+                logger.warning(f"⚠️ 追踪数据导出失败: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_file(self, batch: List[tuple]):
+        path = self.file_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.exists() and path.stat().st_size > settings.tracing_file_max_bytes:
+            # 超过大小上限：保留一个旧文件
+            os.replace(path, path.with_name(path.name + ".1"))
+        with path.open("a", encoding="utf-8") as f:
+            for trace, root in batch:
+                f.write(json.dumps(trace_to_dict(trace, root), ensure_ascii=False, default=str) + "\n")
+
+    def _post_otlp(self, batch: List[tuple]):
+        if self._http is None:
+            self._http = httpx.Client(timeout=5.0)
+        spans = [span for trace, _ in batch for span in trace.spans]
+        response = self._http.post(settings.tracing_otlp_endpoint, json=to_otlp(spans))
+        response.raise_for_status()
+
+
+def trace_to_dict(trace: _Trace, root: Span) -> Dict:
+    """trace的本地JSON格式（时间为相对根span开始的毫秒数）"""
+    spans = sorted(trace.spans, key=lambda span: span.start_ns)
+    return {
+        "trace_id": trace.trace_id,
+        "name": root.name,
+        "start": root.start_ns / 1e9,
+        "duration_ms": round((root.end_ns - root.start_ns) / 1e6, 3),
+        "status": root.status,
+        "attributes": root.attributes,
+        "spans": [
+            {
+                "span_id": span.span_id,
+                "parent_id": span.parent_id,
+                "name": span.name,
+                "offset_ms": round((span.start_ns - root.start_ns) / 1e6, 3),
+                "duration_ms": round((span.end_ns - span.start_ns) / 1e6, 3),
+                "status": span.status,
+                "error": span.error,
+                "attributes": span.attributes,
+            }
+            for span in spans
+        ],
+    }
+
+
+def _otlp_value(value: Any) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans: List[Span]) -> Dict:
+    """转换为OTLP/HTTP JSON请求体"""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{
+                "scope": {"name": "watchface_backend"},
+                "spans": [
+                    {
+                        "traceId": span.trace_id,
+                        "spanId": span.span_id,
+                        "parentSpanId": span.parent_id or "",
+                        "name": span.name,
+                        # 2=SERVER（请求根span），1=INTERNAL
+                        "kind": 2 if span._is_root else 1,
+                        "startTimeUnixNano": str(span.start_ns),
+                        "endTimeUnixNano": str(span.end_ns),
+                        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+                        "status": {"code": 2, "message": span.error} if span.status == "error" else {"code": 1},
+                    }
+                    for span in spans
+                ],
+            }],
+        }]
+    }
+
+
+def traced(name: Optional[str] = None):
+    """把函数调用记录为当前trace下的一个span（支持同步和异步函数）"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# 创建全局实例
+tracer = Tracer()
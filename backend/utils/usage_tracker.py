@@ -0,0 +1,426 @@
+"""
+Token用量统计 - 按客户端、API Key和项目记录每次请求的token用量与耗时，并按天汇总
+
+- 逐条记录追加写入 storage/usage/records/YYYY-MM-DD.jsonl，保留 usage_record_retention_days 天
+- 每日汇总写入 storage/usage/daily/YYYY-MM-DD.json：全天合计，以及按客户端（含各请求类型）、项目、模型分组的合计
+- 查询只读取每日汇总，已结束日期的汇总读取后常驻内存，查询数月的数据也只涉及每天一个小文件
+- record() 只更新内存中的增量，由后台任务按 usage_flush_interval 批量写盘，磁盘读写不在请求路径上
+
+code_agent在结果中附带的usage字典：
+    prompt_tokens / completion_tokens / reasoning_tokens  响应中没有usage时为估算值（estimated为True）
+    llm_latency  LLM调用耗时（秒，回退/重试的多次调用累加）
+    calls        LLM调用次数（命中生成缓存时为0）
+    cached       是否命中生成缓存
+    estimated    是否包含估算值
+"""
+
+import asyncio
+import json
+import threading
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from config import settings
+from logging_config import get_logger, get_request_id
+from .metrics import endpoint_var
+from .storage import STORAGE_ROOT
+
+logger = get_logger()
+
+
+# 用量目录
+USAGE_DIR = STORAGE_ROOT / "usage"
+
+# 汇总中累加的字段
+_COUNTER_FIELDS = (
+    "requests", "cached", "estimated", "llm_calls",
+    "prompt_tokens", "completion_tokens", "reasoning_tokens", "total_tokens",
+    "llm_latency", "queue_wait",
+)
+
+
+def empty_usage(cached: bool = False) -> Dict:
+    """没有发生LLM调用时的用量（如命中生成缓存）"""
+    return {
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "reasoning_tokens": 0,
+        "llm_latency": 0.0,
+        "calls": 0,
+        "cached": cached,
+        "estimated": False,
+    }
+
+
+def merge_usage(first: Optional[Dict], second: Optional[Dict]) -> Optional[Dict]:
+    """合并同一请求中多次调用的用量（如补丁失败后回退到完整代码重新生成）"""
+    if not first:
+        return second
+    if not second:
+        return first
+    return {
+        "prompt_tokens": first["prompt_tokens"] + second["prompt_tokens"],
+        "completion_tokens": first["completion_tokens"] + second["completion_tokens"],
+        "reasoning_tokens": first["reasoning_tokens"] + second["reasoning_tokens"],
+        "llm_latency": first["llm_latency"] + second["llm_latency"],
+        "calls": first["calls"] + second["calls"],
+        "cached": first["cached"] and second["cached"],
+        "estimated": first["estimated"] or second["estimated"],
+    }
+
+
+def _new_counters() -> Dict:
+    return dict.fromkeys(_COUNTER_FIELDS, 0)
+
+
+def _add_counters(counters: Dict, values: Dict):
+    for field in _COUNTER_FIELDS:
+        counters[field] = counters.get(field, 0) + values.get(field, 0)
+
+
+def _record_counters(record: Dict) -> Dict:
+    """单条记录对应的计数增量"""
+    return {
+        "requests": 1,
+        "cached": int(record["cached"]),
+        "estimated": int(record["estimated"]),
+        "llm_calls": record["calls"],
+        "prompt_tokens": record["prompt_tokens"],
+        "completion_tokens": record["completion_tokens"],
+        "reasoning_tokens": record["reasoning_tokens"],
+        "total_tokens": record["prompt_tokens"] + record["completion_tokens"],
+        "llm_latency": record["llm_latency"],
+        "queue_wait": record["queue_wait"],
+    }
+
+
+def _new_rollup(day: str) -> Dict:
+    return {"date": day, "totals": _new_counters(), "by_client": {}, "by_project": {}, "by_model": {}}
+
+
+def _add_to_rollup(rollup: Dict, record: Dict):
+    counters = _record_counters(record)
+    _add_counters(rollup["totals"], counters)
+
+    client = rollup["by_client"].setdefault(
+        record["client_id"], {**_new_counters(), "by_kind": {}, "api_key_hashes": []}
+    )
+    _add_counters(client, counters)
+    _add_counters(client["by_kind"].setdefault(record["kind"], _new_counters()), counters)
+    if record["api_key_hash"] not in client["api_key_hashes"]:
+        client["api_key_hashes"].append(record["api_key_hash"])
+
+    project = rollup["by_project"].setdefault(
+        record["project_id"], {**_new_counters(), "client_id": record["client_id"]}
+    )
+    _add_counters(project, counters)
+    _add_counters(rollup["by_model"].setdefault(record["model"], _new_counters()), counters)
+
+
+def _merge_rollup(target: Dict, delta: Dict):
+    """把增量汇总合并到目标汇总"""
+    _add_counters(target["totals"], delta["totals"])
+    for client_id, values in delta["by_client"].items():
+        client = target["by_client"].setdefault(
+            client_id, {**_new_counters(), "by_kind": {}, "api_key_hashes": []}
+        )
+        _add_counters(client, values)
+        for kind, kind_values in values["by_kind"].items():
+            _add_counters(client["by_kind"].setdefault(kind, _new_counters()), kind_values)
+        for key_hash in values["api_key_hashes"]:
+            if key_hash not in client["api_key_hashes"]:
+                client["api_key_hashes"].append(key_hash)
+    for project_id, values in delta["by_project"].items():
+        project = target["by_project"].setdefault(
+            project_id, {**_new_counters(), "client_id": values["client_id"]}
+        )
+        _add_counters(project, values)
+    for model, values in delta["by_model"].items():
+        _add_counters(target["by_model"].setdefault(model, _new_counters()), values)
+
+
+def _with_averages(counters: Dict) -> Dict:
+    """附加每次请求的平均token数和平均LLM耗时"""
+    requests = counters.get("requests", 0)
+    result = {
+        field: round(value, 3) if isinstance(value, float) else value
+        for field, value in counters.items()
+        if field not in ("by_kind", "api_key_hashes")
+    }
+    result["avg_tokens_per_request"] = round(counters.get("total_tokens", 0) / requests, 1) if requests else 0
+    result["avg_llm_latency"] = round(counters.get("llm_latency", 0) / requests, 3) if requests else 0
+    return result
+
+
+class UsageTracker:
+    """按客户端/API Key/项目记录token用量，逐条记录与每日汇总分别落盘"""
+
+    def __init__(self, usage_dir: Path = USAGE_DIR):
+        self.usage_dir = usage_dir
+        self.records_dir = usage_dir / "records"
+        self.daily_dir = usage_dir / "daily"
+        self.records_dir.mkdir(parents=True, exist_ok=True)
+        self.daily_dir.mkdir(parents=True, exist_ok=True)
+
+        # 尚未写盘的逐条记录和按日期的增量汇总
+        self._pending_records: List[Dict] = []
+        self._pending_rollups: Dict[str, Dict] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        # 已结束日期的每日汇总（不再变化）
+        self._daily_cache: Dict[str, Dict] = {}
+        self._cache_lock = threading.Lock()
+        self._last_cleanup: Optional[str] = None
+
+        # 统计信息
+        self._recorded = 0
+        self._flushes = 0
+        self._flush_errors = 0
+
+    def record(
+        self,
+        kind: str,
+        client_id: str,
+        api_key_hash: str,
+        project_id: str,
+        model: str,
+        usage: Dict,
+        queue_wait: float = 0.0,
+        success: bool = True
+    ):
+        """
+        记录一次请求的token用量（只更新内存，批量写盘）
+
+        Args:
+            kind: 请求类型（generate / edit）
+            client_id: 客户端ID（未提供时为default）
+            api_key_hash: 实际使用的API Key的hash（默认Key时为default）
+            project_id: 项目ID
+            model: 模型名称
+            usage: code_agent结果中的usage字典
+            queue_wait: 调度排队等待时间（秒）
+            success: 请求是否成功
+        """
+        if not settings.usage_tracking_enabled:
+            return
+
+        now = datetime.now()
+        record = {
+            "timestamp": now.isoformat(timespec="milliseconds"),
+            "request_id": get_request_id(),
+            "endpoint": endpoint_var.get(),
+            "kind": kind,
+            "model": model,
+            "client_id": client_id,
+            "api_key_hash": api_key_hash[:16],
+            "project_id": project_id,
+            "success": success,
+            "prompt_tokens": usage["prompt_tokens"],
+            "completion_tokens": usage["completion_tokens"],
+            "reasoning_tokens": usage["reasoning_tokens"],
+            "llm_latency": round(usage["llm_latency"], 3),
+            "queue_wait": round(queue_wait, 3),
+            "calls": usage["calls"],
+            "cached": usage["cached"],
+            "estimated": usage["estimated"],
+        }
+        day = now.date().isoformat()
+        self._pending_records.append(record)
+        _add_to_rollup(self._pending_rollups.setdefault(day, _new_rollup(day)), record)
+        self._recorded += 1
+
+        logger.info(
+            f"💰 Token用量[{kind}]: 输入 {record['prompt_tokens']}, 输出 {record['completion_tokens']}, "
+            f"思考 {record['reasoning_tokens']}{'（估算）' if record['estimated'] else ''}, "
+            f"LLM耗时 {record['llm_latency']:.2f}s",
+            extra={"fields": {"client_id": client_id, "project_id": project_id, "calls": record["calls"]}}
+        )
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._flush_task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(settings.usage_flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """把待写入的记录和增量汇总写盘（关闭前和定时调用）"""
+        async with self._flush_lock:
+            records, rollups = self._pending_records, self._pending_rollups
+            if not records:
+                return
+            self._pending_records, self._pending_rollups = [], {}
+            try:
+                await asyncio.to_thread(self._write, records, rollups)
+                self._flushes += 1
+            except Exception as e:
+                # 写盘失败：放回待写入队列，下次再试
+                self._flush_errors += 1
+                logger.error(f"❌ 用量记录写盘失败: {e}")
+                self._pending_records = records + self._pending_records
+                for day, delta in rollups.items():
+                    _merge_rollup(self._pending_rollups.setdefault(day, _new_rollup(day)), delta)
+                self._schedule_flush()
+
+    def _write(self, records: List[Dict], rollups: Dict[str, Dict]):
+        by_day: Dict[str, List[Dict]] = {}
+        for record in records:
+            by_day.setdefault(record["timestamp"][:10], []).append(record)
+        for day, day_records in by_day.items():
+            with (self.records_dir / f"{day}.jsonl").open("a", encoding="utf-8") as f:
+                for record in day_records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+        for day, delta in rollups.items():
+            rollup = self._read_daily(day) or _new_rollup(day)
+            _merge_rollup(rollup, delta)
+            path = self.daily_dir / f"{day}.json"
+            tmp_path = path.with_name(f"{day}.{threading.get_ident()}.tmp")
+            with tmp_path.open("w", encoding="utf-8") as f:
+                json.dump(rollup, f, ensure_ascii=False)
+            tmp_path.replace(path)
+            with self._cache_lock:
+                self._daily_cache.pop(day, None)
+
+        self._cleanup_records()
+
+    def _read_daily(self, day: str) -> Optional[Dict]:
+        path = self.daily_dir / f"{day}.json"
+        if not path.exists():
+            return None
+        with path.open("r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _cleanup_records(self):
+        """删除超过保留天数的逐条记录（每天检查一次）"""
+        today = date.today().isoformat()
+        if self._last_cleanup == today:
+            return
+        self._last_cleanup = today
+        cutoff = (date.today() - timedelta(days=settings.usage_record_retention_days)).isoformat()
+        for path in self.records_dir.glob("*.jsonl"):
+            if path.stem < cutoff:
+                path.unlink(missing_ok=True)
+
+    def _load_days(self, days: List[str]) -> Dict[str, Dict]:
+        """读取每日汇总；今天之前的日期读取后缓存"""
+        today = date.today().isoformat()
+        rollups = {}
+        for day in days:
+            with self._cache_lock:
+                rollup = self._daily_cache.get(day)
+            if rollup is None:
+                rollup = self._read_daily(day)
+                if rollup is not None and day < today:
+                    with self._cache_lock:
+                        self._daily_cache[day] = rollup
+            if rollup is not None:
+                rollups[day] = rollup
+        return rollups
+
+    async def query(
+        self,
+        start: date,
+        end: date,
+        client_id: Optional[str] = None,
+        project_id: Optional[str] = None
+    ) -> Dict:
+        """
+        按天汇总指定日期范围内的用量
+
+        Args:
+            start / end: 日期范围（含两端）
+            client_id: 只统计该客户端
+            project_id: 只统计该项目
+
+        Returns:
+            days（每天一条）、totals（范围合计），未指定过滤条件时附带 top_clients / top_projects 排行
+        """
+        days = [(start + timedelta(days=offset)).isoformat() for offset in range((end - start).days + 1)]
+        stored = await asyncio.to_thread(self._load_days, days)
+
+        # 合并尚未写盘的增量（不修改缓存中的汇总）
+        rollups = {}
+        for day in days:
+            rollup = _new_rollup(day)
+            if day in stored:
+                _merge_rollup(rollup, stored[day])
+            if day in self._pending_rollups:
+                _merge_rollup(rollup, self._pending_rollups[day])
+            rollups[day] = rollup
+
+        totals = _new_counters()
+        clients: Dict[str, Dict] = {}
+        projects: Dict[str, Dict] = {}
+        rows = []
+        for day in days:
+            rollup = rollups[day]
+            if project_id:
+                counters = rollup["by_project"].get(project_id, _new_counters())
+            elif client_id:
+                counters = rollup["by_client"].get(client_id, _new_counters())
+            else:
+                counters = rollup["totals"]
+            _add_counters(totals, counters)
+            rows.append({"date": day, **_with_averages(counters)})
+
+            for cid, values in rollup["by_client"].items():
+                if client_id and cid != client_id:
+                    continue
+                client = clients.setdefault(cid, {**_new_counters(), "by_kind": {}})
+                _add_counters(client, values)
+                for kind, kind_values in values["by_kind"].items():
+                    _add_counters(client["by_kind"].setdefault(kind, _new_counters()), kind_values)
+            for pid, values in rollup["by_project"].items():
+                if (project_id and pid != project_id) or (client_id and values["client_id"] != client_id):
+                    continue
+                project = projects.setdefault(pid, {**_new_counters(), "client_id": values["client_id"]})
+                _add_counters(project, values)
+
+        top_n = settings.usage_top_n
+        top_clients = sorted(clients.items(), key=lambda item: -item[1]["total_tokens"])[:top_n]
+        top_projects = sorted(projects.items(), key=lambda item: -item[1]["total_tokens"])[:top_n]
+        return {
+            "start": days[0],
+            "end": days[-1],
+            "client_id": client_id,
+            "project_id": project_id,
+            "totals": _with_averages(totals),
+            "days": rows,
+            "top_clients": [
+                {
+                    "client_id": cid,
+                    **_with_averages(values),
+                    "by_kind": {kind: _with_averages(kind_values) for kind, kind_values in values["by_kind"].items()},
+                }
+                for cid, values in top_clients
+            ],
+            "top_projects": [{"project_id": pid, **_with_averages(values)} for pid, values in top_projects],
+        }
+
+    def get_stats(self) -> Dict:
+        today = date.today().isoformat()
+        pending_today = self._pending_rollups.get(today)
+        return {
+            "enabled": settings.usage_tracking_enabled,
+            "usage_dir": str(self.usage_dir),
+            "recorded": self._recorded,
+            "pending_records": len(self._pending_records),
+            "flushes": self._flushes,
+            "flush_errors": self._flush_errors,
+            "cached_days": len(self._daily_cache),
+            "pending_today": _with_averages(pending_today["totals"]) if pending_today else None,
+        }
+
+
+# 创建全局实例
+usage_tracker = UsageTracker()